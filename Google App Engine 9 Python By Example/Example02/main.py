@@ -1,14 +1,22 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+import static_assets
+import template_cache
 
 # define the app that will contain all of our routing for Fast API
 app = FastAPI()
 
 # define the static and templates directories
-app.mount('/static', StaticFiles(directory='static'), name='static')
-templates = Jinja2Templates(directory='templates')
+# the static files are served with hashed names, compressed copies and long lived caching. the url_for in the templates
+# links to the hashed names
+static_files = static_assets.StaticAssets(directory='static')
+app.mount('/static', static_files, name='static')
+templates = template_cache.createTemplates()
+templates.env.globals['url_for'] = static_files.urlFor(templates.env.globals['url_for'])
+
+# compile the templates when the app starts so the first request does not have to. with auto reload off on app engine
+# the compiled templates are then used for the life of the instance
+app.add_event_handler('startup', lambda: template_cache.precompile(templates))
 
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -1,19 +1,29 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-import google.oauth2.id_token
-from google.auth.transport import requests
+import firebase_auth
+import static_assets
+import template_cache
 
 # define the app that will contain all of our routing for FastAPI
 app = FastAPI()
 
-# we need a request object to be able to talk to firebase for verifying user logins
-firebase_request_adapter = requests.Request()
+# shared verifier that keeps the firebase signing certificates in memory so we can check user logins without
+# going out to the network on every request. the certificates are refreshed in the background once the app starts
+firebase_verifier = firebase_auth.FirebaseTokenVerifier()
+app.add_event_handler('startup', firebase_verifier.start)
+app.add_event_handler('shutdown', firebase_verifier.stop)
 
 # define the static and template directories
-app.mount('/static', StaticFiles(directory='static'), name='static')
-templates = Jinja2Templates(directory='templates')
+# the static files are served with hashed names, compressed copies and long lived caching. the url_for in the templates
+# links to the hashed names
+static_files = static_assets.StaticAssets(directory='static')
+app.mount('/static', static_files, name='static')
+templates = template_cache.createTemplates()
+templates.env.globals['url_for'] = static_files.urlFor(templates.env.globals['url_for'])
+
+# compile the templates when the app starts so the first request does not have to. with auto reload off on app engine
+# the compiled templates are then used for the life of the instance
+app.add_event_handler('startup', lambda: template_cache.precompile(templates))
 
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -27,7 +37,7 @@ async def root(request: Request):
     # if we have an id_token, we will verify it against firebase. If it does not checkout then log the error message that is returned
     if id_token:
         try:
-            user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+            user_token = firebase_verifier.verify(id_token)
         except ValueError as err:
             # dump this message to console as it will not be displayed on the template. use for debugging, if you are building for
             # production you should handle this much more gracefully
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+import jinja2
+from fastapi.templating import Jinja2Templates
+
+# folder the compiled templates are kept in. running this file before a deploy fills it so a cold instance can load
+# the compiled templates instead of compiling them. if it is not there we fall back to a folder in the temp directory,
+# which at least saves the compile for every instance after the first on the same machine
+BYTECODE_DIRECTORY = 'template_bytecode'
+
+# templates are only checked for changes on disk when we are not running on app engine
+AUTO_RELOAD = 'GAE_ENV' not in os.environ
+
+
+# bytecode cache that carries on without caching if it can not write, as the app folder is read only on app engine
+class BytecodeCache(jinja2.FileSystemBytecodeCache):
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+# make the templates for an app. every template is compiled through the bytecode cache and kept in the environment, and
+# async environments get their own folder as their compiled code is different
+def createTemplates(directory='templates', enable_async=False):
+    bytecode_directory = BYTECODE_DIRECTORY
+    if not os.path.isdir(bytecode_directory):
+        bytecode_directory = os.path.join(tempfile.gettempdir(), 'jinja-bytecode-' + os.path.basename(os.getcwd()))
+    bytecode_directory = os.path.join(bytecode_directory, 'async' if enable_async else 'sync')
+    try:
+        os.makedirs(bytecode_directory, exist_ok=True)
+        bytecode_cache = BytecodeCache(bytecode_directory)
+    except OSError:
+        bytecode_cache = None
+
+    return Jinja2Templates(
+        directory=directory,
+        auto_reload=AUTO_RELOAD,
+        bytecode_cache=bytecode_cache,
+        cache_size=-1,
+        enable_async=enable_async,
+    )
+
+
+# compile every template now rather than on the first request that uses it. add this as a startup handler
+def precompile(templates):
+    for name in templates.env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        templates.env.get_template(name)
+
+
+# fill the bytecode folder before a deploy with: python template_cache.py
+if __name__ == '__main__':
+    os.makedirs(BYTECODE_DIRECTORY, exist_ok=True)
+    for enable_async in (False, True):
+        precompile(createTemplates(enable_async=enable_async))
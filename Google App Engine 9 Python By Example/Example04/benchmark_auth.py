@@ -0,0 +1,79 @@
+# micro benchmark for the login dependency. it builds two small apps with the same route, one checking the login inline
+# the way the routes used to and one using the requireLogin dependency, and times requests to both through the ASGI
+# interface so no network or server is involved. token checks and user reads are stand ins that take no time, so the
+# difference is the cost of the dependency itself
+import asyncio
+import time
+
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import RedirectResponse
+from typing import Union
+import httpx
+
+import request_auth
+
+REQUESTS = 20000
+
+
+def validateFirebaseToken(id_token):
+    return {'user_id': 'benchmark', 'email': 'benchmark@example.com'} if id_token else None
+
+
+class Users:
+    async def getOrCreate(self, user_id):
+        return {'name': 'John Doe'}
+
+
+async def getUserRepository():
+    return Users()
+
+
+async def getUserToken(request: Request):
+    return validateFirebaseToken(request.cookies.get("token"))
+
+
+async def requireLogin(user_token: Union[dict, None] = Depends(getUserToken), users: Users = Depends(getUserRepository)):
+    if not user_token:
+        raise request_auth.LoginRequired()
+    return request_auth.Login(user_token, users)
+
+
+inline_app = FastAPI()
+
+
+@inline_app.get('/user')
+async def inlineUser(request: Request, users: Users = Depends(getUserRepository)):
+    id_token = request.cookies.get("token")
+    user_token = validateFirebaseToken(id_token)
+    if not user_token:
+        return RedirectResponse("/")
+    user = await users.getOrCreate(user_token['user_id'])
+    return user
+
+
+dependency_app = FastAPI()
+dependency_app.add_exception_handler(request_auth.LoginRequired, request_auth.redirectToLogin)
+
+
+@dependency_app.get('/user')
+async def dependencyUser(request: Request, login: request_auth.Login = Depends(requireLogin)):
+    return await login.user()
+
+
+async def run(app, cookies):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://benchmark', cookies=cookies) as client:
+        start = time.perf_counter()
+        for i in range(REQUESTS):
+            await client.get('/user')
+        return 1e6 * (time.perf_counter() - start) / REQUESTS
+
+
+async def main():
+    for name, cookies in (('logged in', {'token': 'token'}), ('logged out', {})):
+        inline = await run(inline_app, cookies)
+        dependency = await run(dependency_app, cookies)
+        print('{:10}  inline: {:.1f}us/request  dependency: {:.1f}us/request  overhead: {:+.1f}us'.format(name, inline, dependency, dependency - inline))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import google.auth.exceptions
+import google.auth.jwt
+from google.auth.transport import requests
+
+# this is where firebase publishes the public certificates that it signs user ID tokens with
+FIREBASE_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+
+
+# verifier for firebase ID tokens that does not touch the network on the request path. the signing certificates are kept
+# in memory and refreshed on a background thread according to the Cache-Control max-age that google sends with them.
+# tokens that have already been verified are kept in a bounded LRU cache keyed by the hash of the token until they expire
+class FirebaseTokenVerifier:
+    def __init__(self, max_cached_tokens=10000, min_refresh_seconds=60, certs_url=FIREBASE_CERTS_URL):
+        self.max_cached_tokens = max_cached_tokens
+        self.min_refresh_seconds = min_refresh_seconds
+        self.certs_url = certs_url
+
+        # the request adapter is only ever used from the refresh thread or the very first cold fetch
+        self.request_adapter = requests.Request()
+
+        # the current certificates and the cache of verified tokens. both are guarded by the lock as the refresh
+        # thread and the worker threads will touch them at the same time
+        self.lock = threading.Lock()
+        self.certs = None
+        self.tokens = OrderedDict()
+        self.timer = None
+
+    # start the background refresh. this will fetch the certificates straight away on the refresh thread so the first
+    # request to come in does not have to wait for them
+    def start(self):
+        self.scheduleRefresh(0)
+
+    # stop the background refresh, used when the app is shutting down
+    def stop(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+    def scheduleRefresh(self, delay):
+        timer = threading.Timer(delay, self.refreshCerts)
+        timer.daemon = True
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            self.timer = timer
+        timer.start()
+
+    # fetch the certificates and schedule the next refresh for when google says they will go stale. if the fetch fails
+    # we keep the certificates we already have, as google rotates its keys with plenty of overlap, and try again soon
+    def refreshCerts(self):
+        try:
+            self.fetchCerts()
+        except (google.auth.exceptions.TransportError, ValueError) as err:
+            print(str(err))
+            self.scheduleRefresh(self.min_refresh_seconds)
+
+    def fetchCerts(self):
+        response = self.request_adapter(self.certs_url, method='GET')
+        if response.status != 200:
+            raise google.auth.exceptions.TransportError('Could not fetch certificates at {}'.format(self.certs_url))
+        certs = json.loads(response.data.decode('utf-8'))
+
+        # pull the max-age out of the Cache-Control header. refresh a little before that so we never hold stale keys
+        max_age = self.min_refresh_seconds
+        match = re.search(r'max-age=(\d+)', response.headers.get('cache-control', ''))
+        if match:
+            max_age = max(int(match.group(1)) * 0.9, self.min_refresh_seconds)
+
+        with self.lock:
+            self.certs = certs
+        self.scheduleRefresh(max_age)
+        return certs
+
+    # verify a firebase ID token and return its claims. this raises a ValueError if the token is not valid in the same way
+    # that google.oauth2.id_token.verify_firebase_token does
+    def verify(self, id_token):
+        key = hashlib.sha256(id_token.encode('utf-8')).digest()
+        now = time.time()
+
+        # if we have seen this token before and it has not expired yet then we can skip the signature check
+        with self.lock:
+            cached = self.tokens.get(key)
+            if cached and cached['exp'] > now:
+                self.tokens.move_to_end(key)
+                return cached
+            if cached:
+                del self.tokens[key]
+            certs = self.certs
+
+        # only the very first request on a cold instance will have to fetch the certificates itself
+        if certs is None:
+            certs = self.fetchCerts()
+
+        # check the signature locally against the certificates we have in memory
+        user_token = google.auth.jwt.decode(id_token, certs=certs)
+
+        # remember the verified token until it expires, dropping the least recently used token if we are full
+        with self.lock:
+            self.tokens[key] = user_token
+            while len(self.tokens) > self.max_cached_tokens:
+                self.tokens.popitem(last=False)
+
+        return user_token
@@ -0,0 +1,240 @@
+import asyncio
+import collections
+import inspect
+import os
+import sys
+import threading
+import time
+
+from fastapi import Depends, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+# profiling is off unless ENABLE_PROFILER=1 is set, and then only the logins with an email in PROFILER_ADMINS (a comma
+# separated list) can use it. with it off the routes are not added at all
+ENABLED = os.environ.get('ENABLE_PROFILER', '0') == '1'
+ADMINS = {email.strip().lower() for email in os.environ.get('PROFILER_ADMINS', '').split(',') if email.strip()}
+
+# the event loop counts as blocked when it has not run for this long. the stack of whatever was running on it at the
+# time is kept with the block
+LOOP_BLOCK_SECONDS = float(os.environ.get('LOOP_BLOCK_MS', 100)) / 1000
+
+# the longest profile that can be asked for and the shortest gap between samples. below the interpreter's switch
+# interval of 5ms the sampler can not get the GIL often enough to keep up anyway
+MAX_SECONDS = 60
+MIN_INTERVAL = 0.005
+
+# python frames a thread is in when it is waiting for work rather than doing any. the event loop waiting in select and
+# the thread pool workers waiting on their queue are left out of a profile unless idle stacks are asked for. uvloop,
+# which uvicorn[standard] runs on, waits in C with no frame of its own, so its idle stack is found by loopBase instead
+IDLE_FRAMES = {('selectors.py', 'select'), ('threading.py', 'wait'), ('queue.py', 'get'), ('threading.py', '_wait_for_tstate_lock')}
+
+
+def isAdmin(user_token):
+    return bool(user_token) and (user_token.get('email') or '').lower() in ADMINS
+
+
+STANDARD_LIBRARY = os.path.dirname(os.__file__) + os.sep
+
+
+# a file name short enough to read in a flame graph, relative to site-packages, the standard library or the app folder
+def shortPath(filename):
+    marker = 'site-packages' + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    for directory in (STANDARD_LIBRARY, os.getcwd() + os.sep):
+        if filename.startswith(directory):
+            return filename[len(directory):]
+    return filename
+
+
+# the frames of a stack from the outermost call in, as (function, file, first line of the function). the first line is
+# used rather than the current line so every sample in a function lands on the same frame
+def stackOf(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, shortPath(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def frameName(frame):
+    return '{} ({}:{})'.format(*frame)
+
+
+def isIdle(stack):
+    return bool(stack) and (os.path.basename(stack[-1][1]), stack[-1][0]) in IDLE_FRAMES
+
+
+# the frames under the coroutines of the event loop thread, taken from a coroutine running on it. an idle uvloop shows
+# just these (asyncio's runners.py run and what called it), since the loop itself has no python frames
+def loopBase(frame):
+    while frame is not None and not frame.f_code.co_flags & inspect.CO_COROUTINE:
+        frame = frame.f_back
+    while frame is not None and frame.f_code.co_flags & inspect.CO_COROUTINE:
+        frame = frame.f_back
+    return stackOf(frame)
+
+
+# the samples of one profile, counted by thread name and stack
+class Profile:
+    def __init__(self, counts, interval, seconds, samples):
+        self.counts = counts
+        self.interval = interval
+        self.seconds = seconds
+        self.samples = samples
+
+    # the collapsed stack format flamegraph.pl, inferno and speedscope all read: one line per stack with the frames
+    # from the thread down to the leaf separated by ; and then the number of samples
+    def collapsed(self):
+        lines = []
+        for (thread, stack), count in self.counts.most_common():
+            lines.append('{} {}'.format(';'.join([thread] + [frameName(frame) for frame in stack]), count))
+        return '\n'.join(lines) + '\n'
+
+    # the speedscope file format with a sampled profile for each thread
+    def speedscope(self):
+        frames = []
+        frame_index = {}
+        profiles = {}
+        for (thread, stack), count in self.counts.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                indexes.append(frame_index[frame])
+            profile = profiles.setdefault(thread, {
+                'type': 'sampled', 'name': thread, 'unit': 'seconds', 'startValue': 0, 'endValue': self.seconds,
+                'samples': [], 'weights': [],
+            })
+            profile['samples'].append(indexes)
+            profile['weights'].append(count * self.interval)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': 'profile',
+            'exporter': 'profiler.py',
+            'shared': {'frames': frames},
+            'profiles': list(profiles.values()),
+        }
+
+
+# sample the stack of every thread in the process except this one every interval for the given number of seconds. this
+# blocks, so it is run on a thread of its own. the event loop thread is called event-loop in the results, and counts as
+# idle when its stack is just loop_base
+def sampleStacks(seconds, interval, loop_ident, idle=False, loop_base=None):
+    own_ident = threading.get_ident()
+    names = {}
+    counts = collections.Counter()
+    samples = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = stackOf(frame)
+            if not idle and (isIdle(stack) or ident == loop_ident and stack == loop_base):
+                continue
+            name = names.get(ident)
+            if name is None:
+                names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                names[loop_ident] = 'event-loop'
+                name = names.setdefault(ident, 'thread-{}'.format(ident))
+            counts[(name, stack)] += 1
+        samples += 1
+        time.sleep(interval)
+    return Profile(counts, interval, time.perf_counter() - start, samples)
+
+
+# watches for the event loop being blocked. a task on the loop updates a heartbeat and a thread checks it. when the
+# heartbeat is older than the threshold the loop is stuck in something that does not await, and the thread takes the
+# stack of the loop thread right then, which shows what it is stuck in. the block is measured when the heartbeat
+# comes back
+class LoopMonitor:
+    def __init__(self, threshold=LOOP_BLOCK_SECONDS, keep=50):
+        self.threshold = threshold
+        self.tick = threshold / 4
+        self.blocks = collections.deque(maxlen=keep)
+        self.count = 0
+        self.loop_ident = None
+        self.loop_base = None
+        self.beat = None
+        self.task = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    async def start(self):
+        self.loop_ident = threading.get_ident()
+        self.loop_base = loopBase(sys._getframe())
+        self.beat = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, name='loop-monitor', daemon=True)
+        self.thread.start()
+
+    async def stop(self):
+        self.stopping.set()
+        if self.task:
+            self.task.cancel()
+
+    async def heartbeat(self):
+        while True:
+            self.beat = time.monotonic()
+            await asyncio.sleep(self.tick)
+
+    def watch(self):
+        blocked_beat = None
+        block = None
+        while not self.stopping.wait(self.tick):
+            beat = self.beat
+            if block is not None and beat != blocked_beat:
+                block['blocked_ms'] = round(1000 * (beat - blocked_beat - self.tick), 1)
+                block = None
+            late = time.monotonic() - beat
+            if block is None and beat != blocked_beat and late > self.threshold:
+                frame = sys._current_frames().get(self.loop_ident)
+                stack = [frameName(frame) for frame in stackOf(frame)] if frame else []
+                blocked_beat = beat
+                block = {'at': time.time() - late, 'blocked_ms': round(1000 * late, 1), 'stack': stack}
+                self.blocks.append(block)
+                self.count += 1
+                print('event loop blocked for over {:.0f}ms in {}'.format(1000 * self.threshold, stack[-1] if stack else 'unknown'))
+
+    def report(self):
+        return {'threshold_ms': 1000 * self.threshold, 'blocks': self.count, 'recent': list(self.blocks)}
+
+
+# add the profiling routes to an app. require_admin is the dependency that lets only the admins in, and the routes are
+# only added when profiling is turned on
+def attach(app, require_admin):
+    if not ENABLED:
+        return None
+
+    monitor = LoopMonitor()
+    app.add_event_handler('startup', monitor.start)
+    app.add_event_handler('shutdown', monitor.stop)
+    running = asyncio.Lock()
+
+    # sample the process for a number of seconds and return the profile as collapsed stacks or as a speedscope file
+    async def profile(seconds: float = 10, interval: float = 0.01, format: str = 'collapsed', idle: bool = False):
+        if format not in ('collapsed', 'speedscope'):
+            raise HTTPException(status_code=400, detail='format must be collapsed or speedscope')
+        if running.locked():
+            raise HTTPException(status_code=409, detail='a profile is already being taken')
+        async with running:
+            seconds = min(max(seconds, 0.1), MAX_SECONDS)
+            interval = max(interval, MIN_INTERVAL)
+            result = await run_in_threadpool(sampleStacks, seconds, interval, monitor.loop_ident, idle, monitor.loop_base)
+
+        if format == 'speedscope':
+            return JSONResponse(result.speedscope(), headers={'content-disposition': 'attachment; filename="profile.speedscope.json"'})
+        return PlainTextResponse(result.collapsed(), headers={'content-disposition': 'attachment; filename="profile.collapsed.txt"'})
+
+    async def loopBlocks():
+        return monitor.report()
+
+    app.add_api_route('/admin/profile', profile, methods=['GET'], dependencies=[Depends(require_admin)])
+    app.add_api_route('/admin/loop-blocks', loopBlocks, methods=['GET'], dependencies=[Depends(require_admin)])
+    return monitor
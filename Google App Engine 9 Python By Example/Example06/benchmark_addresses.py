@@ -0,0 +1,62 @@
+# benchmark for resolving the address list of a user. this compares getting each address one after the other with
+# the reference resolver for users that have 1, 10, 100 and 500 addresses. run it against the firestore emulator with
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo-benchmark python benchmark_addresses.py
+import asyncio
+import time
+
+from google.cloud import firestore
+
+import reference_resolver
+
+ADDRESS_COUNTS = [1, 10, 100, 500]
+REPEATS = 5
+
+
+# make a user with the given number of addresses in the same shape as the /add-address route does
+async def seedUser(firestore_db, count):
+    addresses = []
+    batch = firestore_db.batch()
+    for i in range(count):
+        address_ref = firestore_db.collection('address').document()
+        batch.set(address_ref, {'address1': str(i), 'address2': '', 'address3': '', 'address4': ''})
+        addresses.append(address_ref)
+        # keep each batch inside the firestore limit on writes per commit
+        if len(batch) == 500:
+            await batch.commit()
+            batch = firestore_db.batch()
+    await batch.commit()
+
+    user = firestore_db.collection('users').document('benchmark-{}'.format(count))
+    await user.set({'name': 'John Doe', 'address_list': addresses})
+    return user
+
+
+async def sequential(firestore_db, user):
+    snapshot = await user.get()
+    return [await address.get() for address in snapshot.get('address_list')]
+
+
+async def batched(firestore_db, user):
+    snapshot = await user.get()
+    return await reference_resolver.ReferenceResolver(firestore_db).resolveField(snapshot, 'address_list')
+
+
+async def timeIt(function, firestore_db, user):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        await function(firestore_db, user)
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+
+async def main():
+    firestore_db = firestore.AsyncClient()
+    print('{:>10} {:>16} {:>16}'.format('addresses', 'sequential ms', 'resolver ms'))
+    for count in ADDRESS_COUNTS:
+        user = await seedUser(firestore_db, count)
+        sequential_ms = await timeIt(sequential, firestore_db, user)
+        batched_ms = await timeIt(batched, firestore_db, user)
+        print('{:>10} {:>16.1f} {:>16.1f}'.format(count, sequential_ms, batched_ms))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
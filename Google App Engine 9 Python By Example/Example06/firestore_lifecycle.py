@@ -0,0 +1,39 @@
+import inspect
+
+from google.api_core import exceptions
+
+# the warm up reads this document. it does not have to exist, a read of a missing document is as cheap as a read gets
+WARM_UP_DOCUMENT = 'warm-up/ping'
+WARM_UP_TIMEOUT = 5
+
+
+# open the firestore channel when a worker starts, on the event loop the worker serves requests with, so the first
+# request does not have to. the client only connects and fetches its credentials on its first call, so we make one
+# real call: a get of a document that is not there. if firestore cannot be reached the worker starts anyway and the
+# first request connects instead
+async def warmUp(firestore_db):
+    try:
+        await firestore_db.document(WARM_UP_DOCUMENT).get(retry=None, timeout=WARM_UP_TIMEOUT)
+    except exceptions.GoogleAPICallError as err:
+        print(str(err))
+
+
+# close the client when the worker shuts down, which uvicorn does after the requests that were still running have
+# finished. close() on the async client is the synchronous one it gets from google-cloud-core, so it is only awaited
+# if it hands back something to await
+async def close(firestore_db):
+    closed = firestore_db.close()
+    if inspect.isawaitable(closed):
+        await closed
+
+
+# warm the client up and close it along with the app
+def attach(app, firestore_db):
+    async def startup():
+        await warmUp(firestore_db)
+
+    async def shutdown():
+        await close(firestore_db)
+
+    app.add_event_handler('startup', startup)
+    app.add_event_handler('shutdown', shutdown)
@@ -0,0 +1,39 @@
+import asyncio
+
+import instrumentation
+
+
+# resolves lists of document references in as few round trips as we can. rather than calling get() on each reference
+# one after the other, all of the references are fetched with get_all, split into chunks that go to firestore at the
+# same time. get_all does not keep the order we asked for so the results are put back in order using their paths.
+# a new resolver is made for every request and it keeps every document it has fetched for the rest of that request
+class ReferenceResolver:
+    def __init__(self, firestore_db, chunk_size=100):
+        self.firestore_db = firestore_db
+        self.chunk_size = chunk_size
+        self.documents = {}
+
+    @instrumentation.traced('firestore')
+    async def fetchChunk(self, references):
+        return [snapshot async for snapshot in self.firestore_db.get_all(references)]
+
+    # return the snapshots for a list of references in the same order as the list
+    async def resolve(self, references):
+        # only go to firestore for the references we have not already fetched in this request. references can appear
+        # more than once in the list so make sure we only ask for each of them once
+        missing = {}
+        for reference in references:
+            if reference.path not in self.documents:
+                missing[reference.path] = reference
+        missing = list(missing.values())
+
+        chunks = [missing[i:i + self.chunk_size] for i in range(0, len(missing), self.chunk_size)]
+        for snapshots in await asyncio.gather(*[self.fetchChunk(chunk) for chunk in chunks]):
+            for snapshot in snapshots:
+                self.documents[snapshot.reference.path] = snapshot
+
+        return [self.documents[reference.path] for reference in references]
+
+    # pull the list of references out of a field in a snapshot and resolve them
+    async def resolveField(self, snapshot, field):
+        return await self.resolve(snapshot.get(field) or [])
@@ -0,0 +1,30 @@
+import uuid
+
+from google.cloud import firestore
+
+
+# functions for changing the list of addresses stored on a user document. instead of reading the whole array, changing
+# it and writing all of it back, these send only the address that changed using the ArrayUnion and ArrayRemove
+# transforms. firestore applies the transform on the server so two requests that edit the list at the same time can
+# not overwrite each other
+
+# add an address to the end of the list. every address gets its own id so two addresses with the same lines are still
+# different elements, otherwise ArrayUnion would treat them as the same element and only keep one of them
+async def addAddress(users, user_id, address, field='address_list'):
+    address = dict(address, id=uuid.uuid4().hex)
+    await users.update(user_id, {field: firestore.ArrayUnion([address])})
+    return address
+
+
+# delete the address at the given index of the list the user was shown. the index is looked up in the snapshot the
+# request already has and only that address is sent to be removed. if the list has changed in the meantime and the
+# address has already gone then this does nothing
+async def deleteAddress(users, user_id, index, field='address_list'):
+    user = await users.getOrCreate(user_id)
+    addresses = user.get(field) or []
+    if index < 0 or index >= len(addresses):
+        return None
+
+    address = addresses[index]
+    await users.update(user_id, {field: firestore.ArrayRemove([address])})
+    return address
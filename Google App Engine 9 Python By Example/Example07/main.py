@@ -1,49 +1,86 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-import google.oauth2.id_token
-from google.auth.transport import requests
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 from google.cloud import firestore
 from typing import Union
 import starlette.status as status
 import datetime
+import address_list
+import conditional_get
+import firebase_auth
+import firestore_lifecycle
+import instrumentation
+import profiler
+import request_auth
+import static_assets
+import template_cache
+import user_repository
 
 # define the app that will contain all of our routing for fast API
 app = FastAPI()
 
-# define a firestore client so we can interact with out database
-firestore_db = firestore.Client()
+# define an async firestore client so we can interact with out database without blocking the event loop
+firestore_db = firestore.AsyncClient()
 
-# we need a request object to be able to talk to firebase for verifying user logins
-firebase_request_adapter = requests.Request()
+
+# open the firestore channel when a worker starts and close it when the worker shuts down
+firestore_lifecycle.attach(app, firestore_db)
+
+# shared verifier that keeps the firebase signing certificates in memory so we can check user logins without
+# going out to the network on every request. the certificates are refreshed in the background once the app starts
+firebase_verifier = firebase_auth.FirebaseTokenVerifier()
+app.add_event_handler('startup', firebase_verifier.start)
+app.add_event_handler('shutdown', firebase_verifier.stop)
+
+# routes that need a login send the browser back to / when there is not a valid one
+app.add_exception_handler(request_auth.LoginRequired, request_auth.redirectToLogin)
+
+# time every request and, for a sample of them, the parts of it like checking the login, reading firestore and
+# rendering the template. the histograms are at /request-metrics for the admins and traced requests carry a
+# Server-Timing header
+request_metrics = instrumentation.Metrics()
+app.add_middleware(instrumentation.InstrumentationMiddleware, metrics=request_metrics)
 
 # define the static and template directories
-app.mount('/static', StaticFiles(directory='static'), name='static')
-templates = Jinja2Templates(directory="templates")
+# the static files are served with hashed names, compressed copies and long lived caching. the url_for in the templates
+# links to the hashed names
+static_files = static_assets.StaticAssets(directory='static')
+app.mount('/static', static_files, name='static')
+templates = instrumentation.traceTemplates(template_cache.createTemplates())
+templates.env.globals['url_for'] = static_files.urlFor(templates.env.globals['url_for'])
+
+# compile the templates when the app starts so the first request does not have to. with auto reload off on app engine
+# the compiled templates are then used for the life of the instance
+app.add_event_handler('startup', lambda: template_cache.precompile(templates))
+
+
+# function that returns the data we give to a user document the first time we see that user
+def newUserData():
+    return {
+        # for now, we will use a place holder name as this is not our focus, but we will start with an empty array for our addresses
+        'name': 'John Doe',
+        'age': 0,
+        'address_list': [],
+    }
 
 
-# function that we will use to retrieve and return the document that represents this user
-# by using the ID of the firebase credentials. this function assumes that the credentials
-# have been checked first
-def getUser(user_token):
-    # now that we have a user token, we are going to try and retrieve a user object for this user from firestore
-    # if there is not a user object for this user, we will create one
-    user = firestore_db.collection("users").document(user_token['user_id'])
-    if not user.get().exists():
-        user_data = {
-            # for now, we will use a place holder name as this is not our focus, but we will start with an empty array for our addresses
-            'name': 'John Doe',
-            'address_list': [],
-        }
-        firestore_db.collection("users").document(user_token['user_id']).set(user_data)
+# function that gives every request its own user repository. the repository remembers the user snapshots it has read
+# so a request will only ever go to firestore once for its user. this is async so fastapi calls it on the event loop
+# rather than handing it to the thread pool
+async def getUserRepository():
+    return user_repository.UserRepository(firestore_db, newUserData)
 
-    # return the user document
-    return user
+
+# function that we will use to retrieve and return the snapshot of the document that represents this user
+# by using the ID of the firebase credentials. this function assumes that the credentials
+# have been checked first. if there is not a user document for this user, the repository will create one
+@instrumentation.traced('user')
+async def getUser(users, user_token):
+    return await users.getOrCreate(user_token['user_id'])
 
 
 
 # function that we will use to validate an id_token, we will return the user_token if valid, None if not
+@instrumentation.traced('auth')
 def validateFirebaseToken(id_token):
     # if we dont have a token, then return None
     if not id_token:
@@ -53,7 +90,7 @@ def validateFirebaseToken(id_token):
     # at the end
     user_token = None
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = firebase_verifier.verify(id_token)
     except ValueError as err:
         # dump this message to the console as it will not be displayed on the template. use for debuggin
         # but if you are building for production you should handle this much more gracefully
@@ -63,37 +100,52 @@ def validateFirebaseToken(id_token):
     return user_token
 
 
+# dependency that checks the login cookie and returns the user_token, or None if there is not a valid login. fastapi
+# runs a dependency once per request and hands the result to everything that asks for it, so the token is only
+# verified once however many dependencies and routes use it
+async def getUserToken(request: Request):
+    return validateFirebaseToken(request.cookies.get("token"))
+
+
+# dependency for the routes that need a login. if there is not a valid login it raises LoginRequired, which sends the
+# browser back to / before the route runs. otherwise the route gets the login, and the user document is only read if
+# the route asks for it
+async def requireLogin(user_token: Union[dict, None] = Depends(getUserToken), users: user_repository.UserRepository = Depends(getUserRepository)):
+    if not user_token:
+        raise request_auth.LoginRequired()
+    return request_auth.Login(user_token, users)
+
+
 
 @app.get("/", response_class=HTMLResponse)
-async def root(request: Request):
+async def root(request: Request, user_token: Union[dict, None] = Depends(getUserToken), users: user_repository.UserRepository = Depends(getUserRepository)):
     # query firebase for the request token. We also declare a bunch of other variables here as we will need them
     # for rendering the template at the end
-    id_token = request.cookies.get("token")
     error_message = "No error here"
-    user_token = None
     user = None
 
     # check if we have a valid login, if not, return the template with empty data as we will shoe the login box
-    user_token = validateFirebaseToken(id_token)
     if not user_token:
         return templates.TemplateResponse('main.html', {'request': request, 'user_token': None, 'error_message': None, 'user': None})
     
+    # if the browser already has a copy of this page, check it is still current by reading only the update time of the
+    # user document. when nothing has changed we send back 304 Not Modified without reading the rest or rendering
+    if conditional_get.hasCopy(request):
+        etag = conditional_get.userETag(user_token, await users.getUpdateTime(user_token['user_id']))
+        if conditional_get.isNotModified(request, etag):
+            return conditional_get.notModified(etag)
+
     # get the user document and render the template. we will need to pull the address objects as well
     # you can use get_all as well, but it will not guarantee order. If order does not matter then use get_all
-    user = getUser(user_token).get()
+    user = await getUser(users, user_token)
     addresses = user.get('address_list')
-    return templates.TemplateResponse('main.html', {'request': request, 'user_token': user_token, 'error_message':error_message, 'user_info':user, 'address_list': addresses})
+    response = templates.TemplateResponse('main.html', {'request': request, 'user_token': user_token, 'error_message':error_message, 'user_info':user, 'address_list': addresses})
+    return conditional_get.withETag(response, conditional_get.userETag(user_token, user.update_time))
 
 
 # route that will take in an address form and will add it to the firestore and link it to a user
 @app.post("/add-address", response_class=RedirectResponse)
-async def addAddresses(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
+async def addAddresses(request: Request, login: request_auth.Login = Depends(requireLogin)):
     # pull the form containing our data
     form = await request.form()
 
@@ -105,36 +157,42 @@ async def addAddresses(request: Request):
         'address4': form['address4'],
     }
 
-    # add the address to our current user
-    user = getUser(user_token)
-    addresses = user.get().get('address_list')
-    addresses.append(address)
-    user.update({'address_list': addresses})
+    # add the address to our current user. only the new address is sent and firestore appends it on the server
+    await login.user()
+    await address_list.addAddress(login.users, login.user_id, address)
 
     # when finished, return a redirect with a 302 to force a GET verb
     return RedirectResponse("/", status_code=status.HTTP_302_FOUND)
 
 
 @app.post("/delete-address", response_class=RedirectResponse)
-async def deleteAddresses(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
+async def deleteAddresses(request: Request, login: request_auth.Login = Depends(requireLogin)):
     # pull the index from our form
     form = await request.form()
     index = int(form['index'])
 
-    # pull the list of address objects from the user, delete the requested index and update the user
-    user = getUser(user_token)
-    addresses = user.get().get('address_list')
-    del addresses[int(index)]
-    data = {
-        'address_list': addresses,
-    }
-    user.update(data)
+    # look up the address at the requested index and ask firestore to remove just that address from the user
+    await login.user()
+    await address_list.deleteAddress(login.users, login.user_id, index)
 
     # when finished return a redirect with a 302 verb to force a get verb
     return RedirectResponse('/', status_code=status.HTTP_302_FOUND)
+
+
+# dependency for the admin only routes. the login has to have one of the emails listed in PROFILER_ADMINS
+async def requireAdmin(login: request_auth.Login = Depends(requireLogin)):
+    if not profiler.isAdmin(login.user_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return login
+
+
+# handler that reports the request and span histograms of this worker in the prometheus text format. they show how
+# long every route and the calls inside it take, so only admins can see them
+@app.get("/request-metrics", response_class=PlainTextResponse)
+async def requestMetrics(request: Request, login: request_auth.Login = Depends(requireAdmin)):
+    return request_metrics.render()
+
+
+# admin routes that sample where the process spends its time and report when the event loop was blocked. they are only
+# there when ENABLE_PROFILER=1 is set
+profiler.attach(app, requireAdmin)
@@ -0,0 +1,60 @@
+# concurrency stress test for the address list. this fires a few hundred adds at the same user at the same time, each
+# from its own repository the way separate requests would, and checks that every one of them made it into the list.
+# it then deletes half of them in parallel and checks the right ones are left. run it against the firestore emulator with
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo-stress python stress_addresses.py
+import asyncio
+import sys
+
+from google.cloud import firestore
+
+import address_list
+import user_repository
+
+PARALLEL_ADDS = 300
+USER_ID = 'stress-test'
+
+
+def newUserData():
+    return {'name': 'John Doe', 'address_list': []}
+
+
+def newRepository(firestore_db):
+    return user_repository.UserRepository(firestore_db, newUserData)
+
+
+async def main():
+    firestore_db = firestore.AsyncClient()
+    await firestore_db.collection('users').document(USER_ID).set(newUserData())
+
+    # every add uses the same address lines, only the id that addAddress gives it makes them different
+    address = {'address1': 'line 1', 'address2': 'line 2', 'address3': 'line 3', 'address4': 'line 4'}
+    added = await asyncio.gather(*[
+        address_list.addAddress(newRepository(firestore_db), USER_ID, address) for _ in range(PARALLEL_ADDS)
+    ])
+
+    stored = (await newRepository(firestore_db).getOrCreate(USER_ID)).get('address_list')
+    lost = {a['id'] for a in added} - {a['id'] for a in stored}
+    print('added {} addresses in parallel, {} stored, {} lost'.format(PARALLEL_ADDS, len(stored), len(lost)))
+    if lost:
+        sys.exit(1)
+
+    # delete every other address in parallel. each delete looks at its own snapshot of the list like a request would
+    snapshot = await newRepository(firestore_db).getOrCreate(USER_ID)
+    to_delete = list(range(0, len(stored), 2))
+    deletes = []
+    for index in to_delete:
+        users = newRepository(firestore_db)
+        users.snapshots[USER_ID] = snapshot
+        deletes.append(address_list.deleteAddress(users, USER_ID, index))
+    deleted = await asyncio.gather(*deletes)
+
+    remaining = (await newRepository(firestore_db).getOrCreate(USER_ID)).get('address_list')
+    expected = {a['id'] for a in stored} - {a['id'] for a in deleted}
+    print('deleted {} addresses in parallel, {} remaining'.format(len(deleted), len(remaining)))
+    if {a['id'] for a in remaining} != expected:
+        print('remaining addresses do not match what was expected')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+from google.api_core import exceptions
+from google.cloud import firestore
+import instrumentation
+
+# a field that no user document has. a read that asks for only this field gets the document back with its update time
+# and none of its data
+METADATA_ONLY = ['no_such_field']
+
+
+# data access for the user documents on top of the async firestore client. a new repository is made for every request
+# and it remembers every user snapshot it has read, so no matter how many times a request asks for the user we only go
+# to firestore for it once. every call to firestore is timed as a firestore span of the request. the client is passed in
+# so this can be pointed at the firestore emulator (by setting FIRESTORE_EMULATOR_HOST) or at an in memory stand in that
+# has the same collection/document/get/create/update calls
+class UserRepository:
+    def __init__(self, firestore_db, new_user_data, collection='users'):
+        self.firestore_db = firestore_db
+        self.new_user_data = new_user_data
+        self.collection = collection
+        self.snapshots = {}
+
+        # count the calls we make to firestore so we can see how many round trips a route costs
+        self.reads = 0
+        self.writes = 0
+
+    def document(self, user_id):
+        return self.firestore_db.collection(self.collection).document(user_id)
+
+    # return the snapshot for this user, creating the document with the default data if the user does not have one yet.
+    # an existing user costs a single read. a new user costs the read plus a create that has an exists=False
+    # precondition on it, so if two requests race to create the same user only one write wins and the other rereads
+    async def getOrCreate(self, user_id):
+        if user_id in self.snapshots:
+            return self.snapshots[user_id]
+
+        user = self.document(user_id)
+        self.reads += 1
+        with instrumentation.span('firestore'):
+            snapshot = await user.get()
+        if not snapshot.exists:
+            user_data = self.new_user_data()
+            try:
+                self.writes += 1
+                with instrumentation.span('firestore'):
+                    result = await user.create(user_data)
+                snapshot = firestore.DocumentSnapshot(user, user_data, True, result.update_time, result.update_time, result.update_time)
+            except exceptions.Conflict:
+                self.reads += 1
+                with instrumentation.span('firestore'):
+                    snapshot = await user.get()
+
+        self.snapshots[user_id] = snapshot
+        return snapshot
+
+    # update fields on the user document. the snapshot we had is now out of date so forget it, the next read for this
+    # user in the same request will go back to firestore
+    async def update(self, user_id, data):
+        self.writes += 1
+        with instrumentation.span('firestore'):
+            result = await self.document(user_id).update(data)
+        self.snapshots.pop(user_id, None)
+        return result
+
+    # the update time of the user document, which changes on every write to it. if this request has already read the
+    # user we use that snapshot, otherwise we read the document without any of its fields. None if there is no document
+    async def getUpdateTime(self, user_id):
+        if user_id in self.snapshots:
+            return self.snapshots[user_id].update_time
+
+        self.reads += 1
+        with instrumentation.span('firestore'):
+            snapshot = await self.document(user_id).get(field_paths=METADATA_ONLY)
+        return snapshot.update_time if snapshot.exists else None
@@ -0,0 +1,56 @@
+# benchmark for seeding the dummy data. this writes the same documents one small commit at a time, the way the routes
+# used to, and then with the bulk writer, and reports the documents written per second for each. run it against the
+# firestore emulator with
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo-benchmark python benchmark_bulk_writer.py
+import asyncio
+import time
+
+from google.cloud import firestore
+
+import bulk_writer
+
+DOCUMENTS = 20000
+SEQUENTIAL_BATCH_SIZE = 4
+
+
+def documents():
+    names = ['first', 'second', 'third', 'fourth']
+    for i in range(DOCUMENTS):
+        yield str(i), {'number': i, 'name': names[i % 4]}
+
+
+async def sequential(firestore_db):
+    dummy_data = firestore_db.collection('dummy-data')
+    batch = firestore_db.batch()
+    for document_id, data in documents():
+        batch.set(dummy_data.document(document_id), data)
+        if len(batch) == SEQUENTIAL_BATCH_SIZE:
+            await batch.commit()
+            batch = firestore_db.batch()
+    if len(batch):
+        await batch.commit()
+
+
+async def bulk(firestore_db):
+    dummy_data = firestore_db.collection('dummy-data')
+    writer = bulk_writer.BulkWriter(firestore_db)
+    return await writer.write(('set', dummy_data.document(document_id), data) for document_id, data in documents())
+
+
+async def main():
+    firestore_db = firestore.AsyncClient()
+
+    start = time.perf_counter()
+    await sequential(firestore_db)
+    sequential_rate = DOCUMENTS / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    stats = await bulk(firestore_db)
+    bulk_rate = DOCUMENTS / (time.perf_counter() - start)
+
+    print('sequential batches of {}: {:.0f} documents/s'.format(SEQUENTIAL_BATCH_SIZE, sequential_rate))
+    print('bulk writer:             {:.0f} documents/s ({})'.format(bulk_rate, stats))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
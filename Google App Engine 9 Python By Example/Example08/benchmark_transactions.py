@@ -0,0 +1,48 @@
+# contention benchmark for the transaction runner. many writers read the same four dummy-data documents and write
+# them back with a counter added to, so most of the transactions get in each others way. at the end it checks the
+# counters add up and prints the runner metrics, which split the time lost to aborted attempts from the commit time.
+# run it against the firestore emulator with
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo-benchmark python benchmark_transactions.py
+import asyncio
+import time
+
+from google.cloud import firestore
+
+import transaction_runner
+
+WRITERS = 50
+TRANSACTIONS_PER_WRITER = 20
+DOCUMENT_IDS = ['1', '2', '3', '4']
+
+
+async def addToCounters(transaction, references):
+    snapshots = await transaction.getAll(references)
+    for snapshot in snapshots:
+        data = snapshot.to_dict() or {}
+        transaction.set(snapshot.reference, {'name': data.get('name', ''), 'count': data.get('count', 0) + 1})
+
+
+async def main():
+    firestore_db = firestore.AsyncClient()
+    references = [firestore_db.collection('dummy-data').document(document_id) for document_id in DOCUMENT_IDS]
+    for reference in references:
+        await reference.set({'name': 'counter', 'count': 0})
+
+    runner = transaction_runner.TransactionRunner(firestore_db, max_attempts=20)
+
+    async def writer():
+        for i in range(TRANSACTIONS_PER_WRITER):
+            await runner.run(addToCounters, references)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[writer() for i in range(WRITERS)])
+    elapsed = time.perf_counter() - start
+
+    counts = [(await reference.get()).get('count') for reference in references]
+    print('{} transactions in {:.1f}s, {:.0f}/s'.format(WRITERS * TRANSACTIONS_PER_WRITER, elapsed, WRITERS * TRANSACTIONS_PER_WRITER / elapsed))
+    print('counters: {} (expected {})'.format(counts, WRITERS * TRANSACTIONS_PER_WRITER))
+    print(runner.metrics())
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,269 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import os
+import random
+import time
+
+import jinja2
+
+# the share of requests that are traced. a traced request records a span for every part of it that is wrapped below,
+# like checking the login, reading firestore or rendering the template. the rest only have their total time recorded
+# which costs two clock reads. every request is traced when running locally and one in a hundred on app engine
+SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.01 if 'GAE_ENV' in os.environ else 1))
+
+# send the spans of a traced request back to the browser in a Server-Timing header so they show up in the network tab
+# of the developer tools. it is on locally and off on app engine unless SERVER_TIMING=1 is set
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0' if 'GAE_ENV' in os.environ else '1') == '1'
+
+# the upper bounds of the histogram buckets in seconds, the same as the prometheus client uses by default
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# the trace of the request being handled, None if it is not being traced, and the span we are inside of. these are
+# context variables so requests running at the same time and tasks started with gather each see their own
+current_trace = contextvars.ContextVar('current_trace', default=None)
+current_span = contextvars.ContextVar('current_span', default='')
+
+
+# the spans of one traced request as (path, name, seconds). the path is the names of the spans it is inside of and its
+# own name joined with /, like user/firestore for a firestore read made while getting the user
+class Trace:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def add(self, path, name, seconds):
+        self.spans.append((path, name, seconds))
+
+    # the Server-Timing header value. spans with the same name are added together and the total comes last
+    def serverTiming(self):
+        totals = {}
+        for path, name, seconds in self.spans:
+            totals[name] = totals.get(name, 0) + seconds
+        totals['total'] = time.perf_counter() - self.start
+        return ', '.join('{};dur={:.2f}'.format(name, 1000 * seconds) for name, seconds in totals.items())
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'path', 'token', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        parent = current_span.get()
+        self.path = parent + '/' + self.name if parent else self.name
+        self.token = current_span.set(self.path)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add(self.path, self.name, time.perf_counter() - self.start)
+        current_span.reset(self.token)
+
+
+class NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+# time a block of code as a span of the current request. when the request is not being traced this hands back a span
+# that does nothing, so it can be left in the hot path
+def span(name):
+    trace = current_trace.get()
+    return Span(trace, name) if trace is not None else NO_SPAN
+
+
+# add time that was measured some other way as a span inside the current one. this is for time that is spread out, like
+# the time spent waiting on a query stream that an async generator is reading from
+def record(name, seconds):
+    trace = current_trace.get()
+    if trace is not None:
+        parent = current_span.get()
+        trace.add(parent + '/' + name if parent else name, name, seconds)
+
+
+# decorator that times every call of a function, sync or async, as a span
+def traced(name):
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def tracedCall(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def tracedCall(*args, **kwargs):
+                with span(name):
+                    return function(*args, **kwargs)
+        return tracedCall
+    return decorate
+
+
+# a template that times generate_async as a render span. a streamed template is rendered a bit at a time as the
+# response goes out, so the time of each step is added up and recorded as one span once it is done. the steps run
+# inside the render span, so the time the template spends waiting on what it loops over, like a query stream, shows
+# up under it as render/firestore
+class TracedTemplate(jinja2.Template):
+    async def generate_async(self, *args, **kwargs):
+        stream = super().generate_async(*args, **kwargs)
+        trace = current_trace.get()
+        if trace is None:
+            async for chunk in stream:
+                yield chunk
+            return
+
+        parent = current_span.get()
+        path = parent + '/render' if parent else 'render'
+        seconds = 0
+        try:
+            while True:
+                token = current_span.set(path)
+                start = time.perf_counter()
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - start
+                    current_span.reset(token)
+                yield chunk
+        finally:
+            await stream.aclose()
+            trace.add(path, 'render', seconds)
+
+
+# time the rendering of every template a Jinja2Templates renders as a render span, whether it is rendered whole by
+# TemplateResponse or streamed with generate_async
+def traceTemplates(templates):
+    templates.TemplateResponse = traced('render')(templates.TemplateResponse)
+    templates.env.template_class = TracedTemplate
+    return templates
+
+
+# a prometheus histogram. the counts are kept per bucket and added up when they are written out
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, self.count)
+
+
+def labelValue(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# the histograms for one worker process. every request goes into the request histogram by route, method and status.
+# the spans of the traced requests go into the span histogram by route and span path, so they are a sample of the
+# requests at the sample rate
+class Metrics:
+    def __init__(self):
+        self.requests = {}
+        self.spans = {}
+        self.route_names = {}
+
+    # the path template of the route that handled a request, like /users/{user_id}, so every user goes into the same
+    # histogram. the router leaves the endpoint it picked in the scope and we look its route up once
+    def routeName(self, scope):
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        name = self.route_names.get(endpoint)
+        if name is None:
+            name = 'unmatched'
+            for route in getattr(scope.get('app'), 'routes', ()):
+                if getattr(route, 'endpoint', None) is endpoint or getattr(route, 'app', None) is endpoint:
+                    name = route.path
+                    break
+            self.route_names[endpoint] = name
+        return name
+
+    def observe(self, scope, status, seconds, trace):
+        route = self.routeName(scope)
+        key = (route, scope['method'], status)
+        histogram = self.requests.get(key)
+        if histogram is None:
+            histogram = self.requests[key] = Histogram()
+        histogram.observe(seconds)
+
+        if trace is not None:
+            for path, name, span_seconds in trace.spans:
+                histogram = self.spans.get((route, path))
+                if histogram is None:
+                    histogram = self.spans[(route, path)] = Histogram()
+                histogram.observe(span_seconds)
+
+    # the histograms in the prometheus text format
+    def render(self):
+        lines = [
+            '# HELP http_request_duration_seconds Time taken to handle each request.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (route, method, status), histogram in sorted(self.requests.items()):
+            labels = 'route="{}",method="{}",status="{}"'.format(labelValue(route), method, status)
+            lines.extend(histogram.lines('http_request_duration_seconds', labels))
+
+        lines.append('# HELP http_request_span_duration_seconds Time taken by each part of the traced requests.')
+        lines.append('# TYPE http_request_span_duration_seconds histogram')
+        for (route, path), histogram in sorted(self.spans.items()):
+            labels = 'route="{}",span="{}"'.format(labelValue(route), labelValue(path))
+            lines.extend(histogram.lines('http_request_span_duration_seconds', labels))
+        return '\n'.join(lines) + '\n'
+
+
+# ASGI middleware that times every request and decides if it is traced. spans that end before the response headers go
+# out are in the Server-Timing header, anything after that, like a streamed body, only goes into the histograms
+class InstrumentationMiddleware:
+    def __init__(self, app, metrics, sample_rate=SAMPLE_RATE, server_timing=SERVER_TIMING):
+        self.app = app
+        self.metrics = metrics
+        self.sample_rate = sample_rate
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        trace = Trace() if self.sample_rate >= 1 or random.random() < self.sample_rate else None
+        status = 500
+
+        async def sendWithTiming(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if trace is not None and self.server_timing:
+                    headers = list(message.get('headers', ()))
+                    headers.append((b'server-timing', trace.serverTiming().encode('latin-1')))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        token = current_trace.set(trace)
+        try:
+            await self.app(scope, receive, sendWithTiming)
+        finally:
+            current_trace.reset(token)
+            self.metrics.observe(scope, status, time.perf_counter() - start, trace)
@@ -1,46 +1,131 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-import google.oauth2.id_token
-from google.auth.transport import requests
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 from google.cloud import firestore
 from typing import Union
 import starlette.status as status
+import asyncio
 import datetime
+import bulk_writer
+import conditional_get
+import firebase_auth
+import firestore_lifecycle
+import instrumentation
+import profiler
+import request_auth
+import static_assets
+import template_cache
+import transaction_runner
+import user_repository
 
 # define the app that will contain all of our routing for fast API
 app = FastAPI()
 
-# define a firestore client so we can interact with out database
-firestore_db = firestore.Client()
+# define an async firestore client so we can interact with out database without blocking the event loop
+firestore_db = firestore.AsyncClient()
 
-# we need a request object to be able to talk to firebase for verifying user logins
-firebase_request_adapter = requests.Request()
+
+# open the firestore channel when a worker starts and close it when the worker shuts down
+firestore_lifecycle.attach(app, firestore_db)
+
+# shared verifier that keeps the firebase signing certificates in memory so we can check user logins without
+# going out to the network on every request. the certificates are refreshed in the background once the app starts
+firebase_verifier = firebase_auth.FirebaseTokenVerifier()
+app.add_event_handler('startup', firebase_verifier.start)
+app.add_event_handler('shutdown', firebase_verifier.stop)
+
+# routes that need a login send the browser back to / when there is not a valid one
+app.add_exception_handler(request_auth.LoginRequired, request_auth.redirectToLogin)
+
+# time every request and, for a sample of them, the parts of it like checking the login, reading firestore and
+# rendering the template. the histograms are at /request-metrics for the admins and traced requests carry a
+# Server-Timing header
+request_metrics = instrumentation.Metrics()
+app.add_middleware(instrumentation.InstrumentationMiddleware, metrics=request_metrics)
 
 # define the static and template directories
-app.mount('/static', StaticFiles(directory='static'), name='static')
-templates = Jinja2Templates(directory="templates")
+# the static files are served with hashed names, compressed copies and long lived caching. the url_for in the templates
+# links to the hashed names
+static_files = static_assets.StaticAssets(directory='static')
+app.mount('/static', static_files, name='static')
+templates = instrumentation.traceTemplates(template_cache.createTemplates())
+templates.env.globals['url_for'] = static_files.urlFor(templates.env.globals['url_for'])
+
+# compile the templates when the app starts so the first request does not have to. with auto reload off on app engine
+# the compiled templates are then used for the life of the instance
+app.add_event_handler('startup', lambda: template_cache.precompile(templates))
+
+# bulk writer that splits any number of writes into batches firestore will take, commits them a few at a time and
+# retries a batch that fails because of contention
+dummy_data_writer = bulk_writer.BulkWriter(firestore_db)
+
+# runner for the transaction routes. it tries a transaction again with backoff when it is aborted by another one
+# touching the same documents and keeps metrics on retries, aborts and commit time
+dummy_data_transactions = transaction_runner.TransactionRunner(firestore_db)
 
-# function that we will use to retrieve and return the document that represents this user
+# function that returns the data we give to a user document the first time we see that user
+def newUserData():
+    return {
+        # we wont use this, but just to ensure some data in our user document
+        'name': 'John Doe',
+    }
+
+
+# function that gives every request its own user repository. the repository remembers the user snapshots it has read
+# so a request will only ever go to firestore once for its user. this is async so fastapi calls it on the event loop
+# rather than handing it to the thread pool
+async def getUserRepository():
+    return user_repository.UserRepository(firestore_db, newUserData)
+
+
+# function that we will use to retrieve and return the snapshot of the document that represents this user
 # by using the ID of the firebase credentials. this function assumes that the credentials
-# have been checked first
-def getUser(user_token):
-    # now that we have a user token, we are going to try and retrieve a user object for this user from firestore
-    # if there is not a user object for this user, we will create one
-    user = firestore_db.collection("users").document(user_token['user_id'])
-    if not user.get().exists():
-        user_data = {
-            # we wont use this, but just to ensure some data in our user document
-            'name': 'John Doe',
-        }
-        firestore_db.collection("users").document(user_token['user_id']).set(user_data)
-
-    # return the user document
-    return user
+# have been checked first. if there is not a user document for this user, the repository will create one
+@instrumentation.traced('user')
+async def getUser(users, user_token):
+    return await users.getOrCreate(user_token['user_id'])
+
+
+# the document that keeps the version of the dummy data. every route that writes the dummy data bumps the version, so
+# the update time of this one document changes whenever the collection does and telling if the page changed is a single
+# small read however big the collection gets. anything else that writes to the collection has to bump it as well
+def dummyDataVersionDocument():
+    return firestore_db.collection('versions').document('dummy-data')
+
+
+DUMMY_DATA_VERSION_BUMP = {'version': firestore.Increment(1)}
+
+
+# function that returns the update time of the dummy data version, or None if the dummy data has never been written.
+# only the metadata of the document is read
+@instrumentation.traced('firestore')
+async def dummyDataVersion():
+    snapshot = await dummyDataVersionDocument().get(field_paths=user_repository.METADATA_ONLY)
+    return snapshot.update_time if snapshot.exists else None
+
+
+# function that sets the dummy data documents in a transaction. it is given (document ID, data) pairs. the version is
+# bumped in the same transaction so it changes exactly when the documents do
+async def setDummyData(transaction, documents):
+    for document_id, data in documents:
+        transaction.set(firestore_db.collection('dummy-data').document(document_id), data)
+    transaction.set(dummyDataVersionDocument(), DUMMY_DATA_VERSION_BUMP, merge=True)
+
+
+# function that deletes the dummy data documents with the given IDs in a transaction
+async def deleteDummyData(transaction, document_ids):
+    for document_id in document_ids:
+        transaction.delete(firestore_db.collection('dummy-data').document(document_id))
+    transaction.set(dummyDataVersionDocument(), DUMMY_DATA_VERSION_BUMP, merge=True)
+
+
+# function that bumps the dummy data version after the bulk writer is done. the writes may go in several batches, so
+# the version is only bumped once all of them are in, and a page read in between is rendered again on the next request
+async def bumpDummyDataVersion():
+    await dummyDataVersionDocument().set(DUMMY_DATA_VERSION_BUMP, merge=True)
 
 
 # function that we will use to validate an id_token, we will return the user_token if valid, None if not
+@instrumentation.traced('auth')
 def validateFirebaseToken(id_token):
     # if we dont have a token, then return None
     if not id_token:
@@ -50,7 +135,7 @@ def validateFirebaseToken(id_token):
     # at the end
     user_token = None
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = firebase_verifier.verify(id_token)
     except ValueError as err:
         # dump this message to the console as it will not be displayed on the template. use for debuggin
         # but if you are building for production you should handle this much more gracefully
@@ -60,52 +145,64 @@ def validateFirebaseToken(id_token):
     return user_token
 
 
+# dependency that checks the login cookie and returns the user_token, or None if there is not a valid login. fastapi
+# runs a dependency once per request and hands the result to everything that asks for it, so the token is only
+# verified once however many dependencies and routes use it
+async def getUserToken(request: Request):
+    return validateFirebaseToken(request.cookies.get("token"))
+
+
+# dependency for the routes that need a login. if there is not a valid login it raises LoginRequired, which sends the
+# browser back to / before the route runs. otherwise the route gets the login, and the user document is only read if
+# the route asks for it
+async def requireLogin(user_token: Union[dict, None] = Depends(getUserToken), users: user_repository.UserRepository = Depends(getUserRepository)):
+    if not user_token:
+        raise request_auth.LoginRequired()
+    return request_auth.Login(user_token, users)
+
+
 @app.get("/", response_class=HTMLResponse)
-async def root(request: Request):
+async def root(request: Request, user_token: Union[dict, None] = Depends(getUserToken), users: user_repository.UserRepository = Depends(getUserRepository)):
     # query firebase for the request token. We also declare a bunch of other variables here as we will need them
     # for rendering the template at the end
-    id_token = request.cookies.get("token")
     error_message = "No error here"
-    user_token = None
     user = None
 
     # check if we have a valid login, if not, return the template with empty data as we will shoe the login box
-    user_token = validateFirebaseToken(id_token)
     if not user_token:
         return templates.TemplateResponse('main.html', {'request': request, 'user_token': None, 'error_message': None, 'user': None})
     
+    # if the browser already has a copy of this page, check it is still current by reading only the update times of
+    # the user document and the dummy data version. when nothing has changed we send back 304 Not Modified without
+    # reading the dummy data or rendering
+    if conditional_get.hasCopy(request):
+        update_time, dummy_data_version = await asyncio.gather(users.getUpdateTime(user_token['user_id']), dummyDataVersion())
+        etag = conditional_get.userETag(user_token, update_time, dummy_data_version)
+        if conditional_get.isNotModified(request, etag):
+            return conditional_get.notModified(etag)
+
     # get the user document and render the template. we will need to pull the address objects as well
-    # you can use get_all as well, but it will not guarantee order. If order does not matter then use get_all
-    user = getUser(user_token).get()
-    dummy_data = firestore_db.collection("dummy-data").stream()
-    return templates.TemplateResponse('main.html', {'request': request, 'user_token': user_token, 'error_message':error_message, 'user_info':user, 'dummy_data': dummy_data})
+    # you can use get_all as well, but it will not guarantee order. If order does not matter then use get_all.
+    # the version is read before the dummy data, so a write that lands in between leaves the page with the older
+    # version in its ETag and it is rendered again next time, rather than older data going out with the newer version
+    user, dummy_data_version = await asyncio.gather(getUser(users, user_token), dummyDataVersion())
+    with instrumentation.span('firestore'):
+        dummy_data = [doc async for doc in firestore_db.collection("dummy-data").stream()]
+    response = templates.TemplateResponse('main.html', {'request': request, 'user_token': user_token, 'error_message':error_message, 'user_info':user, 'dummy_data': dummy_data})
+    return conditional_get.withETag(response, conditional_get.userETag(user_token, user.update_time, dummy_data_version))
 
 
 # route that will add four objects to the firestore by using a batch request. The idea is to add them in a single operation
 # rather than for individual objects
 @app.post("/batch-add", response_class=RedirectResponse)
-async def batchAdd(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
-    # create dictionaries for four objects to add into the firestore
-    batch1 = {"name":"first"}
-    batch2 = {"name":"second"}
-    batch3 = {"name":"third"}
-    batch4 = {"name":"fourth"}
-
-    # get a batch object and add the objects
-    batch = firestore_db.batch()
-    batch.set(firestore_db.collection('dummy-data').document('1'), batch1)
-    batch.set(firestore_db.collection('dummy-data').document('2'), batch2)
-    batch.set(firestore_db.collection('dummy-data').document('3'), batch3)
-    batch.set(firestore_db.collection('dummy-data').document('4'), batch4)
-
-    # commit the batch and it should be added to the firestore
-    batch.commit()
+async def batchAdd(request: Request, login: request_auth.Login = Depends(requireLogin)):
+    # the four objects to add into the firestore as (document ID, data)
+    documents = [('1', {"name":"first"}), ('2', {"name":"second"}), ('3', {"name":"third"}), ('4', {"name":"fourth"})]
+
+    # hand the writes to the bulk writer which puts them in batches and commits them to the firestore
+    dummy_data = firestore_db.collection('dummy-data')
+    await dummy_data_writer.write(('set', dummy_data.document(document_id), data) for document_id, data in documents)
+    await bumpDummyDataVersion()
 
     # when finished, redirect with a 302 to force a GET request back to /
     return RedirectResponse('/', status_code=status.HTTP_302_FOUND)
@@ -114,72 +211,58 @@ async def batchAdd(request: Request):
 # route that will add four objects to the firestore by using a transaction request. The idea is to add them in a single operation
 # rather than for individual objects
 @app.post("/transaction-add", response_class=RedirectResponse)
-async def batchAdd(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
-    # create dictionaries for four objects to add into the firestore
-    transaction1 = {"name":"fifth"}
-    transaction2 = {"name":"sixth"}
-    transaction3 = {"name":"seventh"}
-    transaction4 = {"name":"eighth"}
-
-    # get a transaction object and add the objects
-    transaction = firestore_db.transaction()
-    transaction.set(firestore_db.collection('dummy-data').document('1'), transaction1)
-    transaction.set(firestore_db.collection('dummy-data').document('2'), transaction2)
-    transaction.set(firestore_db.collection('dummy-data').document('3'), transaction3)
-    transaction.set(firestore_db.collection('dummy-data').document('4'), transaction4)
-
-    # commit the transaction and it should be added to the firestore
-    transaction.commit()
+async def transactionAdd(request: Request, login: request_auth.Login = Depends(requireLogin)):
+    # the four objects to add into the firestore as (document ID, data)
+    documents = [('1', {"name":"fifth"}), ('2', {"name":"sixth"}), ('3', {"name":"seventh"}), ('4', {"name":"eighth"})]
+
+    # set all four in one transaction. the runner commits it and tries again if another transaction got in the way
+    await dummy_data_transactions.run(setDummyData, documents)
 
     # when finished, redirect with a 302 to force a GET request back to /
     return RedirectResponse('/', status_code=status.HTTP_302_FOUND)
 
 # route that will delete the first four objects using a batch operation
 @app.post('/batch-delete', response_class=RedirectResponse)
-async def batchDelete(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")    
-
-    # get a batch object and add the objects
-    batch = firestore_db.batch()
-    batch.delete(firestore_db.collection('dummy-data').document('1'))
-    batch.delete(firestore_db.collection('dummy-data').document('2'))
-    batch.delete(firestore_db.collection('dummy-data').document('3'))
-    batch.delete(firestore_db.collection('dummy-data').document('4'))
-
-    # commit the batch and it should be added to the firestore
-    batch.commit()
+async def batchDelete(request: Request, login: request_auth.Login = Depends(requireLogin)):
+    # hand the deletes to the bulk writer which puts them in batches and commits them to the firestore
+    dummy_data = firestore_db.collection('dummy-data')
+    await dummy_data_writer.write(('delete', dummy_data.document(document_id), None) for document_id in ['1', '2', '3', '4'])
+    await bumpDummyDataVersion()
 
     # when finished, redirect with a 302 to force a GET request back to /
     return RedirectResponse('/', status_code=status.HTTP_302_FOUND)
 
 # route that will delete the first four objects using a transaction operation
 @app.post('/transaction-delete', response_class=RedirectResponse)
-async def transactionDelete(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")    
-
-    # get a transaction object and add the objects
-    transaction = firestore_db.transaction()
-    transaction.delete(firestore_db.collection('dummy-data').document('1'))
-    transaction.delete(firestore_db.collection('dummy-data').document('2'))
-    transaction.delete(firestore_db.collection('dummy-data').document('3'))
-    transaction.delete(firestore_db.collection('dummy-data').document('4'))
-
-    # commit the transaction and it should be added to the firestore
-    transaction.commit()
+async def transactionDelete(request: Request, login: request_auth.Login = Depends(requireLogin)):
+    # delete all four in one transaction. the runner commits it and tries again if another transaction got in the way
+    await dummy_data_transactions.run(deleteDummyData, ['1', '2', '3', '4'])
 
     # when finished, redirect with a 302 to force a GET request back to /
     return RedirectResponse('/', status_code=status.HTTP_302_FOUND)
+
+
+# dependency for the admin only routes. the login has to have one of the emails listed in PROFILER_ADMINS
+async def requireAdmin(login: request_auth.Login = Depends(requireLogin)):
+    if not profiler.isAdmin(login.user_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return login
+
+
+# handler that reports the request and span histograms of this worker in the prometheus text format. they show how
+# long every route and the calls inside it take, so only admins can see them
+@app.get("/request-metrics", response_class=PlainTextResponse)
+async def requestMetrics(request: Request, login: request_auth.Login = Depends(requireAdmin)):
+    return request_metrics.render()
+
+
+# route that shows how much the transaction routes are retrying and how long their commits take. it names the most
+# contended documents, so only admins can see it
+@app.get('/transaction-metrics')
+async def transactionMetrics(request: Request, login: request_auth.Login = Depends(requireAdmin)):
+    return dummy_data_transactions.metrics()
+
+
+# admin routes that sample where the process spends its time and report when the event loop was blocked. they are only
+# there when ENABLE_PROFILER=1 is set
+profiler.attach(app, requireAdmin)
@@ -0,0 +1,24 @@
+from fastapi.responses import RedirectResponse
+import starlette.status as status
+
+
+# raised by the login dependency when a route needs a login and the request does not have a valid one. the handler
+# below turns it into a redirect to / so the route itself never runs
+class LoginRequired(Exception):
+    pass
+
+
+async def redirectToLogin(request, exc):
+    return RedirectResponse('/', status_code=status.HTTP_302_FOUND)
+
+
+# the login for one request. the token has already been checked when this is made, and the user document is only read
+# the first time a route asks for it. the user repository remembers the snapshot so asking again costs nothing
+class Login:
+    def __init__(self, user_token, users):
+        self.user_token = user_token
+        self.users = users
+        self.user_id = user_token['user_id']
+
+    async def user(self):
+        return await self.users.getOrCreate(self.user_id)
@@ -0,0 +1,90 @@
+# tests for BulkWriter against a stand in for the firestore batch, so they need neither the emulator nor the network.
+# run them from this folder:
+#   python -m pytest test_bulk_writer.py
+import asyncio
+import unittest
+from unittest import mock
+
+from google.api_core import exceptions
+
+import bulk_writer
+
+
+class Reference:
+    def __init__(self, path):
+        self.path = path
+
+
+class FakeBatch:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, reference, data):
+        self.writes.append(('set', reference.path, data))
+
+    def delete(self, reference):
+        self.writes.append(('delete', reference.path, None))
+
+
+class FakeFirestore:
+    def batch(self):
+        return FakeBatch()
+
+
+# commits the batches into a dictionary of documents. the batches given in errors fail with that error instead
+class FakeCommit:
+    def __init__(self, errors=None):
+        self.documents = {}
+        self.commits = 0
+        self.errors = errors or {}
+
+    async def __call__(self, batch):
+        self.commits += 1
+        await asyncio.sleep(0)
+        error = self.errors.get(self.commits)
+        if error:
+            raise error
+        for action, path, data in batch.writes:
+            if action == 'set':
+                self.documents[path] = data
+            else:
+                self.documents.pop(path, None)
+
+
+def counted(count, taken):
+    for i in range(count):
+        taken.append(i)
+        yield ('set', Reference('rows/{}'.format(i % 50)), {'value': i})
+
+
+class BulkWriterTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        sleep = mock.patch.object(bulk_writer.asyncio, 'sleep', new=mock.AsyncMock())
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    async def testTheLastWriteToADocumentWins(self):
+        commit = FakeCommit()
+        writer = bulk_writer.BulkWriter(FakeFirestore(), batch_size=7, max_concurrency=4, commit=commit)
+        stats = await writer.write(counted(1000, []))
+        self.assertEqual(stats['writes'] + stats['deduplicated'], 1000)
+        self.assertEqual(commit.documents, {'rows/{}'.format(i): {'value': 950 + i} for i in range(50)})
+
+    async def testRetriesAContendedBatch(self):
+        commit = FakeCommit({1: exceptions.Aborted('contention')})
+        writer = bulk_writer.BulkWriter(FakeFirestore(), batch_size=10, max_concurrency=1, commit=commit)
+        stats = await writer.write(counted(20, []))
+        self.assertEqual((stats['batches'], stats['retries']), (2, 1))
+
+    async def testStopsTakingWritesOnceABatchHasFailed(self):
+        commit = FakeCommit({2: exceptions.PermissionDenied('no')})
+        writer = bulk_writer.BulkWriter(FakeFirestore(), batch_size=10, max_concurrency=2, commit=commit)
+        taken = []
+        with self.assertRaises(exceptions.PermissionDenied):
+            await writer.write(counted(100000, taken))
+        # only the batches that were already committing or waiting for a turn were read
+        self.assertLess(len(taken), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# tests for TransactionRunner against a stand in for the firestore transaction, so they need neither the emulator nor
+# the network. run them from this folder:
+#   python -m pytest test_transaction_runner.py
+import asyncio
+import unittest
+from unittest import mock
+
+from google.api_core import exceptions
+
+import transaction_runner
+
+
+class Reference:
+    def __init__(self, path):
+        self.path = path
+
+
+# the parts of AsyncTransaction the runner uses. the first aborts commits are aborted the way firestore aborts a
+# commit that lost to another transaction
+class FakeTransaction:
+    def __init__(self, aborts):
+        self.aborts = aborts
+        self._id = None
+        self.begun = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.writes = []
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._id = None
+        self.writes = []
+
+    async def _begin(self, retry_id=None):
+        self.begun.append(retry_id)
+        self._id = 'transaction-{}'.format(len(self.begun)).encode()
+
+    async def _commit(self):
+        self.commits += 1
+        if self.commits <= self.aborts:
+            raise exceptions.Aborted('Transaction lock timeout')
+        self._clean_up()
+        return []
+
+    async def _rollback(self):
+        self.rollbacks += 1
+        self._clean_up()
+
+    def set(self, reference, data, merge=False):
+        self.writes.append((reference.path, data))
+
+
+class FakeFirestore:
+    def __init__(self, aborts):
+        self.transactions = []
+        self.aborts = aborts
+
+    def transaction(self):
+        transaction = FakeTransaction(self.aborts)
+        self.transactions.append(transaction)
+        return transaction
+
+
+async def writeCounter(transaction, value):
+    transaction.set(Reference('counters/hits'), {'value': value})
+    return value
+
+
+class TransactionRunnerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        sleep = mock.patch.object(transaction_runner.asyncio, 'sleep', new=mock.AsyncMock())
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+        uniform = mock.patch.object(transaction_runner.random, 'uniform', side_effect=lambda low, high: high)
+        uniform.start()
+        self.addCleanup(uniform.stop)
+
+    async def testRetriesAnAbortedCommitWithBackoff(self):
+        firestore_db = FakeFirestore(aborts=2)
+        runner = transaction_runner.TransactionRunner(firestore_db, max_attempts=5, base_delay=0.05, max_delay=5)
+
+        self.assertEqual(await runner.run(writeCounter, 7), 7)
+
+        transaction = firestore_db.transactions[0]
+        self.assertEqual(transaction.commits, 3)
+        self.assertEqual(transaction.rollbacks, 2)
+        # each attempt after the first begins with the id of the one that was aborted
+        self.assertEqual(transaction.begun, [None, b'transaction-1', b'transaction-2'])
+        self.assertEqual([call.args[0] for call in self.sleep.await_args_list], [0.1, 0.2])
+        metrics = runner.metrics()
+        self.assertEqual((metrics['commits'], metrics['attempts'], metrics['retries'], metrics['aborts'], metrics['failures']), (1, 3, 2, 2, 0))
+        self.assertEqual(metrics['most_contended_documents'], [('counters/hits', 2)])
+
+    async def testBackoffIsCapped(self):
+        firestore_db = FakeFirestore(aborts=3)
+        runner = transaction_runner.TransactionRunner(firestore_db, max_attempts=4, base_delay=1, max_delay=3)
+        await runner.run(writeCounter, 1)
+        self.assertEqual([call.args[0] for call in self.sleep.await_args_list], [2, 3, 3])
+
+    async def testRaisesTheLastAbortedErrorWhenEveryAttemptIsAborted(self):
+        firestore_db = FakeFirestore(aborts=10)
+        runner = transaction_runner.TransactionRunner(firestore_db, max_attempts=3)
+
+        with self.assertRaises(exceptions.Aborted):
+            await runner.run(writeCounter, 1)
+
+        transaction = firestore_db.transactions[0]
+        self.assertEqual((transaction.commits, transaction.rollbacks), (3, 3))
+        self.assertEqual(self.sleep.await_count, 2)
+        self.assertEqual(runner.metrics()['failures'], 1)
+
+    async def testOtherErrorsRollBackWithoutRetrying(self):
+        firestore_db = FakeFirestore(aborts=0)
+        runner = transaction_runner.TransactionRunner(firestore_db)
+
+        async def fail(transaction):
+            raise KeyError('missing')
+
+        with self.assertRaises(KeyError):
+            await runner.run(fail)
+
+        transaction = firestore_db.transactions[0]
+        self.assertEqual((transaction.commits, transaction.rollbacks), (0, 1))
+        self.assertFalse(self.sleep.await_count)
+        self.assertEqual(runner.metrics()['retries'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import asyncio
+import random
+import time
+from collections import Counter
+
+from google.api_core import exceptions
+
+
+# the transaction handed to the function the runner runs. reads go through the real transaction and the path of every
+# document that is read is kept in read_set, writes are passed straight on and their paths kept in write_set. when an
+# attempt is aborted these tell us which documents were being fought over
+class TrackedTransaction:
+    def __init__(self, transaction):
+        self.transaction = transaction
+        self.read_set = set()
+        self.write_set = set()
+
+    # read one document in the transaction and return its snapshot
+    async def get(self, reference):
+        self.read_set.add(reference.path)
+        async for snapshot in await self.transaction.get(reference):
+            return snapshot
+
+    async def getAll(self, references):
+        references = list(references)
+        self.read_set.update(reference.path for reference in references)
+        return [snapshot async for snapshot in await self.transaction.get_all(references)]
+
+    def set(self, reference, data, merge=False):
+        self.write_set.add(reference.path)
+        self.transaction.set(reference, data, merge=merge)
+
+    def update(self, reference, data):
+        self.write_set.add(reference.path)
+        self.transaction.update(reference, data)
+
+    def delete(self, reference):
+        self.write_set.add(reference.path)
+        self.transaction.delete(reference)
+
+
+# runs an async function in a firestore transaction and tries it again when it is aborted because another transaction
+# touched the same documents. the runner begins, commits and rolls back the transaction itself rather than going
+# through firestore.async_transactional, which turns an aborted commit into a plain ValueError and so hides what went
+# wrong. an attempt that is aborted is rolled back and the next one begins with the id of the one that failed, which
+# keeps its place in line. between attempts we wait with exponential backoff and jitter so a crowd of writers on the
+# same documents spread out rather than all trying again at the same moment. the metrics split the time spent on
+# commits that went through from the time lost to attempts that were aborted
+class TransactionRunner:
+    def __init__(self, firestore_db, max_attempts=5, base_delay=0.05, max_delay=5):
+        self.firestore_db = firestore_db
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.transactions = 0
+        self.commits = 0
+        self.attempts = 0
+        self.retries = 0
+        self.aborts = 0
+        self.failures = 0
+        self.commit_seconds = 0.0
+        self.max_commit_seconds = 0.0
+        self.contention_seconds = 0.0
+        self.contended_documents = Counter()
+
+    # run function(transaction, *args) until it commits and return what it returned. if every attempt is aborted the
+    # last Aborted error is raised. any other error rolls the transaction back and is raised straight away
+    async def run(self, function, *args):
+        self.transactions += 1
+        transaction = self.firestore_db.transaction()
+        retry_id = None
+        for attempt in range(1, self.max_attempts + 1):
+            self.attempts += 1
+            tracked = TrackedTransaction(transaction)
+            started = time.perf_counter()
+            try:
+                await transaction._begin(retry_id=retry_id)
+                result = await function(tracked, *args)
+                function_done = time.perf_counter()
+                await transaction._commit()
+            except exceptions.Aborted as aborted:
+                retry_id = transaction._id
+                await self.rollback(transaction)
+                self.aborts += 1
+                self.contended_documents.update(tracked.read_set | tracked.write_set)
+                if attempt == self.max_attempts:
+                    self.failures += 1
+                    self.contention_seconds += time.perf_counter() - started
+                    raise
+                self.retries += 1
+                await asyncio.sleep(random.uniform(0, min(self.base_delay * 2 ** attempt, self.max_delay)))
+                self.contention_seconds += time.perf_counter() - started
+                continue
+            except BaseException:
+                await self.rollback(transaction)
+                raise
+
+            commit_seconds = time.perf_counter() - function_done
+            self.commits += 1
+            self.commit_seconds += commit_seconds
+            self.max_commit_seconds = max(self.max_commit_seconds, commit_seconds)
+            return result
+
+    # roll back an attempt that did not commit. a rollback that fails is not worth more than the error that led to it,
+    # so it is left at that
+    async def rollback(self, transaction):
+        if not transaction.in_progress:
+            return
+        try:
+            await transaction._rollback()
+        except exceptions.GoogleAPICallError:
+            transaction._clean_up()
+
+    def metrics(self):
+        return {
+            'transactions': self.transactions,
+            'commits': self.commits,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'aborts': self.aborts,
+            'failures': self.failures,
+            'average_commit_ms': 1000 * self.commit_seconds / self.commits if self.commits else 0,
+            'max_commit_ms': 1000 * self.max_commit_seconds,
+            'contention_ms': 1000 * self.contention_seconds,
+            'most_contended_documents': self.contended_documents.most_common(10),
+        }
@@ -0,0 +1,64 @@
+# benchmark for the cache of filter results. this seeds the dummy data and then runs the same filters over and over
+# with and without the cache, reporting the pages read per second for each. run it against the firestore emulator with
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo-benchmark python benchmark_query_cache.py
+import asyncio
+import time
+
+from google.cloud import firestore
+
+import bulk_writer
+import query_cache
+import query_runner
+
+DOCUMENTS = 1000
+REQUESTS = 2000
+CONCURRENCY = 50
+
+# the same filters the routes make, with the page size they use
+FILTERS = [
+    ([('number', '>=', 500)], 'number'),
+    ([('number', '>=', 100), ('number', '<=', 200)], 'number'),
+    ([('name', '>=', 'f'), ('name', '<', 'g')], 'name'),
+]
+
+
+async def seed(firestore_db):
+    names = ['first', 'second', 'third', 'fourth']
+    dummy_data = firestore_db.collection('dummy-data')
+    await bulk_writer.BulkWriter(firestore_db).write(
+        ('set', dummy_data.document(str(i)), {'number': i, 'name': names[i % 4]}) for i in range(DOCUMENTS)
+    )
+
+
+async def readPage(firestore_db, cache, i):
+    filters, order_field = FILTERS[i % len(FILTERS)]
+    results = query_runner.QueryResults(firestore_db.collection('dummy-data'), filters, order_field, fields=['name'], cache=cache)
+    return [snapshot async for snapshot in results]
+
+
+async def run(firestore_db, cache):
+    limit = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(i):
+        async with limit:
+            await readPage(firestore_db, cache, i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(REQUESTS)])
+    return REQUESTS / (time.perf_counter() - start)
+
+
+async def main():
+    firestore_db = firestore.AsyncClient()
+    await seed(firestore_db)
+
+    uncached = await run(firestore_db, None)
+    cache = query_cache.QueryCache()
+    cached = await run(firestore_db, cache)
+
+    print('without cache: {:.0f} pages/s'.format(uncached))
+    print('with cache:    {:.0f} pages/s ({})'.format(cached, cache.metrics()))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
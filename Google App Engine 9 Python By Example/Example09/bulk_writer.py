@@ -0,0 +1,135 @@
+import asyncio
+import random
+
+from google.api_core import exceptions
+
+# the most writes firestore will take in a single commit
+MAX_BATCH_SIZE = 500
+
+# errors that mean the commit did not go through because of contention or a busy backend, so it is worth trying again.
+# sets and deletes give the same result however many times they are applied so retrying them is safe
+RETRYABLE_ERRORS = (
+    exceptions.Aborted,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+)
+
+
+# turn a normal or async iterable into an async one so we can read both the same way
+async def iterateOperations(operations):
+    if hasattr(operations, '__aiter__'):
+        async for operation in operations:
+            yield operation
+    else:
+        for operation in operations:
+            yield operation
+
+
+# bulk writer for loading lots of documents. the writes are ('set', reference, data) or ('delete', reference, None)
+# tuples and can come from a list, a generator or an async generator, so the whole load never has to be in memory.
+# they are cut into batches that fit in one commit, and if a batch writes the same document more than once only the
+# last write is kept. several batches are committed at once, up to max_concurrency, and a batch that fails because of
+# contention is tried again with exponential backoff and jitter. a batch that writes a document an earlier batch also
+# wrote waits for that batch first, so the last write to a document always wins. if a batch fails for good the write
+# stops taking operations and raises its error as soon as the batches already committing are done
+class BulkWriter:
+    def __init__(self, firestore_db, batch_size=MAX_BATCH_SIZE, max_concurrency=10, max_attempts=5, commit=None):
+        self.firestore_db = firestore_db
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+
+        # the function that commits a batch. this can be swapped for one that does something else as well, like
+        # emptying a cache after the write
+        self.commit = commit or (lambda batch: batch.commit())
+
+    async def commitBatch(self, operations, waits_for, stats):
+        if waits_for:
+            await asyncio.gather(*waits_for, return_exceptions=True)
+
+        attempt = 0
+        while True:
+            # build a new batch for every attempt so nothing is left over from the one that failed
+            batch = self.firestore_db.batch()
+            for action, reference, data in operations:
+                if action == 'set':
+                    batch.set(reference, data)
+                else:
+                    batch.delete(reference)
+            try:
+                await self.commit(batch)
+                stats['batches'] += 1
+                stats['writes'] += len(operations)
+                return
+            except RETRYABLE_ERRORS:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                stats['retries'] += 1
+                await asyncio.sleep(random.uniform(0, min(0.1 * 2 ** attempt, 10)))
+
+    async def write(self, operations):
+        stats = {'writes': 0, 'batches': 0, 'retries': 0, 'deduplicated': 0}
+        limit = asyncio.Semaphore(self.max_concurrency)
+
+        # the batches still committing, and for each document they write the batch that wrote it last. a batch takes
+        # itself out of both when it finishes, so they only ever hold the batches in flight and never every document
+        # of the load
+        running = set()
+        last_writer = {}
+        failures = []
+
+        async def run(batch_operations, waits_for):
+            try:
+                await self.commitBatch(batch_operations, waits_for, stats)
+            finally:
+                limit.release()
+
+        def finished(task, paths):
+            running.discard(task)
+            for path in paths:
+                if last_writer.get(path) is task:
+                    del last_writer[path]
+            if not task.cancelled() and task.exception() is not None:
+                failures.append(task.exception())
+
+        async def submit(batch):
+            await limit.acquire()
+            if failures:
+                limit.release()
+                return
+            waits_for = {last_writer[path] for path in batch if path in last_writer}
+            task = asyncio.ensure_future(run(list(batch.values()), waits_for))
+            paths = list(batch)
+            task.add_done_callback(lambda task: finished(task, paths))
+            for path in paths:
+                last_writer[path] = task
+            running.add(task)
+
+        # the batch being built, keyed by document path so a later write to the same document replaces the earlier one.
+        # once a batch has run out of attempts no more writes are taken, the batches already committing are waited for
+        # and its error is raised
+        try:
+            batch = {}
+            async for action, reference, data in iterateOperations(operations):
+                if failures:
+                    break
+                if action not in ('set', 'delete'):
+                    raise ValueError('unknown write {}'.format(action))
+                if reference.path in batch:
+                    del batch[reference.path]
+                    stats['deduplicated'] += 1
+                batch[reference.path] = (action, reference, data)
+                if len(batch) == self.batch_size:
+                    await submit(batch)
+                    batch = {}
+            if batch and not failures:
+                await submit(batch)
+        finally:
+            await asyncio.gather(*running, return_exceptions=True)
+
+        if failures:
+            raise failures[0]
+        return stats
@@ -0,0 +1,71 @@
+import hashlib
+import os
+
+from fastapi import Response
+
+# pages are private to the user that asked for them and the browser has to check with us before it uses its copy.
+# the page depends on the login cookie so a copy is only good for the same cookie
+CACHE_CONTROL = 'private, no-cache'
+VARY = 'Cookie'
+
+
+# hash of every file under the folders the page is built from. this goes into every ETag so a deploy that changes a
+# template or a static file changes the ETags as well, even if the data on the page has not changed
+def filesVersion(*directories):
+    digest = hashlib.sha256()
+    for directory in directories:
+        for root, folders, files in sorted(os.walk(directory)):
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                digest.update(path.encode('utf-8'))
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+
+PAGE_VERSION = filesVersion('templates', 'static')
+
+
+# make a strong ETag for a page from everything that goes into it, like the user ID and the update time of the user
+# document. the parts only have to have a stable repr
+def makeETag(*parts):
+    digest = hashlib.sha256(PAGE_VERSION.encode('ascii'))
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return '"{}"'.format(digest.hexdigest()[:32])
+
+
+# the ETag for a page that shows the logged in user. the email from the token is on the page as well as the user
+# document, and any other data the page shows is passed in parts
+def userETag(user_token, update_time, *parts):
+    return makeETag(user_token['user_id'], user_token.get('email'), update_time, *parts)
+
+
+# check if the browser sent an If-None-Match, which means it has a copy of the page and is asking if it is still good
+def hasCopy(request):
+    return 'if-none-match' in request.headers
+
+
+# check if the ETag of the browser's copy matches the one we have. an If-None-Match can have a list of ETags or *
+def isNotModified(request, etag):
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in tags or 'W/' + etag in tags
+
+
+# the 304 we send back when the browser's copy is still good. it has no body so nothing is rendered for it
+def notModified(etag):
+    return Response(status_code=304, headers={'etag': etag, 'cache-control': CACHE_CONTROL, 'vary': VARY})
+
+
+# put the ETag on a page we rendered so the browser can ask about it next time
+def withETag(response, etag):
+    response.headers['etag'] = etag
+    response.headers['cache-control'] = CACHE_CONTROL
+    response.headers['vary'] = VARY
+    return response
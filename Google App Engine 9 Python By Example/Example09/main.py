@@ -1,47 +1,124 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-import google.oauth2.id_token
-from google.auth.transport import requests
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 from typing import Union
 import starlette.status as status
 import datetime
+import os
+import bulk_writer
+import conditional_get
+import firebase_auth
+import firestore_lifecycle
+import instrumentation
+import profiler
+import request_auth
+import query_cache
+import query_runner
+import static_assets
+import template_cache
+import user_repository
 
 # define the app that will contain all of our routing for fast API
 app = FastAPI()
 
-# define a firestore client so we can interact with out database
-firestore_db = firestore.Client()
+# define an async firestore client so we can interact with out database without blocking the event loop
+firestore_db = firestore.AsyncClient()
 
-# we need a request object to be able to talk to firebase for verifying user logins
-firebase_request_adapter = requests.Request()
 
-# define the static and template directories
-app.mount('/static', StaticFiles(directory='static'), name='static')
-templates = Jinja2Templates(directory="templates")
+# open the firestore channel when a worker starts and close it when the worker shuts down
+firestore_lifecycle.attach(app, firestore_db)
+
+# shared verifier that keeps the firebase signing certificates in memory so we can check user logins without
+# going out to the network on every request. the certificates are refreshed in the background once the app starts
+firebase_verifier = firebase_auth.FirebaseTokenVerifier()
+app.add_event_handler('startup', firebase_verifier.start)
+app.add_event_handler('shutdown', firebase_verifier.stop)
+
+# routes that need a login send the browser back to / when there is not a valid one
+app.add_exception_handler(request_auth.LoginRequired, request_auth.redirectToLogin)
 
-# function that we will use to retrieve and return the document that represents this user
+# time every request and, for a sample of them, the parts of it like checking the login, reading firestore and
+# rendering the template. the histograms are at /request-metrics for the admins and traced requests carry a
+# Server-Timing header
+request_metrics = instrumentation.Metrics()
+app.add_middleware(instrumentation.InstrumentationMiddleware, metrics=request_metrics)
+
+# define the static and template directories
+# the static files are served with hashed names, compressed copies and long lived caching. the url_for in the templates
+# links to the hashed names
+static_files = static_assets.StaticAssets(directory='static')
+app.mount('/static', static_files, name='static')
+templates = instrumentation.traceTemplates(template_cache.createTemplates())
+
+# a second template environment in async mode. pages that show query results are rendered with this so the page is
+# sent to the client bit by bit as the documents come in from firestore rather than all at once at the end
+streaming_templates = instrumentation.traceTemplates(template_cache.createTemplates(enable_async=True))
+for environment in (templates.env, streaming_templates.env):
+    environment.globals['url_for'] = static_files.urlFor(environment.globals['url_for'])
+
+# compile the templates in both environments when the app starts so the first request does not have to. with auto
+# reload off on app engine the compiled templates are then used for the life of the instance
+app.add_event_handler('startup', lambda: template_cache.precompile(templates))
+app.add_event_handler('startup', lambda: template_cache.precompile(streaming_templates))
+
+
+# function that renders a template with the streaming environment and sends it as it is rendered
+def streamTemplate(name, context):
+    template = streaming_templates.get_template(name)
+    return StreamingResponse(template.generate_async(context), media_type='text/html')
+
+
+# cache of the pages of dummy data that the filters have returned. the dummy data only changes through /initialise
+# so the same filter gives the same results until then. writes go through dummy_data_cache.commit which empties it
+dummy_data_cache = query_cache.QueryCache(max_entries=1000, ttl=300)
+
+# bulk writer for the dummy data. every batch it commits goes through the cache so the filter results are emptied after
+# each write
+dummy_data_writer = bulk_writer.BulkWriter(firestore_db, commit=dummy_data_cache.commit)
+
+# set LISTEN_FOR_DUMMY_DATA_CHANGES=1 to keep the cache fresh when another instance writes to the dummy data. it opens
+# a listener on the collection with a sync client that empties the cache whenever anything in the collection changes
+LISTEN_FOR_DUMMY_DATA_CHANGES = os.environ.get('LISTEN_FOR_DUMMY_DATA_CHANGES', '0') == '1'
+if LISTEN_FOR_DUMMY_DATA_CHANGES:
+    dummy_data_watch = dummy_data_cache.listen(firestore.Client().collection('dummy-data'))
+    app.add_event_handler('shutdown', dummy_data_watch.unsubscribe)
+
+
+# function that runs a query on the dummy data one page at a time. the filters are a list of (field, op, value). the
+# template only shows the name of each object so that is the only field we ask firestore for, along with the field we
+# order by for the cursor
+def queryDummyData(filters, order_field, form):
+    return query_runner.QueryResults(
+        firestore_db.collection('dummy-data'), filters, order_field,
+        limit=form.get('limit'), cursor=form.get('cursor'), fields=['name'], cache=dummy_data_cache,
+    )
+
+# function that returns the data we give to a user document the first time we see that user
+def newUserData():
+    return {
+        # we wont use this, but just to ensure some data in our user document
+        'name': 'John Doe',
+    }
+
+
+# function that gives every request its own user repository. the repository remembers the user snapshots it has read
+# so a request will only ever go to firestore once for its user. this is async so fastapi calls it on the event loop
+# rather than handing it to the thread pool
+async def getUserRepository():
+    return user_repository.UserRepository(firestore_db, newUserData)
+
+
+# function that we will use to retrieve and return the snapshot of the document that represents this user
 # by using the ID of the firebase credentials. this function assumes that the credentials
-# have been checked first
-def getUser(user_token):
-    # now that we have a user token, we are going to try and retrieve a user object for this user from firestore
-    # if there is not a user object for this user, we will create one
-    user = firestore_db.collection("users").document(user_token['user_id'])
-    if not user.get().exists():
-        user_data = {
-            # we wont use this, but just to ensure some data in our user document
-            'name': 'John Doe',
-        }
-        firestore_db.collection("users").document(user_token['user_id']).set(user_data)
-
-    # return the user document
-    return user
+# have been checked first. if there is not a user document for this user, the repository will create one
+@instrumentation.traced('user')
+async def getUser(users, user_token):
+    return await users.getOrCreate(user_token['user_id'])
 
 
 # function that we will use to validate an id_token, we will return the user_token if valid, None if not
+@instrumentation.traced('auth')
 def validateFirebaseToken(id_token):
     # if we dont have a token, then return None
     if not id_token:
@@ -51,7 +128,7 @@ def validateFirebaseToken(id_token):
     # at the end
     user_token = None
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = firebase_verifier.verify(id_token)
     except ValueError as err:
         # dump this message to the console as it will not be displayed on the template. use for debuggin
         # but if you are building for production you should handle this much more gracefully
@@ -61,68 +138,65 @@ def validateFirebaseToken(id_token):
     return user_token
 
 
+# dependency that checks the login cookie and returns the user_token, or None if there is not a valid login. fastapi
+# runs a dependency once per request and hands the result to everything that asks for it, so the token is only
+# verified once however many dependencies and routes use it
+async def getUserToken(request: Request):
+    return validateFirebaseToken(request.cookies.get("token"))
+
+
+# dependency for the routes that need a login. if there is not a valid login it raises LoginRequired, which sends the
+# browser back to / before the route runs. otherwise the route gets the login, and the user document is only read if
+# the route asks for it
+async def requireLogin(user_token: Union[dict, None] = Depends(getUserToken), users: user_repository.UserRepository = Depends(getUserRepository)):
+    if not user_token:
+        raise request_auth.LoginRequired()
+    return request_auth.Login(user_token, users)
+
+
 @app.get("/", response_class=HTMLResponse)
-async def root(request: Request):
+async def root(request: Request, cursor: Union[str, None] = None, user_token: Union[dict, None] = Depends(getUserToken), users: user_repository.UserRepository = Depends(getUserRepository)):
     # query firebase for the request token. We also declare a bunch of other variables here as we will need them
     # for rendering the template at the end
-    id_token = request.cookies.get("token")
     error_message = "No error here"
-    user_token = None
     user = None
 
     # check if we have a valid login, if not, return the template with empty data as we will shoe the login box
-    user_token = validateFirebaseToken(id_token)
     if not user_token:
         return templates.TemplateResponse('main.html', {'request': request, 'user_token': None, 'error_message': None, 'user': None})
     
+    # read the page of dummy data first so the ETag can be made from it. the page goes into the filter cache so this
+    # is usually answered from memory, and the render below then streams it from the cache as well
+    page_version = [(doc.id, doc.update_time) async for doc in queryDummyData([], None, {'cursor': cursor})]
+
+    # if the browser already has a copy of this page, check it is still current by reading only the update time of the
+    # user document. when nothing has changed we send back 304 Not Modified without rendering
+    if conditional_get.hasCopy(request):
+        etag = conditional_get.userETag(user_token, await users.getUpdateTime(user_token['user_id']), cursor, page_version)
+        if conditional_get.isNotModified(request, etag):
+            return conditional_get.notModified(etag)
+
     # get the user document and render the template. we will need to pull the address objects as well
     # you can use get_all as well, but it will not guarantee order. If order does not matter then use get_all
-    user = getUser(user_token).get()
-    dummy_data = firestore_db.collection("dummy-data").stream()
-    return templates.TemplateResponse('main.html', {'request': request, 'user_token': user_token, 'error_message':error_message, 'user_info':user, 'dummy_data': dummy_data})
+    user = await getUser(users, user_token)
+    dummy_data = queryDummyData([], None, {'cursor': cursor})
+    response = streamTemplate('main.html', {'request': request, 'user_token': user_token, 'error_message':error_message, 'user_info':user, 'dummy_data': dummy_data, 'page_action': '/', 'page_method': 'get', 'page_params': {}})
+    return conditional_get.withETag(response, conditional_get.userETag(user_token, user.update_time, cursor, page_version))
 
 # route that will add four objects to the firestore by using a batch request. the idea is to add the in a single
 # rather than for individual objects
 @app.post("/initialise", response_class=RedirectResponse)
-async def batchAdd(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
+async def batchAdd(request: Request, login: request_auth.Login = Depends(requireLogin)):
     
-    # create dictionaries for four objects to add into the firestore
-    batch1 = {"number": 1, "name":"first"}
-    batch2 = {"number": 2, "name":"second"}
-    batch3 = {"number": 3, "name":"third"}
-    batch4 = {"number": 4, "name":"fourth"}
-    batch5 = {"number": 5, "name":"first"}
-    batch6 = {"number": 6, "name":"second"}
-    batch7 = {"number": 7, "name":"third"}
-    batch8 = {"number": 8, "name":"fourth"}
-    batch9 = {"number": 9, "name":"first"}
-    batch10 = {"number": 10, "name":"second"}
-    batch11 = {"number": 11, "name":"third"}
-    batch12 = {"number": 12, "name":"fourth"}
-
-    # get a batch object and add the objects
-    batch = firestore_db.batch()
-    batch.set(firestore_db.collection('dummy-data').document('1'), batch1)
-    batch.set(firestore_db.collection('dummy-data').document('2'), batch2)
-    batch.set(firestore_db.collection('dummy-data').document('3'), batch3)
-    batch.set(firestore_db.collection('dummy-data').document('4'), batch4)
-    batch.set(firestore_db.collection('dummy-data').document('1'), batch5)
-    batch.set(firestore_db.collection('dummy-data').document('2'), batch6)
-    batch.set(firestore_db.collection('dummy-data').document('3'), batch7)
-    batch.set(firestore_db.collection('dummy-data').document('4'), batch8)
-    batch.set(firestore_db.collection('dummy-data').document('1'), batch9)
-    batch.set(firestore_db.collection('dummy-data').document('2'), batch10)
-    batch.set(firestore_db.collection('dummy-data').document('3'), batch11)
-    batch.set(firestore_db.collection('dummy-data').document('4'), batch12)
-
-    # commit the batch and it should be added to the firestore
-    batch.commit()
+    # the objects to add into the firestore as (document ID, data). the same four IDs are written three times, the bulk
+    # writer only keeps the last write to a document in a batch so each ID ends up with the last object given for it
+    names = ["first", "second", "third", "fourth"]
+    documents = [(str(number % 4 or 4), {"number": number, "name": names[(number - 1) % 4]}) for number in range(1, 13)]
+
+    # hand the writes to the bulk writer which puts them in batches and commits them to the firestore. each commit also
+    # empties the cache of filter results
+    dummy_data = firestore_db.collection('dummy-data')
+    await dummy_data_writer.write(('set', dummy_data.document(document_id), data) for document_id, data in documents)
 
     # when finished, redirect with a 302 to force a GET request back to /
     return RedirectResponse('/', status_code=status.HTTP_302_FOUND)
@@ -130,90 +204,94 @@ async def batchAdd(request: Request):
 
 # route that will filter by a number and return display the list of objects that satisfy
 @app.post('/filter-by-number', response_class=HTMLResponse)
-async def filterByNumber(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
+async def filterByNumber(request: Request, login: request_auth.Login = Depends(requireLogin)):
     # pull the number from the form
-    form = await request.token()
+    form = await request.form()
     num = int(form['num'])
 
-    # get a reference to the collection and then make a query
-    dummy_data_ref = firestore_db.collection('dummy-data')
-    query = dummy_data_ref.where(filter=FieldFilter('number', '>=', int(num)))
+    # the filters for the query we want to make
+    filters = [('number', '>=', int(num))]
 
-    # return the template with the filtered data
-    user = getUser(user_token).get()
-    return templates.TemplateResponse('main.html', {'request':request, 'user_token':user_token, 'error_message':'no error here', 'user_info':user, 'dummy_data':query.stream()})
+    # return the template with the filtered data, a page at a time
+    user = await login.user()
+    dummy_data = queryDummyData(filters, 'number', form)
+    return streamTemplate('main.html', {'request':request, 'user_token':login.user_token, 'error_message':'no error here', 'user_info':user, 'dummy_data':dummy_data, 'page_action': '/filter-by-number', 'page_method': 'post', 'page_params': {'num': num}})
 
 
 # route that will filter by two numbers and return display the list of objects that satisfy
 @app.post('/filter-by-ranger', response_class=HTMLResponse)
-async def filterByRange(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
+async def filterByRange(request: Request, login: request_auth.Login = Depends(requireLogin)):
     # pull the number from the form
-    form = await request.token()
+    form = await request.form()
     low = int(form['low'])
     high = int(form['high'])
 
 
-    # get a reference to the collection and then make a query
-    dummy_data_ref = firestore_db.collection('dummy-data')
-    query = dummy_data_ref.where(filter=FieldFilter('number', '>=', int(low))).where(filter=FieldFilter('number', '<=', int(high)))
+    # the filters for the query we want to make
+    filters = [('number', '>=', int(low)), ('number', '<=', int(high))]
 
-    # return the template with the filtered data
-    user = getUser(user_token).get()
-    return templates.TemplateResponse('main.html', {'request':request, 'user_token':user_token, 'error_message':'no error here', 'user_info':user, 'dummy_data':query.stream()})
+    # return the template with the filtered data, a page at a time
+    user = await login.user()
+    dummy_data = queryDummyData(filters, 'number', form)
+    return streamTemplate('main.html', {'request':request, 'user_token':login.user_token, 'error_message':'no error here', 'user_info':user, 'dummy_data':dummy_data, 'page_action': '/filter-by-ranger', 'page_method': 'post', 'page_params': {'low': low, 'high': high}})
 
 
 
 # route that will filter by two strings and return display the list of objects that satisfy
 # this will pick out all the objects with a name starting with the letter f
 @app.post('/filter-by-string', response_class=HTMLResponse)
-async def filterByString(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
-    # get a reference to the collection and then make a query
-    dummy_data_ref = firestore_db.collection('dummy-data')
-    query = dummy_data_ref.where(filter=FieldFilter('number', '>=', 'f')).where(filter=FieldFilter('number', '<', 'g'))
+async def filterByString(request: Request, login: request_auth.Login = Depends(requireLogin)):
+    # pull the form, it will only have a cursor in it if we are asking for the next page
+    form = await request.form()
+
+    # the filters for the query we want to make
+    filters = [('name', '>=', 'f'), ('name', '<', 'g')]
 
-    # return the template with the filtered data
-    user = getUser(user_token).get()
-    return templates.TemplateResponse('main.html', {'request':request, 'user_token':user_token, 'error_message':'no error here', 'user_info':user, 'dummy_data':query.stream()})
+    # return the template with the filtered data, a page at a time
+    user = await login.user()
+    dummy_data = queryDummyData(filters, 'name', form)
+    return streamTemplate('main.html', {'request':request, 'user_token':login.user_token, 'error_message':'no error here', 'user_info':user, 'dummy_data':dummy_data, 'page_action': '/filter-by-string', 'page_method': 'post', 'page_params': {}})
 
 
 
 # route that will filter by a name and a number and return display the list of objects that satisfy
 # note, this will return an index to be built
 @app.post('/filter-by-both', response_class=HTMLResponse)
-async def filterByString(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
+async def filterByString(request: Request, login: request_auth.Login = Depends(requireLogin)):
     # pull the number from the form
-    form = await request.token()
+    form = await request.form()
     num = int(form['num'])
     textinput = form['textinput']
     
-    # get a reference to the collection and then make a query
-    dummy_data_ref = firestore_db.collection('dummy-data')
-    query = dummy_data_ref.where(filter=FieldFilter('number', '>=', int(num))).where(filter=FieldFilter('number', '==', textinput))
+    # the filters for the query we want to make
+    filters = [('number', '>=', int(num)), ('name', '==', textinput)]
+
+    # return the template with the filtered data, a page at a time
+    user = await login.user()
+    dummy_data = queryDummyData(filters, 'number', form)
+    return streamTemplate('main.html', {'request':request, 'user_token':login.user_token, 'error_message':'no error here', 'user_info':user, 'dummy_data':dummy_data, 'page_action': '/filter-by-both', 'page_method': 'post', 'page_params': {'num': num, 'textinput': textinput}})
+
+
+# dependency for the admin only routes. the login has to have one of the emails listed in PROFILER_ADMINS
+async def requireAdmin(login: request_auth.Login = Depends(requireLogin)):
+    if not profiler.isAdmin(login.user_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return login
+
+
+# handler that reports the request and span histograms of this worker in the prometheus text format. they show how
+# long every route and the calls inside it take, so only admins can see them
+@app.get("/request-metrics", response_class=PlainTextResponse)
+async def requestMetrics(request: Request, login: request_auth.Login = Depends(requireAdmin)):
+    return request_metrics.render()
+
+
+# route that reports how well the cache of filter results is doing. it is for the admins like the other metrics
+@app.get('/query-cache-metrics')
+async def queryCacheMetrics(request: Request, login: request_auth.Login = Depends(requireAdmin)):
+    return dummy_data_cache.metrics()
+
 
-    # return the template with the filtered data
-    user = getUser(user_token).get()
-    return templates.TemplateResponse('main.html', {'request':request, 'user_token':user_token, 'error_message':'no error here', 'user_info':user, 'dummy_data':query.stream()})
+# admin routes that sample where the process spends its time and report when the event loop was blocked. they are only
+# there when ENABLE_PROFILER=1 is set
+profiler.attach(app, requireAdmin)
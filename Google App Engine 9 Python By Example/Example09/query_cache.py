@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# cache of query result pages. a page is stored against the normalised filters, order, limit, cursor and fields that
+# produced it, and is kept until it is older than the ttl or pushed out by newer pages when the cache is full. every
+# write to the data must go through invalidate (commit does that for a batch) so the cache never serves results from
+# before a write. the generation number goes up on every invalidate, and a page that was being fetched while an
+# invalidate happened is not stored, so a slow read can not put stale results back in after a write
+class QueryCache:
+    def __init__(self, max_entries=1000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    # turn the filters into a key that is the same however the caller wrote them
+    @staticmethod
+    def makeKey(filters, order_field, limit, cursor, fields):
+        return (
+            tuple(sorted((field, op, repr(value)) for field, op, value in filters)),
+            order_field, limit, cursor or None, tuple(sorted(fields or [])),
+        )
+
+    # return (documents, next_cursor) for the key, or None if we do not have it
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry['expires'] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry['documents'], entry['next_cursor']
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def currentGeneration(self):
+        with self.lock:
+            return self.generation
+
+    def put(self, key, documents, next_cursor, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = {'documents': documents, 'next_cursor': next_cursor, 'expires': time.monotonic() + self.ttl}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    # commit a write batch and then drop everything we have cached, as any page could have changed
+    async def commit(self, batch):
+        try:
+            return await batch.commit()
+        finally:
+            self.invalidate()
+
+    # keep the cache fresh across instances by listening for changes to the collection on a sync client. the first
+    # snapshot the listener gets is the current state of the collection so that one is skipped
+    def listen(self, collection):
+        first = {'seen': False}
+
+        def onSnapshot(documents, changes, read_time):
+            if first['seen'] and changes:
+                self.invalidate()
+            first['seen'] = True
+
+        return collection.on_snapshot(onSnapshot)
+
+    def metrics(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'generation': self.generation}
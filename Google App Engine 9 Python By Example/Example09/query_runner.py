@@ -0,0 +1,121 @@
+import base64
+import binascii
+import json
+import time
+
+from fastapi import HTTPException
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+import instrumentation
+
+# every query gets a limit. this is what we use if the caller does not ask for one and the most they can ask for
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 500
+
+
+# the cursor we hand to the client is the value of the field we order by and the ID of the last document on the page
+def encodeCursor(value, document_id):
+    return base64.urlsafe_b64encode(json.dumps([value, document_id]).encode('utf-8')).decode('ascii')
+
+
+# the cursor comes back from the client, so anything that is not a cursor we could have made is turned down with a 400
+# before it gets near firestore. the value is one that we order by, so a string, number, bool or null, and the document
+# ID has to be one firestore would take
+def decodeCursor(cursor):
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, binascii.Error):
+        decoded = None
+    if not isinstance(decoded, list) or len(decoded) != 2:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    value, document_id = decoded
+    if not isinstance(value, (str, int, float, bool, type(None))):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    if not isinstance(document_id, str) or document_id in ('', '.', '..') or '/' in document_id:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    if len(document_id.encode('utf-8')) > 1500:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    return value, document_id
+
+
+# the limit comes from the form as a string. one that is not a number is turned down like a bad cursor
+def pageLimit(limit):
+    try:
+        limit = int(limit or DEFAULT_LIMIT)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail='Invalid limit')
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+# one page of results from a query on the async client. the query always has a limit and carries on from the cursor of
+# the page before it with start_after. only the fields that are asked for are sent back by firestore. this is an async
+# iterable so a template rendered in async mode can loop over the documents as they arrive from firestore rather than
+# after all of them have come in. once it has been looped over, next_cursor holds the cursor for the next page or None
+# if this was the last page. a cursor or limit that is not valid raises HTTPException(400). the filters are given as
+# (field, op, value) so that, if a cache is passed in, pages can be stored against them and served again without going
+# to firestore
+class QueryResults:
+    def __init__(self, collection, filters=(), order_field=None, limit=DEFAULT_LIMIT, cursor=None, fields=None, cache=None):
+        self.order_field = order_field
+        self.limit = pageLimit(limit)
+        self.next_cursor = None
+        # the cursor is checked before anything else so a bad one never makes it into the cache key
+        start_after = decodeCursor(cursor) if cursor else None
+        self.cache = cache
+        self.cache_key = cache.makeKey(filters, order_field, self.limit, cursor, fields) if cache else None
+
+        query = collection
+        for field, op, value in filters:
+            query = query.where(filter=FieldFilter(field, op, value))
+
+        if order_field:
+            query = query.order_by(order_field)
+        if fields:
+            query = query.select(sorted(set(fields) | ({order_field} if order_field else set())))
+
+        # rebuild the last document of the page before from the cursor so we can start after it without reading it.
+        # the client adds an order on the document ID when a snapshot is used as a cursor, so ties are handled too
+        if start_after:
+            value, document_id = start_after
+            data = {order_field: value} if order_field else {}
+            query = query.start_after(firestore.DocumentSnapshot(collection.document(document_id), data, True, None, None, None))
+
+        # ask for one more than the limit so we know if there is another page after this one
+        self.query = query.limit(self.limit + 1)
+
+    async def __aiter__(self):
+        if self.cache:
+            cached = self.cache.get(self.cache_key)
+            if cached:
+                documents, self.next_cursor = cached
+                for snapshot in documents:
+                    yield snapshot
+                return
+            generation = self.cache.currentGeneration()
+
+        # the time spent waiting on firestore is added up between the documents, leaving out the time the caller spends
+        # on each document, and recorded as a firestore span once the stream is done
+        documents = []
+        stream = self.query.stream()
+        waited = 0
+        try:
+            started = time.perf_counter()
+            async for snapshot in stream:
+                waited += time.perf_counter() - started
+                if len(documents) == self.limit:
+                    last = documents[-1]
+                    value = last.get(self.order_field) if self.order_field else None
+                    self.next_cursor = encodeCursor(value, last.id)
+                    break
+                documents.append(snapshot)
+                yield snapshot
+                started = time.perf_counter()
+            else:
+                waited += time.perf_counter() - started
+        finally:
+            await stream.aclose()
+            instrumentation.record('firestore', waited)
+
+        # only a page that was read all the way through is stored
+        if self.cache:
+            self.cache.put(self.cache_key, documents, self.next_cursor, generation)
@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+from fastapi.staticfiles import StaticFiles
+from jinja2 import pass_context
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+
+# brotli is optional. without it we only make gzip copies of the files
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# folder the compressed copies of the files are kept in. running this file before a deploy fills it so instances do
+# not have to compress anything when they start. if it is not there we use a folder in the temp directory instead
+BUILD_DIRECTORY = 'static_build'
+
+# file types worth compressing and the smallest file we bother with
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS_SIZE = 256
+
+# fingerprinted URLs never change so browsers can keep them for a year without asking again. the plain URLs are still
+# served but have to be checked with the server each time
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+# gives every static file a second name with a hash of its contents in it, like style.1a2b3c4d5e.css, and keeps brotli
+# and gzip copies of the files that compress. templates link to the hashed name through url_for, so a file can be
+# cached forever and a new version gets a new URL. a request gets the smallest copy its Accept-Encoding allows, with
+# a strong ETag for that copy. files are sent with FileResponse, or with the zero copy or path send extension when the
+# server has one so the file goes straight from disk to the socket
+class StaticAssets(StaticFiles):
+    def __init__(self, directory='static', route_name='static'):
+        super().__init__(directory=directory)
+        self.route_name = route_name
+        self.assets = {}
+        self.fingerprints = {}
+        self.build()
+
+    # hash every file and make the compressed copies that are missing
+    def build(self):
+        build_directory = BUILD_DIRECTORY
+        if not os.path.isdir(build_directory):
+            build_directory = os.path.join(tempfile.gettempdir(), 'static-build-' + os.path.basename(os.getcwd()))
+
+        for root, directories, files in os.walk(self.directory):
+            for filename in files:
+                full_path = os.path.join(root, filename)
+                path = os.path.relpath(full_path, self.directory).replace(os.sep, '/')
+                with open(full_path, 'rb') as f:
+                    content = f.read()
+                digest = hashlib.sha256(content).hexdigest()[:16]
+                media_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+                stem, extension = os.path.splitext(path)
+                fingerprinted = '{}.{}{}'.format(stem, digest[:10], extension)
+                asset = {
+                    'path': full_path,
+                    'stat': os.stat(full_path),
+                    'media_type': media_type,
+                    'digest': digest,
+                    'variants': self.compress(build_directory, content, digest, media_type),
+                }
+                self.assets[path] = dict(asset, cache_control=REVALIDATE_CACHE_CONTROL)
+                self.assets[fingerprinted] = dict(asset, cache_control=IMMUTABLE_CACHE_CONTROL)
+                self.fingerprints[path] = fingerprinted
+
+    # write the brotli and gzip copies of a file, named by the hash of the file so a stale copy is never used. returns
+    # the copies that are smaller than the file, best first
+    def compress(self, build_directory, content, digest, media_type):
+        if len(content) < MIN_COMPRESS_SIZE or not media_type.startswith(COMPRESSIBLE_TYPES):
+            return []
+
+        encoders = [('gzip', '.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+        if brotli:
+            encoders.insert(0, ('br', '.br', lambda data: brotli.compress(data, quality=11)))
+
+        variants = []
+        for encoding, suffix, encode in encoders:
+            variant_path = os.path.join(build_directory, digest + suffix)
+            try:
+                if not os.path.exists(variant_path):
+                    os.makedirs(build_directory, exist_ok=True)
+                    with open(variant_path, 'wb') as f:
+                        f.write(encode(content))
+            except OSError:
+                continue
+            stat_result = os.stat(variant_path)
+            if stat_result.st_size < len(content):
+                variants.append((encoding, variant_path, stat_result))
+        return variants
+
+    # the hashed name for a file, or the name we were given if it is not one of ours
+    def fingerprint(self, path):
+        return self.fingerprints.get(path.lstrip('/'), path)
+
+    # a url_for for templates that links static files by their hashed names and leaves every other route alone
+    def urlFor(self, url_for):
+        @pass_context
+        def assetUrlFor(context, name, **path_params):
+            if name == self.route_name and 'path' in path_params:
+                path_params['path'] = '/' + self.fingerprint(path_params['path'])
+            return url_for(context, name, **path_params)
+        return assetUrlFor
+
+    # the best copy of the file the client will take from its Accept-Encoding. a q of 0 means the client does not want
+    # that encoding and * stands for any encoding not listed
+    @staticmethod
+    def chooseEncoding(accept_encoding, variants):
+        weights = {}
+        for part in accept_encoding.split(','):
+            encoding, _, params = part.partition(';')
+            weight = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    weight = float(params[2:])
+                except ValueError:
+                    weight = 0.0
+            weights[encoding.strip().lower()] = weight
+        for variant in variants:
+            if weights.get(variant[0], weights.get('*', 0)) > 0:
+                return variant
+        return None, None, None
+
+    async def get_response(self, path, scope):
+        asset = self.assets.get(path.replace(os.sep, '/'))
+        if asset is None or scope['method'] not in ('GET', 'HEAD'):
+            return await super().get_response(path, scope)
+
+        request_headers = Headers(scope=scope)
+        encoding, variant_path, variant_stat = self.chooseEncoding(request_headers.get('accept-encoding', ''), asset['variants'])
+        headers = {
+            'cache-control': asset['cache_control'],
+            'etag': '"{}{}"'.format(asset['digest'], '-' + encoding if encoding else ''),
+            'vary': 'Accept-Encoding',
+        }
+        if encoding:
+            headers['content-encoding'] = encoding
+
+        response = AssetResponse(
+            variant_path or asset['path'], headers=headers, media_type=asset['media_type'], stat_result=variant_stat or asset['stat'],
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+# FileResponse that hands the file to the server when it supports the zero copy or path send extensions, so the file
+# is sent with sendfile rather than read into memory a chunk at a time. it is always given the stat of the file
+class AssetResponse(FileResponse):
+    async def __call__(self, scope, receive, send):
+        extensions = scope.get('extensions') or {}
+        zero_copy = 'http.response.zerocopysend' in extensions
+        path_send = 'http.response.pathsend' in extensions
+        if scope['method'] != 'HEAD' and not zero_copy and not path_send:
+            return await super().__call__(scope, receive, send)
+
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        elif zero_copy:
+            with open(self.path, 'rb') as f:
+                await send({'type': 'http.response.zerocopysend', 'file': f, 'more_body': False})
+        else:
+            await send({'type': 'http.response.pathsend', 'path': os.path.abspath(self.path)})
+
+
+# fill the build folder with the compressed copies before a deploy with: python static_assets.py
+if __name__ == '__main__':
+    os.makedirs(BUILD_DIRECTORY, exist_ok=True)
+    StaticAssets()
@@ -0,0 +1,96 @@
+# tests for the cursors that QueryResults hands out and takes back, against a stand in for the firestore collection so
+# they need neither the emulator nor the network. run them from this folder:
+#   python -m pytest test_query_runner.py
+import base64
+import unittest
+
+from fastapi import HTTPException
+
+import query_runner
+
+
+# the parts of a collection and its queries that QueryResults uses when it builds a query. each call is recorded
+class FakeQuery:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return call
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self):
+        super().__init__([])
+
+    def document(self, document_id):
+        return FakeDocument(document_id)
+
+
+class FakeDocument:
+    def __init__(self, document_id):
+        self.id = document_id
+
+
+class FakeCache:
+    def __init__(self):
+        self.keys = []
+
+    def makeKey(self, *key):
+        self.keys.append(key)
+        return key
+
+
+def encode(raw):
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+GARBAGE_CURSORS = [
+    'not a cursor',
+    'é',
+    encode(b'\xff\xfe'),
+    encode(b'{"value": 1}'),
+    encode(b'[1, 2, 3]'),
+    encode(b'["f", 42]'),
+    encode(b'["f", ""]'),
+    encode(b'["f", "a/b"]'),
+    encode(b'["f", ".."]'),
+    encode(b'[{"a": 1}, "doc"]'),
+    encode(b'"just a string"'),
+]
+
+
+class QueryResultsCursorTest(unittest.TestCase):
+    def testCursorRoundTrips(self):
+        cursor = query_runner.encodeCursor('fig', 'doc-7')
+        self.assertEqual(query_runner.decodeCursor(cursor), ('fig', 'doc-7'))
+
+        collection = FakeCollection()
+        query_runner.QueryResults(collection, order_field='name', cursor=cursor)
+        start_after = [args for name, args, kwargs in collection.calls if name == 'start_after']
+        self.assertEqual(len(start_after), 1)
+        snapshot = start_after[0][0]
+        self.assertEqual((snapshot.reference.id, snapshot.to_dict()), ('doc-7', {'name': 'fig'}))
+
+    def testGarbageCursorIsABadRequest(self):
+        for cursor in GARBAGE_CURSORS:
+            with self.subTest(cursor=cursor):
+                collection = FakeCollection()
+                cache = FakeCache()
+                with self.assertRaises(HTTPException) as raised:
+                    query_runner.QueryResults(collection, order_field='name', cursor=cursor, cache=cache)
+                self.assertEqual(raised.exception.status_code, 400)
+                # nothing is asked of firestore or stored in the cache for a cursor we did not make
+                self.assertEqual(collection.calls, [])
+                self.assertEqual(cache.keys, [])
+
+    def testGarbageLimitIsABadRequest(self):
+        with self.assertRaises(HTTPException) as raised:
+            query_runner.QueryResults(FakeCollection(), limit='ten')
+        self.assertEqual(raised.exception.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# memory ceiling benchmark for /download-file. this uploads a multi GB object and then streams it back through the same
+# response the route builds, reporting the peak memory of the process as it goes. peak memory should stay around the
+# download chunk size no matter how big the object is. run it against fake-gcs-server with
+#   STORAGE_EMULATOR_HOST=http://localhost:4443 python benchmark_download.py [size in GB]
+import asyncio
+import io
+import resource
+import sys
+import time
+
+import blob_download
+import local_constants
+import storage_service
+
+OBJECT_NAME = 'benchmark/large-object.bin'
+BLOCK = b'\0' * (1024 * 1024)
+
+
+# file like object that makes up size bytes as it is read so the upload does not need the object in memory either
+class GeneratedFile(io.RawIOBase):
+    def __init__(self, size):
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        length = min(len(buffer), len(BLOCK), self.remaining)
+        buffer[:length] = BLOCK[:length]
+        self.remaining -= length
+        return length
+
+
+def peakMemoryMB():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def main():
+    size = int(float(sys.argv[1] if len(sys.argv) > 1 else 2) * 1024 * 1024 * 1024)
+    service = storage_service.StorageService(local_constants.PROJECT_NAME, local_constants.PROJECT_STORAGE_BUCKET)
+    service.start()
+
+    blob = service.bucket.blob(OBJECT_NAME, chunk_size=local_constants.DOWNLOAD_CHUNK_SIZE)
+    blob.upload_from_file(GeneratedFile(size), size=size)
+    print('uploaded {:.2f} GB, peak memory {:.0f} MB'.format(size / 1024 ** 3, peakMemoryMB()))
+
+    response = await blob_download.downloadResponse(service.bucket, OBJECT_NAME, {}, local_constants.DOWNLOAD_CHUNK_SIZE)
+    start = time.perf_counter()
+    received = 0
+    async for chunk in response.body_iterator:
+        received += len(chunk)
+    elapsed = time.perf_counter() - start
+
+    print('downloaded {:.2f} GB in {:.1f}s ({:.0f} MB/s), chunk size {} MB, peak memory {:.0f} MB'.format(
+        received / 1024 ** 3, elapsed, received / 1024 ** 2 / elapsed,
+        local_constants.DOWNLOAD_CHUNK_SIZE // (1024 * 1024), peakMemoryMB()))
+    service.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+import re
+
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+# the default amount of a blob we hold in memory at a time while we send it to the client
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+# work out which bytes of a blob of the given size the Range header is asking for. this returns None if the whole blob
+# should be sent, the (start, end) of the range with end included, or False if the range can not be satisfied. only a
+# single range is supported, a header asking for several ranges is answered with the whole blob
+def parseRange(range_header, size):
+    if not range_header:
+        return None
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', range_header)
+    if not match or (match.group(1) == '' and match.group(2) == ''):
+        return None
+
+    # an empty blob has no bytes for any range to ask for
+    if size == 0:
+        return False
+
+    start, end = match.group(1), match.group(2)
+    if start == '':
+        # a suffix range like bytes=-500 asks for the last 500 bytes
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = size - 1 if end == '' else min(int(end), size - 1)
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+# generator that downloads the blob a chunk at a time. the blob has its generation set from when we looked it up so
+# every chunk comes from the same version of the object even if it is overwritten while we are sending it
+def iterBlob(blob, start, end, chunk_size):
+    position = start
+    while position <= end:
+        chunk_end = min(position + chunk_size - 1, end)
+        yield blob.download_as_bytes(start=position, end=chunk_end, raw_download=True)
+        position = chunk_end + 1
+
+
+# build the response for downloading a blob. the blob is streamed to the client in chunks so memory use stays the same
+# no matter how big the file is. Range and If-None-Match are honoured, and the ETag, Content-Length and Content-Type
+# come from the blob metadata. the streaming generator is synchronous so starlette runs it on the thread pool
+async def downloadResponse(bucket, filename, request_headers, chunk_size=DEFAULT_CHUNK_SIZE):
+    blob = await run_in_threadpool(bucket.get_blob, filename)
+    if blob is None:
+        return Response(status_code=404)
+
+    etag = '"{}"'.format(blob.etag)
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+    if blob.content_encoding:
+        headers['Content-Encoding'] = blob.content_encoding
+
+    # if the client already has this version of the blob then there is nothing to send
+    if_none_match = request_headers.get('if-none-match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+        return Response(status_code=304, headers=headers)
+
+    size = blob.size
+    status_code = 200
+    start, end = 0, size - 1
+
+    # an If-Range that does not match means the client's partial copy is stale so we send the whole blob instead
+    byte_range = parseRange(request_headers.get('range'), size)
+    if_range = request_headers.get('if-range')
+    if if_range and if_range.strip() != etag:
+        byte_range = None
+
+    if byte_range is False:
+        headers['Content-Range'] = 'bytes */{}'.format(size)
+        return Response(status_code=416, headers=headers)
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(
+        iterBlob(blob, start, end, chunk_size),
+        status_code=status_code,
+        headers=headers,
+        media_type=blob.content_type or 'application/octet-stream',
+    )
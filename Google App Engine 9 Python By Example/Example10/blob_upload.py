@@ -0,0 +1,265 @@
+import asyncio
+import re
+import time
+import uuid
+
+import requests
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+# resumable upload chunks have to be a multiple of 256KB, apart from the last one
+CHUNK_ALIGNMENT = 256 * 1024
+
+# the default size of the chunks we send to GCS
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# compose can only join this many objects in one call
+MAX_COMPOSE_SOURCES = 32
+
+
+# one GCS resumable upload session. the chunks are sent with plain PUTs on the storage client's http session so they
+# share its connection pool. if a PUT fails part way through we ask GCS how much of the object it has already kept and
+# carry on from there, so a dropped connection only costs the bytes that had not arrived yet. this is blocking and is
+# always called from the thread pool
+class ResumableSession:
+    def __init__(self, blob, http, content_type, max_retries=5):
+        self.blob = blob
+        self.http = http
+        self.max_retries = max_retries
+        self.url = blob.create_resumable_upload_session(content_type=content_type, checksum=None)
+        self.offset = 0
+
+    # ask GCS how many bytes of the object it has kept. this returns None once the upload is complete
+    def persistedOffset(self):
+        response = self.http.put(self.url, headers={'Content-Range': 'bytes */*'})
+        if response.status_code in (200, 201):
+            return None
+        if response.status_code != 308:
+            response.raise_for_status()
+        match = re.match(r'bytes=0-(\d+)', response.headers.get('Range', ''))
+        return int(match.group(1)) + 1 if match else 0
+
+    # send a chunk of the object. the chunk has to be a multiple of CHUNK_ALIGNMENT unless it is the last one
+    def uploadChunk(self, data, final):
+        start = self.offset
+        end = start + len(data)
+        total = str(end) if final else '*'
+        attempt = 0
+
+        while True:
+            sent_from = self.offset - start
+            try:
+                if sent_from < len(data):
+                    content_range = 'bytes {}-{}/{}'.format(self.offset, end - 1, total)
+                else:
+                    content_range = 'bytes */{}'.format(total)
+                response = self.http.put(self.url, data=data[sent_from:], headers={'Content-Range': content_range})
+
+                if response.status_code in (200, 201):
+                    self.offset = end
+                    return
+
+                if response.status_code != 308:
+                    response.raise_for_status()
+
+                # GCS might keep less than we sent it, in which case we go round again with the rest of the chunk
+                match = re.match(r'bytes=0-(\d+)', response.headers.get('Range', ''))
+                self.offset = int(match.group(1)) + 1 if match else 0
+                if self.offset >= end and not final:
+                    return
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as err:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                print('upload chunk failed, resuming: {}'.format(err))
+                time.sleep(min(2 ** attempt * 0.1, 5))
+                persisted = self.persistedOffset()
+                if persisted is None:
+                    self.offset = end
+                    return
+                self.offset = persisted
+
+
+# writes a stream of bytes into a single object. the bytes are collected into fixed size chunks and each chunk is sent
+# on the thread pool while we carry on reading the next one from the client, so at most two chunks are held in memory
+class BlobWriter:
+    def __init__(self, blob, http, content_type, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.blob = blob
+        self.http = http
+        self.content_type = content_type
+        self.chunk_size = max(chunk_size // CHUNK_ALIGNMENT, 1) * CHUNK_ALIGNMENT
+        self.buffer = bytearray()
+        self.session = None
+        self.pending = None
+        self.size = 0
+
+    async def sendChunk(self, data, final):
+        if self.session is None:
+            self.session = await run_in_threadpool(ResumableSession, self.blob, self.http, self.content_type)
+        await run_in_threadpool(self.session.uploadChunk, data, final)
+
+    async def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.chunk_size:
+            chunk = bytes(self.buffer[:self.chunk_size])
+            del self.buffer[:self.chunk_size]
+
+            # wait for the chunk before this one, chunks of the same session have to go in order
+            if self.pending:
+                await self.pending
+            self.pending = asyncio.ensure_future(self.sendChunk(chunk, False))
+
+    async def close(self):
+        if self.pending:
+            await self.pending
+        await self.sendChunk(bytes(self.buffer), True)
+        self.buffer = bytearray()
+        return self.blob
+
+    async def abort(self):
+        if self.pending:
+            self.pending.cancel()
+
+
+# parallel composite upload for very large files. the stream is cut into parts that are each uploaded to their own
+# temporary object, and while one part is finishing the next part is already being uploaded alongside it. at the end
+# the parts are composed into the final object and deleted
+class CompositeWriter:
+    def __init__(self, bucket, http, name, content_type, part_size, chunk_size=DEFAULT_CHUNK_SIZE, parallel_parts=4):
+        self.bucket = bucket
+        self.http = http
+        self.name = name
+        self.content_type = content_type
+        self.part_size = part_size
+        self.chunk_size = chunk_size
+        self.prefix = '{}.parts-{}/'.format(name, uuid.uuid4().hex)
+        self.limit = asyncio.Semaphore(parallel_parts)
+        self.parts = []
+        self.closing = []
+        self.current = None
+        self.size = 0
+
+    async def closePart(self, writer):
+        try:
+            await writer.close()
+        finally:
+            self.limit.release()
+
+    async def write(self, data):
+        self.size += len(data)
+        while data:
+            if self.current is None:
+                await self.limit.acquire()
+                part = self.bucket.blob('{}{:05d}'.format(self.prefix, len(self.parts)))
+                self.parts.append(part)
+                self.current = BlobWriter(part, self.http, self.content_type, self.chunk_size)
+
+            room = self.part_size - self.current.size
+            await self.current.write(data[:room])
+            data = data[room:]
+            if self.current.size >= self.part_size:
+                self.closing.append(asyncio.ensure_future(self.closePart(self.current)))
+                self.current = None
+
+    async def close(self):
+        if self.current is not None:
+            self.closing.append(asyncio.ensure_future(self.closePart(self.current)))
+            self.current = None
+        await asyncio.gather(*self.closing)
+        return await run_in_threadpool(self.compose)
+
+    # join the parts together. compose only takes 32 objects at a time so big uploads are joined in rounds, each round
+    # adding the next parts on to what has been joined so far
+    def compose(self):
+        destination = self.bucket.blob(self.name)
+        destination.content_type = self.content_type
+        sources = self.parts[:MAX_COMPOSE_SOURCES]
+        destination.compose(sources)
+        for i in range(MAX_COMPOSE_SOURCES, len(self.parts), MAX_COMPOSE_SOURCES - 1):
+            destination.compose([destination] + self.parts[i:i + MAX_COMPOSE_SOURCES - 1])
+        self.bucket.delete_blobs(self.parts, on_error=lambda blob: None)
+        return destination
+
+    async def abort(self):
+        for future in self.closing:
+            future.cancel()
+        if self.current:
+            await self.current.abort()
+        await run_in_threadpool(self.bucket.delete_blobs, self.parts, on_error=lambda blob: None)
+
+
+# read a multipart form straight from the request and upload the file in the given field as it arrives. nothing is
+# spooled to disk, the body is parsed as it comes in and handed to the writer chunk by chunk. requests bigger than
+# composite_threshold use a parallel composite upload. this returns the uploaded blob, or None if no file was sent
+async def streamUpload(request, bucket, http, field_name, chunk_size=DEFAULT_CHUNK_SIZE, composite_threshold=None, part_size=None, parallel_parts=4):
+    content_type, options = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in options:
+        return None
+
+    content_length = int(request.headers.get('content-length') or 0)
+    use_composite = composite_threshold is not None and content_length > composite_threshold
+
+    # the parser calls these as it goes, they just queue up what happened so we can act on it asynchronously
+    events = []
+    headers = {}
+    header = {'field': b'', 'value': b''}
+
+    def onHeaderField(data, start, end):
+        header['field'] += data[start:end]
+
+    def onHeaderValue(data, start, end):
+        header['value'] += data[start:end]
+
+    def onHeaderEnd():
+        headers[header['field'].lower()] = header['value']
+        header['field'] = b''
+        header['value'] = b''
+
+    def onHeadersFinished():
+        events.append(('begin', dict(headers)))
+        headers.clear()
+
+    def onPartData(data, start, end):
+        events.append(('data', bytes(data[start:end])))
+
+    def onPartEnd():
+        events.append(('end', None))
+
+    parser = MultipartParser(options[b'boundary'], {
+        'on_header_field': onHeaderField,
+        'on_header_value': onHeaderValue,
+        'on_header_end': onHeaderEnd,
+        'on_headers_finished': onHeadersFinished,
+        'on_part_data': onPartData,
+        'on_part_end': onPartEnd,
+    })
+
+    writer = None
+    uploaded = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event, value in events:
+                if event == 'begin':
+                    disposition, params = parse_options_header(value.get(b'content-disposition', b''))
+                    filename = params.get(b'filename', b'').decode('utf-8')
+                    if params.get(b'name') == field_name.encode('utf-8') and filename and uploaded is None:
+                        file_type = value.get(b'content-type', b'application/octet-stream').decode('latin-1')
+                        if use_composite:
+                            writer = CompositeWriter(bucket, http, filename, file_type, part_size, chunk_size, parallel_parts)
+                        else:
+                            writer = BlobWriter(bucket.blob(filename), http, file_type, chunk_size)
+                elif event == 'data' and writer:
+                    await writer.write(value)
+                elif event == 'end' and writer:
+                    uploaded = await writer.close()
+                    writer = None
+            events.clear()
+        parser.finalize()
+    except BaseException:
+        if writer:
+            await writer.abort()
+        raise
+
+    return uploaded
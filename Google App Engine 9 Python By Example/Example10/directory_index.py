@@ -0,0 +1,144 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+from google.api_core import exceptions
+
+# GCS object names are at most 1024 bytes of UTF-8 and may not hold carriage returns or line feeds
+MAX_NAME_BYTES = 1024
+
+
+# the directory that holds a blob or directory. for 'a/b/c.txt' this is 'a/b/' and for 'a/b/' it is 'a/'
+def parentPrefix(name):
+    cut = name.rstrip('/').rfind('/')
+    return name[:cut + 1] if cut >= 0 else ''
+
+
+# the prefix of a directory the way the index and GCS want it: no leading /, no empty or . or .. parts and a / on the
+# end, so '/a//b' and 'a/b/' are the same directory and share their cached pages. the root is ''. raises ValueError
+# for a prefix that could never be the name of a directory in the bucket
+def normalisePrefix(prefix):
+    if any(c in prefix for c in '\r\n\0'):
+        raise ValueError('invalid directory prefix')
+    parts = [part for part in prefix.split('/') if part]
+    if any(part in ('.', '..') for part in parts):
+        raise ValueError('invalid directory prefix')
+    prefix = ''.join(part + '/' for part in parts)
+    if len(prefix.encode('utf-8')) > MAX_NAME_BYTES:
+        raise ValueError('invalid directory prefix')
+    return prefix
+
+
+# cached index of the directory tree in the bucket. each directory is listed one level at a time with a prefix and
+# delimiter='/', and a page of that listing is kept against the GCS page token that fetched it. adding a directory or
+# a file puts it straight into the cached pages of its parent directory rather than throwing them away, so the next
+# page load does not have to list the bucket again. pages expire after a while so changes made by other instances
+# still show up. the prefix and the page token come from the client, so the cache is a bounded LRU: expired pages are
+# dropped whenever a page is stored, and past max_pages the least recently used page goes
+class DirectoryIndex:
+    def __init__(self, storage_bucket, page_size=100, ttl=300, max_pages=1000):
+        self.storage_bucket = storage_bucket
+        self.page_size = page_size
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self.lock = threading.Lock()
+        self.pages = OrderedDict()
+
+    # list one page of a directory from GCS. this is blocking so it should be called from the thread pool. GCS turns
+    # down a page token it did not hand out as an invalid argument, which is raised as a ValueError like a bad prefix
+    def fetchPage(self, prefix, page_token):
+        iterator = self.storage_bucket.client.list_blobs(
+            self.storage_bucket.bucket, prefix=prefix or None, delimiter='/', max_results=self.page_size, page_token=page_token,
+        )
+        try:
+            page = next(iterator.pages, None)
+        except exceptions.BadRequest as err:
+            raise ValueError('invalid page token') from err
+        files = []
+        directories = []
+        if page is not None:
+            # the empty blob that marks a directory shows up when we list inside it, but it is not a file
+            files = sorted(blob.name for blob in page if blob.name != prefix)
+            directories = sorted(page.prefixes)
+        return {
+            'directories': directories,
+            'files': files,
+            'next_page_token': iterator.next_page_token,
+            'expires': time.monotonic() + self.ttl,
+        }
+
+    # return a page of a directory as a dictionary with the directories, files and the token for the next page.
+    # raises ValueError if the prefix or the page token is not valid. the dictionary is a copy of the cached one and
+    # its lists are never changed, as insert swaps in new lists, so a request can render it and hash it into the ETag
+    # while another request adds to the directory
+    def listDirectory(self, prefix='', page_token=None):
+        prefix = normalisePrefix(prefix)
+        key = (prefix, page_token)
+        with self.lock:
+            page = self.pages.get(key)
+            if page and page['expires'] > time.monotonic():
+                self.pages.move_to_end(key)
+                return dict(page)
+
+        page = self.fetchPage(prefix, page_token)
+        with self.lock:
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            self.evict()
+        return dict(page)
+
+    # drop the pages that have expired and then the least recently used pages until there are at most max_pages
+    def evict(self):
+        now = time.monotonic()
+        for key in [key for key, page in self.pages.items() if page['expires'] <= now]:
+            del self.pages[key]
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+
+    # put a new blob into the cached pages of its parent directory. a name ending in / is a directory. the directories
+    # above it are added to their parents as well since GCS will now list them as prefixes
+    def addEntry(self, name):
+        with self.lock:
+            while name:
+                parent = parentPrefix(name)
+                self.insert(parent, name, 'directories' if name.endswith('/') else 'files')
+                name = parent
+
+    def insert(self, prefix, name, kind):
+        pages = [(token, page) for (page_prefix, token), page in self.pages.items() if page_prefix == prefix]
+        for token, page in pages:
+            if name in page[kind]:
+                return
+
+        # a page covers the names from its first entry up to the first entry of the next page, and the first page of a
+        # directory covers everything before that, so the new name belongs on the last page that starts before it
+        def startName(token, page):
+            names = page['directories'][:1] + page['files'][:1]
+            return '' if token is None or not names else min(names)
+
+        candidates = [(startName(token, page), page) for token, page in pages if startName(token, page) <= name]
+        if not candidates:
+            return
+        page = max(candidates, key=lambda candidate: candidate[0])[1]
+
+        # if the name is past the end of a page that has more pages after it and we do not have the next page cached,
+        # the name might belong on the page we have not seen, so drop this page and let it be listed again
+        names = page['directories'] + page['files']
+        next_page = self.pages.get((prefix, page['next_page_token']))
+        if page['next_page_token'] and names and name > max(names) and next_page is None:
+            for key in [key for key, value in self.pages.items() if value is page]:
+                del self.pages[key]
+            return
+        names = list(page[kind])
+        bisect.insort(names, name)
+        page[kind] = names
+
+    # forget everything that is cached, or just the pages for one directory
+    def invalidate(self, prefix=None):
+        with self.lock:
+            if prefix is None:
+                self.pages.clear()
+            else:
+                for key in [key for key in self.pages if key[0] == prefix]:
+                    del self.pages[key]
@@ -1,3 +1,23 @@
 # local constants for our project name and bucket name
 PROJECT_NAME="new-gallery-428819"
 PROJECT_STORAGE_BUCKET="new-gallery-428819.appspot.com"
+
+# the number of connections we keep open to cloud storage for each worker
+STORAGE_POOL_SIZE=32
+
+# the size of the chunks that downloads are streamed to the client in
+DOWNLOAD_CHUNK_SIZE=8 * 1024 * 1024
+
+# uploads are sent to cloud storage in chunks of this size. it has to be a multiple of 256KB
+UPLOAD_CHUNK_SIZE=8 * 1024 * 1024
+
+# uploads bigger than this are split into parts that are uploaded side by side and then composed together
+COMPOSITE_UPLOAD_THRESHOLD=256 * 1024 * 1024
+COMPOSITE_PART_SIZE=64 * 1024 * 1024
+PARALLEL_UPLOAD_PARTS=4
+
+# the number of entries shown on each page of the bucket listing, how long a listed page is cached for in seconds and
+# the most pages that are cached at once
+LISTING_PAGE_SIZE=100
+LISTING_CACHE_SECONDS=300
+LISTING_CACHE_PAGES=1000
\ No newline at end of file
@@ -1,96 +1,136 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-import google.oauth2.id_token
-from google.auth.transport import requests
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, Response
+from starlette.concurrency import run_in_threadpool
 from google.cloud import firestore, storage
 from google.cloud.firestore_v1.base_query import FieldFilter
 from typing import Union
 import starlette.status as status
 import datetime
+import firebase_auth
+import firestore_lifecycle
+import instrumentation
+import profiler
+import request_auth
+import static_assets
+import template_cache
+import user_repository
 import local_constants
+import storage_service
+import blob_download
+import blob_upload
+import conditional_get
+import directory_index
 
 # define the app that will contain all of our routing for fast API
 app = FastAPI()
 
-# define a firestore client so we can interact with out database
-firestore_db = firestore.Client()
+# define an async firestore client so we can interact with out database without blocking the event loop
+firestore_db = firestore.AsyncClient()
 
-# we need a request object to be able to talk to firebase for verifying user logins
-firebase_request_adapter = requests.Request()
+
+# open the firestore channel when a worker starts and close it when the worker shuts down
+firestore_lifecycle.attach(app, firestore_db)
+
+# shared verifier that keeps the firebase signing certificates in memory so we can check user logins without
+# going out to the network on every request. the certificates are refreshed in the background once the app starts
+firebase_verifier = firebase_auth.FirebaseTokenVerifier()
+app.add_event_handler('startup', firebase_verifier.start)
+app.add_event_handler('shutdown', firebase_verifier.stop)
+
+# routes that need a login send the browser back to / when there is not a valid one
+app.add_exception_handler(request_auth.LoginRequired, request_auth.redirectToLogin)
+
+# time every request and, for a sample of them, the parts of it like checking the login, reading firestore and
+# rendering the template. the histograms are at /request-metrics for the admins and traced requests carry a
+# Server-Timing header
+request_metrics = instrumentation.Metrics()
+app.add_middleware(instrumentation.InstrumentationMiddleware, metrics=request_metrics)
+
+# one storage client with a bounded connection pool that every request shares. it is created when the app starts
+# and closed when it shuts down rather than making a new client for every call
+storage_bucket = storage_service.StorageService(local_constants.PROJECT_NAME, local_constants.PROJECT_STORAGE_BUCKET, local_constants.STORAGE_POOL_SIZE)
+app.add_event_handler('startup', storage_bucket.start)
+app.add_event_handler('shutdown', storage_bucket.stop)
+
+# cached index of the directories in the bucket. it lists one directory at a time a page at a time, and new directories
+# and files are added to it as they are created rather than listing the bucket again
+bucket_index = directory_index.DirectoryIndex(storage_bucket, local_constants.LISTING_PAGE_SIZE, local_constants.LISTING_CACHE_SECONDS, local_constants.LISTING_CACHE_PAGES)
 
 # define the static and template directories
-app.mount('/static', StaticFiles(directory='static'), name='static')
-templates = Jinja2Templates(directory="templates")
+# the static files are served with hashed names, compressed copies and long lived caching. the url_for in the templates
+# links to the hashed names
+static_files = static_assets.StaticAssets(directory='static')
+app.mount('/static', static_files, name='static')
+templates = instrumentation.traceTemplates(template_cache.createTemplates())
+templates.env.globals['url_for'] = static_files.urlFor(templates.env.globals['url_for'])
+
+# compile the templates when the app starts so the first request does not have to. with auto reload off on app engine
+# the compiled templates are then used for the life of the instance
+app.add_event_handler('startup', lambda: template_cache.precompile(templates))
 
 
 # function tha will add an empty directory to our storage  bucket. Note that the passed in directory name must have
 # a trailing slash attached to it otherwise this will store as a file
+@instrumentation.traced('gcs')
 def addDirectory(directory_name):
-    # get access to a storage client then list the bucket we need to use using the project and the bucket name
-    # from the local constants
-    storage_client = storage.Client(project=local_constants.PROJECT_NAME)
-    bucket = storage_client.bucket(local_constants.PROJECT_STORAGE_BUCKET)
-
     # make an empty blob out the directory name and upload it to the bucket. this is the conventio GCS uses
     # to distinguish between file and directories
-    blob = bucket.blob(directory_name)
+    blob = storage_bucket.bucket.blob(directory_name)
     blob.upload_from_string('', content_type='application/x-www-form-urlencoded;charset=UTF-8')
 
 
-# function that will add a file to the storage bucket
-def addFile(file):
-    # get access to a storage client then list the bucket we need to use using the project and the bucket name
-    # from the local constants
-    storage_client = storage.Client(project=local_constants.PROJECT_NAME)
-    bucket = storage_client.bucket(local_constants.PROJECT_STORAGE_BUCKET)
+# function that will add the file in the request's upload form to the storage bucket. the form is read straight from the
+# request and sent to a resumable upload in chunks as it arrives, so the file is never spooled to disk or held in
+# memory. very large files are uploaded as several parts side by side and composed together at the end
+@instrumentation.traced('gcs')
+async def addFile(request):
+    return await blob_upload.streamUpload(
+        request, storage_bucket.bucket, storage_bucket.session, 'file_name',
+        chunk_size=local_constants.UPLOAD_CHUNK_SIZE,
+        composite_threshold=local_constants.COMPOSITE_UPLOAD_THRESHOLD,
+        part_size=local_constants.COMPOSITE_PART_SIZE,
+        parallel_parts=local_constants.PARALLEL_UPLOAD_PARTS,
+    )
 
-    # create the blob to be stored then upload the content from the source file
-    blob = storage.Blob(file.filename, bucket)
-    blob.upload_from_file(file.file)
 
+# function that will return one page of the directories and files directly inside a directory of the bucket
+@instrumentation.traced('gcs')
+async def blobList(prefix, page_token):
+    # the listing goes to GCS if the page is not cached, so run it on the thread pool
+    return await run_in_threadpool(bucket_index.listDirectory, prefix, page_token)
 
-# function that will return the list of blobs in the bucket
-def blobList(prefix):
-    # get access to a storage client then list the bucket we need to use using the project and the bucket name
-    # from the local constants
-    storage_client = storage.Client(project=local_constants.PROJECT_NAME)
+# function that will stream the contents of a blob back to the caller for downloading. the blob is sent in chunks
+# so we never hold the whole file in memory, and the request headers are passed on so Range and If-None-Match work
+@instrumentation.traced('gcs')
+async def downloadBlob(filename, request_headers):
+    return await blob_download.downloadResponse(storage_bucket.bucket, filename, request_headers, local_constants.DOWNLOAD_CHUNK_SIZE)
 
-    # get the list of blobs and return it
-    return storage_client.list_blobs(local_constants.PROJECT_STORAGE_BUCKET, prefix=prefix)
 
-# function that will get the contents of a blob and will return it to the caller for downloading
-def downloadBlob(filename):
-    # get access to a storage client then list the bucket we need to use using the project and the bucket name
-    # from the local constants
-    storage_client = storage.Client(project=local_constants.PROJECT_NAME)
-    bucket = storage_client.bucket(local_constants.PROJECT_STORAGE_BUCKET)
+# function that returns the data we give to a user document the first time we see that user
+def newUserData():
+    return {
+        # we wont use this, but just to ensure some data in our user document
+        'name': 'John Doe',
+    }
 
-    # get access to the blob name and then download it to disk
-    blob = bucket.get_blob(filename)
-    return blob.download_as_bytes()
 
+# function that gives every request its own user repository. the repository remembers the user snapshots it has read
+# so a request will only ever go to firestore once for its user. this is async so fastapi calls it on the event loop
+# rather than handing it to the thread pool
+async def getUserRepository():
+    return user_repository.UserRepository(firestore_db, newUserData)
 
-# function that we will use to retrieve and return the document that represents this user
+
+# function that we will use to retrieve and return the snapshot of the document that represents this user
 # by using the ID of the firebase credentials. this function assumes that the credentials
-# have been checked first
-def getUser(user_token):
-    # now that we have a user token, we are going to try and retrieve a user object for this user from firestore
-    # if there is not a user object for this user, we will create one
-    user = firestore_db.collection("users").document(user_token['user_id'])
-    if not user.get().exists():
-        user_data = {
-            # we wont use this, but just to ensure some data in our user document
-            'name': 'John Doe',
-        }
-        firestore_db.collection("users").document(user_token['user_id']).set(user_data)
-
-    # return the user document
-    return user
+# have been checked first. if there is not a user document for this user, the repository will create one
+@instrumentation.traced('user')
+async def getUser(users, user_token):
+    return await users.getOrCreate(user_token['user_id'])
 
 
 # function that we will use to validate an id_token, we will return the user_token if valid, None if not
+@instrumentation.traced('auth')
 def validateFirebaseToken(id_token):
     # if we dont have a token, then return None
     if not id_token:
@@ -100,7 +140,7 @@ def validateFirebaseToken(id_token):
     # at the end
     user_token = None
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = firebase_verifier.verify(id_token)
     except ValueError as err:
         # dump this message to the console as it will not be displayed on the template. use for debuggin
         # but if you are building for production you should handle this much more gracefully
@@ -110,84 +150,110 @@ def validateFirebaseToken(id_token):
     return user_token
 
 
+# dependency that checks the login cookie and returns the user_token, or None if there is not a valid login. fastapi
+# runs a dependency once per request and hands the result to everything that asks for it, so the token is only
+# verified once however many dependencies and routes use it
+async def getUserToken(request: Request):
+    return validateFirebaseToken(request.cookies.get("token"))
+
+
+# dependency for the routes that need a login. if there is not a valid login it raises LoginRequired, which sends the
+# browser back to / before the route runs. otherwise the route gets the login, and the user document is only read if
+# the route asks for it
+async def requireLogin(user_token: Union[dict, None] = Depends(getUserToken), users: user_repository.UserRepository = Depends(getUserRepository)):
+    if not user_token:
+        raise request_auth.LoginRequired()
+    return request_auth.Login(user_token, users)
+
+
 @app.get("/", response_class=HTMLResponse)
-async def root(request: Request):
+async def root(request: Request, prefix: str = '', page_token: Union[str, None] = None, user_token: Union[dict, None] = Depends(getUserToken), users: user_repository.UserRepository = Depends(getUserRepository)):
     # query firebase for the request token. We also declare a bunch of other variables here as we will need them
     # for rendering the template at the end
-    id_token = request.cookies.get("token")
     error_message = "No error here"
-    user_token = None
     user = None
 
     # check if we have a valid login, if not, return the template with empty data as we will shoe the login box
-    user_token = validateFirebaseToken(id_token)
     if not user_token:
         return templates.TemplateResponse('main.html', {'request': request, 'user_token': None, 'error_message': None, 'user': None})
     
-    # the list of files and directories that we have in storage
-    file_list = []
-    directory_list = []
-
-    # get the list of blobs and sort them based on directory and files
-    blobs = blobList(None)
-    for blob in blobs:
-        if blob.name[-1] == '/':
-            directory_list.append(blob)
-        else:
-            file_list.append(blob)
+    # get a page of the directories and files that are in the directory we are looking at. the prefix and the page token
+    # come from the query string, so one that is not valid is the client's mistake
+    try:
+        prefix = directory_index.normalisePrefix(prefix)
+        listing = await blobList(prefix, page_token)
+    except ValueError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    listing_version = (prefix, page_token, listing['directories'], listing['files'], listing['next_page_token'])
+
+    # if the browser already has a copy of this page, check it is still current by reading only the update time of the
+    # user document. the listing comes from the directory index so it usually costs nothing. when nothing has changed
+    # we send back 304 Not Modified without rendering
+    if conditional_get.hasCopy(request):
+        etag = conditional_get.userETag(user_token, await users.getUpdateTime(user_token['user_id']), listing_version)
+        if conditional_get.isNotModified(request, etag):
+            return conditional_get.notModified(etag)
 
     # get the user document and render the template. we will need to pull the address objects as well
     # you can use get_all as well, but it will not guarantee order. If order does not matter then use get_all
-    user = getUser(user_token).get()
-    return templates.TemplateResponse('main.html', {'request': request, 'user_token': user_token, 'error_message':error_message, 'user_info':user, 'file_list': file_list, 'directory_list':directory_list})
+    user = await getUser(users, user_token)
+    response = templates.TemplateResponse('main.html', {'request': request, 'user_token': user_token, 'error_message':error_message, 'user_info':user, 'file_list': listing['files'], 'directory_list': listing['directories'], 'prefix': prefix, 'parent_prefix': directory_index.parentPrefix(prefix), 'next_page_token': listing['next_page_token']})
+    return conditional_get.withETag(response, conditional_get.userETag(user_token, user.update_time, listing_version))
 
 # handler that will take in a string representing a directory and will create it in the bucket
 @app.post("/add-directory", response_class=RedirectResponse)
-async def addDirectoryHandler(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
+async def addDirectoryHandler(request: Request, login: request_auth.Login = Depends(requireLogin)):
     # do a couple of basic checks. if the string is zero length or does not end in a / then reject it
     form = await request.form()
     dir_name = form['dir_name']
     if dir_name == '' or dir_name[-1] != '/':
         return RedirectResponse("/")
     
-    # create the directory in the bucket and then redirect
-    addDirectory(dir_name)
+    # create the directory in the bucket, add it to the index and then redirect
+    await run_in_threadpool(addDirectory, dir_name)
+    bucket_index.addEntry(dir_name)
     return RedirectResponse("/", status_code=status.HTTP_302_FOUND)
 
 # handler that will take in a filename to dowload and will serve it to the user
 @app.post("/download-file", response_class=Response)
-async def downloadFileHandler(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
+async def downloadFileHandler(request: Request, login: request_auth.Login = Depends(requireLogin)):
     # pull the file name and see what filename we have for download
     form = await request.form()
     filename = form['filename']
-    return Response(downloadBlob(filename))
+    return await downloadBlob(filename, request.headers)
 
 # handler that will upload a file to the bucket. this will store it in the root of the bucket
 @app.post("/upload-file", response_class=RedirectResponse)
-async def uploadFileHandler(request: Request):
-    # there should be a toke. Validate it and if invalid, redirect back to / as a basic security measure
-    id_token = request.cookies.get("token")
-    user_token = validateFirebaseToken(id_token)
-    if not user_token:
-        return RedirectResponse("/")
-    
-    # if the file name is empty, the redirect to / and do nothing
-    form = await request.form()
-    if form['file_name'].filename == "":
-        return RedirectResponse("/", status_code=status.HTTP_302_FOUND)
-    
-    # redirect back after the directory is added
-    addFile(form['file_name'])
-    return RedirectResponse("/", status_code=status.HTTP_302_FOUND)
\ No newline at end of file
+async def uploadFileHandler(request: Request, login: request_auth.Login = Depends(requireLogin)):
+    # upload the file as the form comes in. if the file name is empty then nothing is uploaded
+    # redirect back after the file is added
+    blob = await addFile(request)
+    if blob:
+        bucket_index.addEntry(blob.name)
+    return RedirectResponse("/", status_code=status.HTTP_302_FOUND)
+
+
+# dependency for the admin only routes. the login has to have one of the emails listed in PROFILER_ADMINS
+async def requireAdmin(login: request_auth.Login = Depends(requireLogin)):
+    if not profiler.isAdmin(login.user_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return login
+
+
+# handler that reports the request and span histograms of this worker in the prometheus text format. they show how
+# long every route and the calls inside it take, so only admins can see them
+@app.get("/request-metrics", response_class=PlainTextResponse)
+async def requestMetrics(request: Request, login: request_auth.Login = Depends(requireAdmin)):
+    return request_metrics.render()
+
+
+# handler that reports how the pool of connections to cloud storage is being used. it is for the admins like the other
+# metrics
+@app.get("/storage-metrics")
+async def storageMetricsHandler(request: Request, login: request_auth.Login = Depends(requireAdmin)):
+    return storage_bucket.metrics()
+
+
+# admin routes that sample where the process spends its time and report when the event loop was blocked. they are only
+# there when ENABLE_PROFILER=1 is set
+profiler.attach(app, requireAdmin)
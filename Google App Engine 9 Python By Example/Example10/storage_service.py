@@ -0,0 +1,92 @@
+import os
+import threading
+
+import google.auth
+import requests
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+# how long a refresh of the credentials may take, the same as the storage client gives its own session
+CREDENTIALS_REFRESH_TIMEOUT = 300
+
+
+# http adapter with a fixed size connection pool that keeps count of how the pool is being used. when every connection
+# is busy a request will wait for one to come back rather than opening another one, and we count those waits
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, pool_size):
+        super().__init__(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.waits = 0
+        self.requests = 0
+
+    def send(self, request, **kwargs):
+        with self.lock:
+            if self.in_use >= self.pool_size:
+                self.waits += 1
+            self.in_use += 1
+            self.requests += 1
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            with self.lock:
+                self.in_use -= 1
+
+    # the number of open connections that are sitting in the pool waiting to be used
+    def idle(self):
+        idle = 0
+        for key in list(self.poolmanager.pools.keys()):
+            pool = self.poolmanager.pools.get(key)
+            if pool and pool.pool:
+                idle += sum(1 for connection in list(pool.pool.queue) if connection is not None)
+        return idle
+
+
+# one storage client for the whole process. credential discovery and the http session are done once when the app
+# starts and every request shares the same pool of connections to GCS. the requests session underneath is safe to share
+# between the worker threads as urllib3 hands each thread its own connection from the pool. this honours
+# STORAGE_EMULATOR_HOST so it can be pointed at fake-gcs-server or any other local stand in for GCS
+class StorageService:
+    def __init__(self, project, bucket_name, pool_size=32):
+        self.project = project
+        self.bucket_name = bucket_name
+        self.pool_size = pool_size
+        self.client = None
+        self.bucket = None
+        self.session = None
+        self.adapter = None
+
+    # the session is made with the pooled adapter already mounted and handed to the client, rather than left for the
+    # client to make on its first request. it is authorised with the default credentials, or not at all for an emulator
+    def start(self):
+        if os.environ.get('STORAGE_EMULATOR_HOST'):
+            credentials = AnonymousCredentials()
+            session = requests.Session()
+        else:
+            credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+            session = AuthorizedSession(credentials, refresh_timeout=CREDENTIALS_REFRESH_TIMEOUT)
+        self.adapter = PooledAdapter(self.pool_size)
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        self.session = session
+        self.client = storage.Client(project=self.project, credentials=credentials, _http=session)
+        self.bucket = self.client.bucket(self.bucket_name)
+
+    def stop(self):
+        if self.client:
+            self.client.close()
+        self.client = None
+        self.bucket = None
+        self.session = None
+
+    def metrics(self):
+        if not self.adapter:
+            return {'pool_size': self.pool_size, 'in_use': 0, 'idle': 0, 'waits': 0, 'requests': 0}
+        with self.adapter.lock:
+            in_use = self.adapter.in_use
+            waits = self.adapter.waits
+            requests = self.adapter.requests
+        return {'pool_size': self.pool_size, 'in_use': in_use, 'idle': self.adapter.idle(), 'waits': waits, 'requests': requests}
@@ -0,0 +1,27 @@
+# gunicorn settings for running any of the examples with uvicorn workers. gunicorn looks after the worker processes and
+# restarts one that dies, and each worker is a uvicorn server with its own event loop. the uvicorn worker uses uvloop
+# and httptools when they are installed. run it from an example folder, or set it as the entrypoint in app.yaml:
+#   gunicorn -c ../gunicorn.conf.py main:app
+# the same environment variables as serve.py are used: PORT, WEB_CONCURRENCY and DRAIN_SECONDS
+import os
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', 8080))
+workers = int(os.environ.get('WEB_CONCURRENCY') or os.cpu_count() or 1)
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# every worker imports the app itself. the firestore and storage clients must not be made before the fork as their
+# connections can not be shared between processes
+preload_app = False
+
+# on SIGTERM a worker stops taking new requests and has this long to finish the ones it has before it is killed. the
+# app shutdown events run once they are done
+graceful_timeout = int(os.environ.get('DRAIN_SECONDS', 10))
+
+# a worker that does not check in for this long is restarted. uploads and downloads are streamed so they keep the
+# worker busy for a long time without blocking it
+timeout = 120
+
+# keep connections from the app engine front end open between requests
+keepalive = 75
+
+accesslog = None
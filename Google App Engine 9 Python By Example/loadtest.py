@@ -0,0 +1,115 @@
+# load test that shows how the requests per second of an example go up with the number of worker processes. for each
+# worker count it starts the example with serve.py on a free port, sends requests to it from several client processes
+# for a while and prints the requests per second. by default it runs Example01 and Example10 with 1, 2, 4... workers up
+# to the number of cores:
+#   python loadtest.py
+#   python loadtest.py Example10 --path / --seconds 20 --connections 64
+# Example10 needs somewhere for its clients to point, so run it with the emulators and a project set, for example
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 STORAGE_EMULATOR_HOST=http://localhost:4443 GOOGLE_CLOUD_PROJECT=demo
+# the page that is loaded is the logged out root page, which renders the template without reading firestore or GCS
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def waitUntilUp(url, seconds=60):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('{} did not come up'.format(url))
+
+
+# one client process. it keeps its share of the connections busy until the time is up and returns how many requests
+# got a good response
+def clientProcess(url, connections, seconds, results):
+    async def run():
+        done = 0
+        deadline = time.monotonic() + seconds
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            async def worker():
+                nonlocal done
+                while time.monotonic() < deadline:
+                    response = await client.get(url)
+                    if response.status_code < 400:
+                        done += 1
+            await asyncio.gather(*[worker() for i in range(connections)])
+        return done
+    results.put(asyncio.run(run()))
+
+
+def measure(url, connections, seconds, clients):
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=clientProcess, args=(url, max(connections // clients, 1), seconds, results))
+        for i in range(clients)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    total = sum(results.get() for process in processes)
+    for process in processes:
+        process.join()
+    return total / (time.perf_counter() - start)
+
+
+def run(example, workers, path, connections, seconds, clients):
+    port = freePort()
+    env = dict(os.environ, PORT=str(port), HOST='127.0.0.1', WEB_CONCURRENCY=str(workers))
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, 'serve.py'), os.path.join(HERE, example)], env=env)
+    try:
+        url = 'http://127.0.0.1:{}{}'.format(port, path)
+        waitUntilUp(url)
+        return measure(url, connections, seconds, clients)
+    finally:
+        # stop it the way app engine does so the drain is exercised too
+        server.terminate()
+        server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('examples', nargs='*', default=['Example01', 'Example10'])
+    parser.add_argument('--path', default='/')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=max((os.cpu_count() or 1) // 2, 1))
+    parser.add_argument('--workers', type=int, nargs='*')
+    args = parser.parse_args()
+
+    worker_counts = args.workers
+    if not worker_counts:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= (os.cpu_count() or 1):
+            worker_counts.append(worker_counts[-1] * 2)
+
+    for example in args.examples:
+        baseline = None
+        for workers in worker_counts:
+            rate = run(example, workers, args.path, args.connections, args.seconds, args.clients)
+            baseline = baseline or rate
+            print('{}  {:>3} workers  {:>9.0f} req/s  {:.2f}x'.format(example, workers, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
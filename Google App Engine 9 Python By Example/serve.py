@@ -0,0 +1,54 @@
+# production entry point for any of the examples. it runs the app in main.py with several uvicorn worker processes, each
+# with its own event loop and its own firestore and storage clients, which the apps open and close in their startup
+# and shutdown events. uvloop and httptools are used when they are installed (pip install uvicorn[standard]) and the
+# plain asyncio loop and h11 parser otherwise. run it from an example folder or give it the folder:
+#   python ../serve.py
+#   python serve.py Example10
+# the settings come from the environment so they can be set in app.yaml:
+#   PORT              port to listen on, app engine sets this (default 8080)
+#   WEB_CONCURRENCY   number of worker processes (default one per core)
+#   DRAIN_SECONDS     how long a worker waits for running requests to finish after SIGTERM before it stops (default 10)
+# on SIGTERM uvicorn stops taking new connections, lets the running requests finish for up to DRAIN_SECONDS and then
+# runs the shutdown events, so the clients are closed after the last request rather than under it
+import importlib.util
+import os
+import sys
+
+import uvicorn
+
+
+def workerCount():
+    return int(os.environ.get('WEB_CONCURRENCY') or os.cpu_count() or 1)
+
+
+# the fastest event loop and http parser we have. uvicorn can work this out itself with 'auto', but naming them means
+# the log says which ones are in use
+def loopAndParser():
+    loop = 'uvloop' if importlib.util.find_spec('uvloop') else 'asyncio'
+    http = 'httptools' if importlib.util.find_spec('httptools') else 'h11'
+    return loop, http
+
+
+def main(app_dir='.'):
+    loop, http = loopAndParser()
+    workers = workerCount()
+    print('starting {} with {} workers, {} loop, {} parser'.format(os.path.abspath(app_dir), workers, loop, http))
+
+    # the apps read their static and template folders relative to where they are run from
+    os.chdir(app_dir)
+    uvicorn.run(
+        'main:app',
+        app_dir='.',
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', 8080)),
+        workers=workers,
+        loop=loop,
+        http=http,
+        lifespan='on',
+        timeout_graceful_shutdown=int(os.environ.get('DRAIN_SECONDS', 10)),
+        access_log=False,
+    )
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else '.')
@@ -0,0 +1,182 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# a batch is run as soon as it has this many inputs, or once the first input in it has waited this long. by default it
+# does not wait at all: the inputs that came in while the last batch was running are the next batch, which under load
+# fills the batches without making a request that comes in on its own wait for others that are not coming. a short
+# wait helps when the requests come in spread out and the model is slow enough to be worth it
+MAX_BATCH_SIZE = 32
+MAX_WAIT_SECONDS = 0.0
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_WAIT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+
+# a cumulative histogram the way prometheus keeps them: how many observations were at most each bucket's bound
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name, labels):
+        lines = []
+        total = 0
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+# a small fully connected network with fixed random weights, standing in for a real model. forward takes a batch of
+# inputs as the rows of a matrix and gives a row of class probabilities for each. residual adds the input of each
+# hidden layer back to its output, which needs the hidden layers to be the same size
+class Network:
+    def __init__(self, sizes, residual=False, seed=0):
+        rng = np.random.default_rng(seed)
+        self.input_size = sizes[0]
+        self.residual = residual
+        self.layers = [
+            (rng.standard_normal((n_in, n_out), dtype=np.float32) / np.sqrt(n_in), np.zeros(n_out, dtype=np.float32))
+            for n_in, n_out in zip(sizes, sizes[1:])
+        ]
+
+    def forward(self, inputs: np.ndarray) -> np.ndarray:
+        x = inputs
+        for i, (weights, bias) in enumerate(self.layers):
+            y = x @ weights + bias
+            if i == len(self.layers) - 1:
+                break
+            np.maximum(y, 0, out=y)
+            x = x + y if self.residual and i > 0 else y
+        y -= y.max(axis=1, keepdims=True)
+        np.exp(y, out=y)
+        y /= y.sum(axis=1, keepdims=True)
+        return y
+
+
+# collects the inputs of concurrent requests for one model into batches and runs each batch as one forward pass on a
+# thread of its own, so the weights are read once per batch rather than once per request and the event loop is free
+# meanwhile. numpy lets go of the GIL for the matrix products, so the models run in parallel with each other and with
+# the loop. a batch is taken as soon as max_batch_size inputs are waiting or max_wait seconds after the first one
+# came in, and while it runs the next one collects. each caller gets its own row of the result back.
+#
+# with max_batch_size=1 every request is a forward pass of its own, which is what the benchmark compares against
+class BatchScheduler:
+    def __init__(self, network, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT_SECONDS):
+        self.network = network
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_waits = Histogram(QUEUE_WAIT_BUCKETS)
+        self.loop = None
+        self.queue = None
+        self.worker = None
+        self.batch = []
+
+    async def predict(self, inputs) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        # the queue and the task that takes batches from it belong to one event loop. a new loop, as each TestClient
+        # has, gets new ones
+        if self.loop is not loop:
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.worker = loop.create_task(self.run())
+        future = loop.create_future()
+        self.queue.put_nowait((np.asarray(inputs, dtype=np.float32), future, time.perf_counter()))
+        return await future
+
+    # the batch is collected on the scheduler rather than in a local list, so the inputs already taken off the queue are
+    # still there for close to fail if it comes while we wait for more
+    async def next_batch(self):
+        self.batch = batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        self.batch = []
+        try:
+            while True:
+                batch = await self.next_batch()
+                # callers that went away while they waited are left out
+                batch = [entry for entry in batch if not entry[1].cancelled()]
+                if not batch:
+                    continue
+                started = time.perf_counter()
+                self.batch_sizes.observe(len(batch))
+                for inputs, future, queued in batch:
+                    self.queue_waits.observe(started - queued)
+                try:
+                    outputs = await self.loop.run_in_executor(self.executor, self.network.forward, np.stack([entry[0] for entry in batch]))
+                except Exception as e:
+                    for inputs, future, queued in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (inputs, future, queued), output in zip(batch, outputs):
+                    if not future.done():
+                        future.set_result(output)
+        finally:
+            # cancelled by close while a batch was being collected or run: its callers get the same error as the ones
+            # still queued
+            self.fail(self.batch)
+            self.batch = []
+
+    # stop taking batches on this event loop. every caller still waiting, queued, in the batch being collected or in
+    # the one that is running, gets a RuntimeError rather than waiting forever. the next request, on another loop,
+    # starts again
+    async def close(self):
+        if self.worker is not None and self.loop is asyncio.get_running_loop():
+            self.fail(self.drain())
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+        self.loop = self.queue = self.worker = None
+
+    def drain(self):
+        entries = []
+        while not self.queue.empty():
+            entries.append(self.queue.get_nowait())
+        return entries
+
+    def fail(self, entries):
+        for inputs, future, queued in entries:
+            if not future.done():
+                future.set_exception(RuntimeError("scheduler closed"))
+
+    def render(self, model_name):
+        labels = f'model="{model_name}"'
+        return [
+            *self.batch_sizes.render("model_batch_size", labels),
+            *self.queue_waits.render("model_queue_wait_seconds", labels),
+        ]
@@ -0,0 +1,90 @@
+# benchmark for the batching of /models/{model_name}. each model is sent requests from a number of clients that each
+# keep one request in flight, first with every request run as a forward pass of its own and then with the requests that
+# come in together run as one batch, waiting up to --max-wait seconds for more. it reports the throughput, the latency
+# percentiles and the average batch size at each concurrency. the requests go straight to the ASGI app, so what is
+# measured is the app and the model. run it from this folder:
+#   python benchmark_batching.py
+#   python benchmark_batching.py --models alexnet --concurrency 1 16 64 --requests 2000 --max-wait 0.002
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import numpy as np
+
+import main
+from batching import BATCH_SIZE_BUCKETS, MAX_WAIT_SECONDS, BatchScheduler, Histogram
+
+
+async def call(path, body):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"benchmark"), (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 50000), "server": ("benchmark", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = []
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await main.app(scope, receive, send)
+    return status[0]
+
+
+async def drive(model_name, bodies, requests, concurrency):
+    path = f"/models/{model_name}"
+    remaining = iter(range(requests))
+    latencies = []
+
+    async def client():
+        for i in remaining:
+            start = time.perf_counter()
+            status = await call(path, bodies[i % len(bodies)])
+            latencies.append(time.perf_counter() - start)
+            assert status == 200, status
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return requests / elapsed, 1000 * statistics.median(latencies), 1000 * latencies[int(0.99 * (len(latencies) - 1))]
+
+
+async def benchmark(settings):
+    rng = np.random.default_rng(0)
+    bodies = [json.dumps({"values": rng.standard_normal(main.INPUT_SIZE).tolist()}).encode() for i in range(64)]
+    for name in settings.models:
+        model_name = main.ModelName(name)
+        network = main.schedulers[model_name].network
+        for batched in (False, True):
+            for concurrency in settings.concurrency:
+                scheduler = BatchScheduler(network, max_wait=settings.max_wait) if batched else BatchScheduler(network, max_batch_size=1, max_wait=0)
+                main.schedulers[model_name] = scheduler
+                await drive(model_name.value, bodies, min(settings.requests, 10 * concurrency), concurrency)
+                scheduler.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+                throughput, p50, p99 = await drive(model_name.value, bodies, settings.requests, concurrency)
+                mean_batch = scheduler.batch_sizes.sum / max(scheduler.batch_sizes.count, 1)
+                print(f"{name:8} {'batched' if batched else 'single':8} c{concurrency:<4} {throughput:8.0f} req/s  "
+                      f"p50 {p50:7.2f}ms  p99 {p99:7.2f}ms  mean batch {mean_batch:5.1f}")
+                await scheduler.close()
+                scheduler.executor.shutdown()
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=[model_name.value for model_name in main.ModelName])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT_SECONDS)
+    asyncio.run(benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_()
@@ -1,5 +1,12 @@
+import os
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from enum import Enum
+from typing import Annotated
+
+from pydantic import BaseModel, Field
+
+from batching import BatchScheduler, Network
 
 app = FastAPI()
 
@@ -44,6 +51,46 @@ async def get_model(model_name: ModelName):
     
     return {"model_name": model_name, "message":"Have some residuals"}
 
+
+# the models behind the names, each with a scheduler that runs the requests that come in together as one batch
+INPUT_SIZE = 64
+CLASSES = 10
+
+schedulers = {
+    ModelName.alexnet: BatchScheduler(Network([INPUT_SIZE, 2048, 2048, CLASSES], seed=1)),
+    ModelName.resnet: BatchScheduler(Network([INPUT_SIZE, 1024, 1024, 1024, 1024, CLASSES], residual=True, seed=2)),
+    ModelName.lenet: BatchScheduler(Network([INPUT_SIZE, 120, 84, CLASSES], seed=3)),
+}
+
+
+async def close_schedulers():
+    for scheduler in schedulers.values():
+        await scheduler.close()
+
+app.add_event_handler("shutdown", close_schedulers)
+
+
+class Features(BaseModel):
+    values: Annotated[list[float], Field(min_length=INPUT_SIZE, max_length=INPUT_SIZE)]
+
+
+@app.post("/models/{model_name}")
+async def predict(model_name: ModelName, features: Features):
+    probabilities = await schedulers[model_name].predict(features.values)
+    return {"model_name": model_name, "label": int(probabilities.argmax()), "probabilities": probabilities.tolist()}
+
+
+# how big the batches have been and how long the requests waited for theirs, in the prometheus text format. there is no
+# login here to keep it to, so it is only there when ENABLE_MODEL_METRICS=1 is set
+async def model_metrics():
+    lines = []
+    for model_name, scheduler in schedulers.items():
+        lines.extend(scheduler.render(model_name.value))
+    return "\n".join(lines) + "\n"
+
+if os.environ.get("ENABLE_MODEL_METRICS", "0") == "1":
+    app.add_api_route("/model-metrics", model_metrics, response_class=PlainTextResponse)
+
 # path parameters containing paths
 @app.get("/files/{file_path:path}")
 async def read_file(file_path: str):
@@ -0,0 +1,61 @@
+# tests for BatchScheduler. they use a small network so each forward pass takes next to no time. run them from this
+# folder:
+#   python -m pytest test_batching.py
+import asyncio
+import time
+import unittest
+
+import numpy as np
+
+from batching import BatchScheduler, Network
+
+
+# a network that takes a while over each batch, so a batch can be caught while it runs
+class SlowNetwork(Network):
+    def forward(self, inputs):
+        time.sleep(0.05)
+        return super().forward(inputs)
+
+
+class BatchSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    def scheduler(self, network, **kwargs):
+        scheduler = BatchScheduler(network, **kwargs)
+        self.addCleanup(scheduler.executor.shutdown)
+        return scheduler
+
+    async def test_callers_get_their_own_rows(self):
+        network = Network([4, 8, 2])
+        scheduler = self.scheduler(network, max_batch_size=8, max_wait=0.01)
+        inputs = np.random.default_rng(0).standard_normal((5, 4)).astype(np.float32)
+        outputs = await asyncio.gather(*[scheduler.predict(row) for row in inputs])
+        np.testing.assert_allclose(np.stack(outputs), network.forward(inputs), rtol=1e-5)
+        self.assertEqual(scheduler.batch_sizes.sum, 5)
+        await scheduler.close()
+
+    async def test_close_during_the_wait_window_fails_the_batch_being_collected(self):
+        scheduler = self.scheduler(Network([4, 8, 2]), max_batch_size=8, max_wait=5.0)
+        caller = asyncio.ensure_future(scheduler.predict(np.zeros(4)))
+        await asyncio.sleep(0.05)
+        self.assertTrue(scheduler.queue.empty())
+        await scheduler.close()
+        with self.assertRaisesRegex(RuntimeError, "scheduler closed"):
+            await asyncio.wait_for(caller, 1)
+
+    async def test_close_fails_the_running_batch_and_the_queue(self):
+        scheduler = self.scheduler(SlowNetwork([4, 8, 2]), max_batch_size=2)
+        callers = [asyncio.ensure_future(scheduler.predict(np.zeros(4))) for i in range(5)]
+        await asyncio.sleep(0.01)
+        await scheduler.close()
+        results = await asyncio.wait_for(asyncio.gather(*callers, return_exceptions=True), 1)
+        self.assertEqual([str(result) for result in results], ["scheduler closed"] * 5)
+
+    async def test_a_new_request_after_close_starts_again(self):
+        scheduler = self.scheduler(Network([4, 8, 2]))
+        await scheduler.predict(np.zeros(4))
+        await scheduler.close()
+        self.assertEqual((await scheduler.predict(np.zeros(4))).shape, (2,))
+        await scheduler.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# benchmark for paging through the item store. it builds a store of 10M items and times a page at increasing depths,
+# once by offset (skip) and once by cursor (after), over the whole catalogue and over the items of one owner. then it
+# pages through a smaller store while items are being added in front of the reader and counts the items each way
+# shows twice or never. run it from this folder:
+#   python benchmark_pagination.py
+#   python benchmark_pagination.py --items 1000000 --limit 50
+# both ways take a page as a slice of a sorted index, so an offset is not a scan here as it would be in a database. what
+# offset paging still gets wrong is a catalogue that changes between pages, which is what the second part shows
+import argparse
+import resource
+import statistics
+import time
+
+from item_store import ItemStore, encode_cursor
+
+NAMES = ["FOO", "BAR", "BAZ", "QUX", "QUUX", "CORGE", "GRAULT", "GARPLY"]
+
+
+def make_items(count, owners):
+    for i in range(count):
+        yield f"item-{i:08d}", NAMES[i % len(NAMES)], i % owners
+
+
+def time_call(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        function()
+        timings.append(time.perf_counter_ns() - start)
+    return statistics.median(timings) / 1000
+
+
+def deep_pages(store, limit, repeats, owner_id=None):
+    index, low, high = store.index_range(owner_id)
+    size = high - low
+    depths = sorted({0, 1000, 100_000, 1_000_000, size // 2, size - limit} & set(range(size)))
+    label = "all items" if owner_id is None else f"owner {owner_id}"
+    for depth in depths:
+        # the cursor a client would have been handed on the page before this one
+        cursor = encode_cursor(store.row_dict(index[low + depth - 1])["item_id"]) if depth else None
+        offset = time_call(lambda: store.page_at(depth, limit, owner_id), repeats)
+        if cursor:
+            by_cursor = time_call(lambda: store.page_after(cursor, limit, owner_id), repeats)
+        else:
+            by_cursor = offset
+        print(f"{label:12} depth {depth:>10}  offset {offset:8.1f}us  cursor {by_cursor:8.1f}us")
+
+
+# page through a store while new items are added in front of the page being read, the way a busy catalogue changes
+# between the requests of a client paging through it. the new items are left out of the count, so every original
+# item should be seen exactly once
+def changing_catalogue(count, limit, inserts_per_page, use_cursor):
+    store = ItemStore(make_items(count, 10))
+    original = {f"item-{i:08d}" for i in range(count)}
+    seen = []
+    skip = 0
+    cursor = None
+    added = 0
+    while True:
+        if use_cursor and cursor:
+            page, cursor = store.page_after(cursor, limit)
+        else:
+            page, cursor = store.page_at(skip, limit)
+        seen.extend(item["item_id"] for item in page if item["item_id"] in original)
+        skip += limit
+        if not cursor:
+            break
+        # new items that sort in front of the page that was just read
+        for _ in range(inserts_per_page):
+            store.add(f"item-00000000-{added:08d}", "NEW", 0)
+            added += 1
+    duplicates = len(seen) - len(set(seen))
+    missed = len(original - set(seen))
+    return duplicates, missed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=10_000_000)
+    parser.add_argument("--owners", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = ItemStore(make_items(args.items, args.owners))
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"built {len(store)} items in {time.perf_counter() - start:.1f}s, max rss {max_rss:.0f}MiB")
+
+    lookup = time_call(lambda: store.get(f"item-{args.items // 2:08d}"), args.repeats)
+    print(f"point lookup {lookup:.1f}us")
+    deep_pages(store, args.limit, args.repeats)
+    deep_pages(store, args.limit, args.repeats, owner_id=args.owners - 1)
+
+    for use_cursor in (False, True):
+        duplicates, missed = changing_catalogue(10_000, 100, 5, use_cursor)
+        print(f"changing catalogue by {'cursor' if use_cursor else 'offset':6}  shown twice {duplicates:5}  never shown {missed:5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import base64
+import bisect
+import json
+from array import array
+
+MAX_LIMIT = 1000
+
+
+# opaque cursors for keyset pagination. a cursor holds the item_id of the last item on the page, and the next page
+# starts right after that item_id in the index, however many items have been added or removed in front of it
+def encode_cursor(item_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([item_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str | None:
+    try:
+        (item_id,) = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    return item_id if isinstance(item_id, str) else None
+
+
+# a catalogue of items kept in flat arrays rather than a dict per item. row r is the r-th item added: its owner is
+# owner_ids[r] and its item_id and item_name are utf-8 bytes in one bytearray each, between offsets[r] and
+# offsets[r + 1]. utf-8 bytes sort in the same order as the strings, so the indexes compare bytes and never decode.
+#
+# two sorted arrays of row numbers are the indexes:
+#   by_id     every row in item_id order, for point lookups and for paging through the whole catalogue
+#   by_owner  every row in (owner_id, item_id) order, for the items of one user
+# a lookup is a binary search of an index and a page is a slice of it, so neither depends on the size of the store
+class ItemStore:
+    def __init__(self, items=()):
+        self.owner_ids = array("q")
+        self.ids = bytearray()
+        self.id_offsets = array("Q", [0])
+        self.names = bytearray()
+        self.name_offsets = array("Q", [0])
+        self.by_id = array("I")
+        self.by_owner = array("I")
+        self.extend(items)
+
+    def __len__(self):
+        return len(self.owner_ids)
+
+    def id_key(self, row: int) -> bytes:
+        return self.ids[self.id_offsets[row] : self.id_offsets[row + 1]]
+
+    def owner_key(self, row: int) -> tuple[int, bytes]:
+        return self.owner_ids[row], self.id_key(row)
+
+    def row_dict(self, row: int) -> dict:
+        return {
+            "item_id": self.id_key(row).decode(),
+            "item_name": self.names[self.name_offsets[row] : self.name_offsets[row + 1]].decode(),
+            "owner_id": self.owner_ids[row],
+        }
+
+    def append_row(self, item_id: str, item_name: str, owner_id: int) -> int:
+        row = len(self.owner_ids)
+        self.owner_ids.append(owner_id)
+        self.ids += item_id.encode()
+        self.id_offsets.append(len(self.ids))
+        self.names += item_name.encode()
+        self.name_offsets.append(len(self.names))
+        return row
+
+    # add one item, keeping both indexes sorted. an item_id that is already there is an error, as it is the key
+    def add(self, item_id: str, item_name: str, owner_id: int) -> dict:
+        key = item_id.encode()
+        position = bisect.bisect_left(self.by_id, key, key=self.id_key)
+        if position < len(self.by_id) and self.id_key(self.by_id[position]) == key:
+            raise KeyError(item_id)
+        row = self.append_row(item_id, item_name, owner_id)
+        self.by_id.insert(position, row)
+        self.by_owner.insert(bisect.bisect_left(self.by_owner, (owner_id, key), key=self.owner_key), row)
+        return self.row_dict(row)
+
+    # add a lot of items at once and build the indexes once at the end rather than keeping them sorted as we go.
+    # items are (item_id, item_name, owner_id) tuples
+    def extend(self, items):
+        start = len(self.owner_ids)
+        for item_id, item_name, owner_id in items:
+            self.append_row(item_id, item_name, owner_id)
+        if len(self.owner_ids) > start:
+            self.build_indexes()
+
+    def build_indexes(self):
+        rows = range(len(self.owner_ids))
+        # items usually arrive in item_id order, in which case the index is just the rows in order
+        if all(self.id_key(row - 1) < self.id_key(row) for row in range(1, len(rows))):
+            self.by_id = array("I", rows)
+        else:
+            self.by_id = array("I", sorted(rows, key=self.id_key))
+            for previous, row in zip(self.by_id, self.by_id[1:]):
+                if self.id_key(previous) == self.id_key(row):
+                    raise KeyError(self.id_key(row).decode())
+
+        # group the rows in item_id order by owner, which leaves each owner's rows in item_id order too
+        owners = {}
+        for row in self.by_id:
+            owners.setdefault(self.owner_ids[row], array("I")).append(row)
+        self.by_owner = array("I")
+        for owner_id in sorted(owners):
+            self.by_owner.extend(owners[owner_id])
+
+    def get(self, item_id: str) -> dict | None:
+        key = item_id.encode()
+        position = bisect.bisect_left(self.by_id, key, key=self.id_key)
+        if position < len(self.by_id) and self.id_key(self.by_id[position]) == key:
+            return self.row_dict(self.by_id[position])
+        return None
+
+    def get_for_owner(self, owner_id: int, item_id: str) -> dict | None:
+        key = (owner_id, item_id.encode())
+        position = bisect.bisect_left(self.by_owner, key, key=self.owner_key)
+        if position < len(self.by_owner) and self.owner_key(self.by_owner[position]) == key:
+            return self.row_dict(self.by_owner[position])
+        return None
+
+    # the part of an index a page is taken from: all of by_id, or the run of one owner's rows in by_owner
+    def index_range(self, owner_id: int | None) -> tuple[array, int, int]:
+        if owner_id is None:
+            return self.by_id, 0, len(self.by_id)
+        low = bisect.bisect_left(self.by_owner, owner_id, key=self.owner_ids.__getitem__)
+        high = bisect.bisect_right(self.by_owner, owner_id, lo=low, key=self.owner_ids.__getitem__)
+        return self.by_owner, low, high
+
+    def page(self, index: array, start: int, end: int, limit: int) -> tuple[list[dict], str | None]:
+        stop = min(start + limit, end)
+        items = [self.row_dict(row) for row in index[start:stop]]
+        next_cursor = encode_cursor(items[-1]["item_id"]) if items and stop < end else None
+        return items, next_cursor
+
+    # a page by offset, the way skip/limit has always worked. the cursor for the page after it is returned as well
+    def page_at(self, skip: int, limit: int, owner_id: int | None = None) -> tuple[list[dict], str | None]:
+        index, low, high = self.index_range(owner_id)
+        return self.page(index, low + max(skip, 0), high, min(max(limit, 0), MAX_LIMIT))
+
+    # the page that starts after the item in the cursor. ValueError if the cursor is not one of ours
+    def page_after(self, cursor: str, limit: int, owner_id: int | None = None) -> tuple[list[dict], str | None]:
+        item_id = decode_cursor(cursor)
+        if item_id is None:
+            raise ValueError("invalid cursor")
+        index, low, high = self.index_range(owner_id)
+        if owner_id is None:
+            start = bisect.bisect_right(index, item_id.encode(), lo=low, hi=high, key=self.id_key)
+        else:
+            start = bisect.bisect_right(index, (owner_id, item_id.encode()), lo=low, hi=high, key=self.owner_key)
+        return self.page(index, start, high, min(max(limit, 0), MAX_LIMIT))
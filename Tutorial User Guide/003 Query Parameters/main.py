@@ -1,21 +1,44 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
+
+from item_store import ItemStore
 
 app = FastAPI()
 
-fake_items_db = [{"item_name":"FOO"}, {"item_name":"BAR"}, {"item_name":"BAZ"}]
+# items are kept in an indexed store rather than a list, so looking one up or jumping to any page does not depend on
+# how many there are
+items_db = ItemStore([("item-001", "FOO", 1), ("item-002", "BAR", 1), ("item-003", "BAZ", 2)])
 
 
+# skip/limit still works, but a client paging through a catalogue that is changing should follow the cursor in the
+# Link header instead. after= starts right after the last item it was given, so nothing is skipped or shown twice when
+# items are added or removed in front of it
 @app.get("/items/")
-async def read_item(skip: int = 0, limit: int = 10):
-    return fake_items_db[skip : skip + limit]
+async def read_item(
+    request: Request, response: Response, skip: int = 0, limit: int = 10, after: str | None = None, owner_id: int | None = None
+):
+    if after is not None:
+        try:
+            page, next_cursor = items_db.page_after(after, limit, owner_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    else:
+        page, next_cursor = items_db.page_at(skip, limit, owner_id)
+
+    if next_cursor:
+        next_url = request.url.remove_query_params("skip").include_query_params(after=next_cursor)
+        response.headers["link"] = f'<{next_url}>; rel="next"'
+    return page
 
 
 # optional parameters
 @app.get("/items_2/{item_id}")
 async def read_item_2(item_id: str, q: str | None = None):
+    item = items_db.get(item_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
     if q:
-        return {"item_id": item_id, "q":q}
-    return {"item_id": item_id}
+        item.update({"q":q})
+    return item
 
 
 # Query parameter type conversion
@@ -38,7 +61,9 @@ async def read_item_3(item_id: str, q: str | None = None, short: bool = False):
 async def read_user_item(
     user_id: int, item_id: str, q: str | None = None, short: bool = False
 ):
-    item = {"item_id": item_id, "owner_id": user_id}
+    item = items_db.get_for_owner(user_id, item_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
     if q:
         item.update({"q":q})
     if not short:
@@ -0,0 +1,111 @@
+# benchmark for /items/bulk. it uploads growing numbers of items, as NDJSON and as a JSON array, and reports how many
+# items a second go in and the most memory the upload took, which should not grow with the size of the upload. the
+# same items sent one request each to create_item are timed for comparison. the requests go straight to the ASGI app,
+# with the upload made up chunk by chunk as it is read and the results thrown away as they come, so neither side holds
+# the whole of it. run it from this folder:
+#   python benchmark_bulk.py
+#   python benchmark_bulk.py --items 10000 100000 --chunk-kib 16
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from main import app
+
+# one in this many items is missing its price, so the batches with an error in them are part of the numbers
+BAD_EVERY = 1000
+
+
+def item_line(i):
+    if i % BAD_EVERY == BAD_EVERY - 1:
+        return json.dumps({"name": f"Item {i}"}).encode()
+    return json.dumps({"name": f"Item {i}", "description": "The pretender", "price": 42.0 + i % 100, "tax": 3.2}).encode()
+
+
+# the body of an upload of count items, made as it is read, in chunks of about chunk_size bytes
+def upload(count, chunk_size, array):
+    chunk = bytearray(b"[" if array else b"")
+    for i in range(count):
+        chunk += item_line(i)
+        if i < count - 1:
+            chunk += b"," if array else b"\n"
+        if len(chunk) >= chunk_size:
+            yield bytes(chunk)
+            chunk.clear()
+    if array:
+        chunk += b"]"
+    yield bytes(chunk)
+
+
+async def call(path, content_type, chunks):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"benchmark"), (b"content-type", content_type.encode())],
+        "client": ("127.0.0.1", 50000), "server": ("benchmark", 80),
+    }
+    chunks = iter(chunks)
+    response = {"lines": 0, "last": b""}
+
+    async def receive():
+        chunk = next(chunks, None)
+        if chunk is None:
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return {"type": "http.request", "body": chunk, "more_body": True}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message.get("body"):
+            response["lines"] += message["body"].count(b"\n")
+            response["last"] = message["body"]
+
+    await app(scope, receive, send)
+    return response
+
+
+# the upload is made twice, once timed and once with tracemalloc on to find the peak, as tracing slows it down a lot
+async def bulk(count, chunk_size, array):
+    content_type = "application/json" if array else "application/x-ndjson"
+    start = time.perf_counter()
+    response = await call("/items/bulk", content_type, upload(count, chunk_size, array))
+    elapsed = time.perf_counter() - start
+    summary = json.loads(response["last"].splitlines()[-1])
+    assert summary["created"] + summary["failed"] == count, summary
+
+    tracemalloc.start()
+    try:
+        await call("/items/bulk", content_type, upload(count, chunk_size, array))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return count / elapsed, peak / 1024, summary
+
+
+async def one_at_a_time(count):
+    start = time.perf_counter()
+    for i in range(count):
+        await call("/items/", "application/json", [item_line(i)])
+    return count / (time.perf_counter() - start)
+
+
+async def benchmark(settings):
+    print(f"create_item one request per item     {await one_at_a_time(settings.single):10.0f} items/s")
+    for array in (False, True):
+        for count in settings.items:
+            rate, peak, summary = await bulk(count, settings.chunk_kib * 1024, array)
+            print(f"/items/bulk {'array ' if array else 'ndjson'} {count:>9} items  {rate:10.0f} items/s  peak {peak:8.0f}KiB  "
+                  f"created {summary['created']} failed {summary['failed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--single", type=int, default=5000)
+    parser.add_argument("--chunk-kib", type=int, default=64)
+    asyncio.run(benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
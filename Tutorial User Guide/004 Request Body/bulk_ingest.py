@@ -0,0 +1,247 @@
+import json
+import re
+
+from pydantic import TypeAdapter, ValidationError
+from pydantic_core import from_json
+from starlette.responses import StreamingResponse
+
+# records are validated this many at a time, as one list, which costs pydantic-core about as much per item as a single
+# one does per request less the overhead of a call per item
+BATCH_SIZE = 500
+
+# the most one record can take. a longer one is reported as an error and skipped rather than kept whole in memory, so
+# what is held at any time is one chunk of the upload, one batch and at most this much of a record
+MAX_RECORD_BYTES = 1024 * 1024
+
+
+class RecordTooLarge(Exception):
+    pass
+
+
+# splits an application/x-ndjson upload into its lines as the chunks come in. blank lines are skipped but still
+# counted, so the line numbers in the results are the line numbers of the upload
+class LineSplitter:
+    def __init__(self, max_record_bytes=MAX_RECORD_BYTES):
+        self.max_record_bytes = max_record_bytes
+        self.buffer = bytearray()
+        self.line = 0
+        self.skipping = False
+
+    # (line, bytes) for every record finished in this chunk, or (line, RecordTooLarge) for one over the limit
+    def feed(self, chunk: bytes):
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end == -1:
+                break
+            self.line += 1
+            if self.skipping:
+                self.skipping = False
+                yield self.line, RecordTooLarge()
+            else:
+                record = bytes(self.buffer) + chunk[start:end] if self.buffer else chunk[start:end]
+                self.buffer.clear()
+                if len(record) > self.max_record_bytes:
+                    yield self.line, RecordTooLarge()
+                elif record.strip():
+                    yield self.line, record
+            start = end + 1
+        if not self.skipping:
+            self.buffer += chunk[start:]
+            if len(self.buffer) > self.max_record_bytes:
+                self.buffer.clear()
+                self.skipping = True
+
+    def close(self):
+        if self.skipping or self.buffer.strip():
+            self.line += 1
+            yield self.line, RecordTooLarge() if self.skipping else bytes(self.buffer)
+        self.buffer.clear()
+
+
+# the characters that matter to the structure of a JSON array. everything between them is copied as it is
+STRUCTURE = re.compile(rb'[\[\]{}",\\]')
+
+
+# splits an application/json upload that is an array of objects into its elements as the chunks come in, without
+# parsing them. it only keeps track of how deep in brackets it is and whether it is inside a string, and cuts at the
+# commas between the elements of the outer array. the elements are numbered from 1 in place of line numbers. anything
+# that is not an array is an error for the whole upload (ValueError)
+class ArraySplitter:
+    def __init__(self, max_record_bytes=MAX_RECORD_BYTES):
+        self.max_record_bytes = max_record_bytes
+        self.buffer = bytearray()
+        self.line = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.finished = False
+        self.skipping = False
+
+    def feed(self, chunk: bytes):
+        start = 0
+        if not self.started:
+            stripped = chunk.lstrip()
+            if not stripped:
+                return
+            if stripped[:1] != b"[":
+                raise ValueError("the body is not a JSON array")
+            self.started = True
+            start = len(chunk) - len(stripped) + 1
+
+        # the position of the character after a backslash in a string, which is taken as it is
+        escaped = start if self.escaped else -1
+        for match in STRUCTURE.finditer(chunk, start):
+            index = match.start()
+            character = match.group()
+            if self.in_string:
+                if index == escaped:
+                    continue
+                if character == b"\\":
+                    escaped = index + 1
+                elif character == b'"':
+                    self.in_string = False
+            elif self.finished:
+                raise ValueError("there is more after the end of the array")
+            elif character == b'"':
+                self.in_string = True
+            elif character in b"[{":
+                self.depth += 1
+            elif self.depth > 0 and character in b"]}":
+                self.depth -= 1
+            elif self.depth == 0 and character in b",]":
+                self.take(chunk, start, index)
+                yield from self.record(character == b"]")
+                start = index + 1
+                self.finished = character == b"]"
+        self.escaped = escaped == len(chunk)
+        self.take(chunk, start, len(chunk))
+
+    def take(self, chunk, start, end):
+        if self.finished:
+            if chunk[start:end].strip():
+                raise ValueError("there is more after the end of the array")
+        elif not self.skipping:
+            self.buffer += chunk[start:end]
+            if len(self.buffer) > self.max_record_bytes:
+                self.buffer.clear()
+                self.skipping = True
+
+    def record(self, last):
+        record = bytes(self.buffer)
+        self.buffer.clear()
+        if self.skipping:
+            self.skipping = False
+            self.line += 1
+            yield self.line, RecordTooLarge()
+        elif record.strip():
+            self.line += 1
+            yield self.line, record
+        elif not (last and self.line == 0):
+            # an empty element, as in [1,,2] or [1,]
+            raise ValueError("the array has an empty element")
+
+    def close(self):
+        if not self.finished:
+            raise ValueError("the array is not closed")
+        yield from ()
+
+
+# a StreamingResponse that does not read from the client while it streams. the usual one waits on receive for the
+# client to go away, which would take the chunks of the upload from under the handler that is still reading it. a
+# client that goes away is found out by the upload instead, which raises ClientDisconnect
+class IngestResponse(StreamingResponse):
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+# validates the records of an upload in batches and yields a result for each one as its batch is done: the item made
+# from it by make_item, or the errors that kept it from being one. it finishes with how many were created and failed
+class BulkIngest:
+    def __init__(self, model, make_item, batch_size=BATCH_SIZE):
+        self.record_adapter = TypeAdapter(model)
+        self.batch_adapter = TypeAdapter(list[model])
+        self.make_item = make_item
+        self.batch_size = batch_size
+        self.created = 0
+        self.failed = 0
+
+    async def results(self, chunks, splitter):
+        batch = []
+        error = None
+        try:
+            async for chunk in chunks:
+                for record in splitter.feed(chunk):
+                    batch.append(record)
+                    if len(batch) == self.batch_size:
+                        yield self.validate(batch)
+                        batch = []
+                # whatever is complete when the chunk runs out is sent back rather than kept for a full batch
+                if batch:
+                    yield self.validate(batch)
+                    batch = []
+            batch.extend(splitter.close())
+        except ValueError as e:
+            # the upload is not an array after all. the records before the point it went wrong still count
+            self.failed += 1
+            error = {"line": splitter.line + 1, "errors": [{"type": "json_invalid", "msg": str(e)}]}
+        if batch:
+            yield self.validate(batch)
+        if error:
+            yield self.line(error)
+        yield self.line({"created": self.created, "failed": self.failed})
+
+    # each record is parsed on its own, with the JSON parser pydantic uses, so what one record is never depends on the
+    # records next to it. the values that parse are then validated together as one list. the errors of the list say
+    # which of its values were wrong, and those get their errors from it while the rest are validated again as a list
+    # of their own. a record that is not one JSON value is sent through validate_one for its json_invalid error
+    def validate(self, batch) -> bytes:
+        results = {}
+        parsed = []
+        for line, record in batch:
+            if isinstance(record, RecordTooLarge):
+                results[line] = self.validate_one(line, record)
+                continue
+            try:
+                parsed.append((line, from_json(record)))
+            except ValueError:
+                results[line] = self.validate_one(line, record)
+
+        while parsed:
+            try:
+                items = self.batch_adapter.validate_python([value for line, value in parsed])
+            except ValidationError as e:
+                errors = {}
+                for error in e.errors(include_url=False, include_context=False, include_input=False):
+                    errors.setdefault(error["loc"][0], []).append({**error, "loc": error["loc"][1:]})
+                for position, record_errors in errors.items():
+                    self.failed += 1
+                    line = parsed[position][0]
+                    results[line] = self.line({"line": line, "errors": record_errors})
+                parsed = [entry for position, entry in enumerate(parsed) if position not in errors]
+                continue
+            self.created += len(items)
+            for (line, value), item in zip(parsed, items):
+                results[line] = self.line({"line": line, "item": self.make_item(item)})
+            break
+        return b"".join(results[line] for line in sorted(results))
+
+    def validate_one(self, line, record) -> bytes:
+        if isinstance(record, RecordTooLarge):
+            self.failed += 1
+            return self.line({"line": line, "errors": [{"type": "too_long", "msg": f"a record can be at most {MAX_RECORD_BYTES} bytes"}]})
+        try:
+            item = self.record_adapter.validate_json(record)
+        except ValidationError as e:
+            self.failed += 1
+            return self.line({"line": line, "errors": e.errors(include_url=False, include_context=False, include_input=False)})
+        self.created += 1
+        return self.line({"line": line, "item": self.make_item(item)})
+
+    def line(self, result) -> bytes:
+        return json.dumps(result).encode() + b"\n"
@@ -0,0 +1,71 @@
+import asyncio
+import functools
+
+from fastapi.exceptions import ResponseValidationError
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from starlette.responses import Response
+
+
+# a response for content that is already JSON bytes, the way ORJSONResponse is used, but with the encoding done by the
+# serializer of the route rather than by the response
+class JSONBytesResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return super().render(content)
+
+
+# a route that writes its response with a pydantic-core serializer compiled from its response_model when the route is
+# added, rather than having FastAPI dump the models to dicts, walk them with jsonable_encoder and then encode them.
+# what the endpoint returns is validated into the response_model, which takes the models inside it as they are, and
+# the serializer writes JSON bytes from that in one go. the response_model_* options of the route are passed on to it.
+#
+# it is opt in for a whole app with
+#   app.router.route_class = CompiledJSONRoute
+# before any routes are added. routes without a response_model, and endpoints that return a Response of their own, are
+# left as FastAPI makes them. headers or a status code set on a Response parameter of the endpoint are not used, as
+# with any endpoint that returns a Response
+class CompiledJSONRoute(APIRoute):
+    def get_route_handler(self):
+        if self.response_model is not None and self.dependant.call is not None:
+            self.dependant.call = self.compile(self.dependant.call)
+        return super().get_route_handler()
+
+    def compile(self, call):
+        adapter = TypeAdapter(self.response_model)
+        # a model instance needs no validating. anything else, a dict of models or a list of them, is validated into it
+        model_class = self.response_model if isinstance(self.response_model, type) and issubclass(self.response_model, BaseModel) else None
+        options = {
+            "include": self.response_model_include,
+            "exclude": self.response_model_exclude,
+            "by_alias": self.response_model_by_alias,
+            "exclude_unset": self.response_model_exclude_unset,
+            "exclude_defaults": self.response_model_exclude_defaults,
+            "exclude_none": self.response_model_exclude_none,
+        }
+        status_code = self.status_code or 200
+
+        def render(content):
+            if isinstance(content, Response):
+                return content
+            if model_class is None or not isinstance(content, model_class):
+                try:
+                    content = adapter.validate_python(content)
+                except ValidationError as e:
+                    raise ResponseValidationError(errors=e.errors(), body=content)
+            return JSONBytesResponse(adapter.dump_json(content, **options), status_code=status_code)
+
+        # FastAPI runs the endpoint on the event loop or in the thread pool depending on whether it is a coroutine
+        # function, so the wrapper has to be the same kind
+        if asyncio.iscoroutinefunction(call):
+            @functools.wraps(call)
+            async def endpoint(*args, **kwargs):
+                return render(await call(*args, **kwargs))
+        else:
+            @functools.wraps(call)
+            def endpoint(*args, **kwargs):
+                return render(call(*args, **kwargs))
+        return endpoint
@@ -1,6 +1,9 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from pydantic import BaseModel
 
+from bulk_ingest import ArraySplitter, BulkIngest, IngestResponse, LineSplitter
+from compiled_json import CompiledJSONRoute
+
 
 class Item(BaseModel):
     name: str
@@ -9,19 +12,49 @@ class Item(BaseModel):
     tax: float | None = None
 
 
+# what the routes send back. keys the handlers leave out are left out of the response too (response_model_exclude_unset)
+class ItemWithTax(Item):
+    price_with_tax: float | None = None
+
+
+class UpdatedItem(Item):
+    item_id: int
+    q: str | None = None
+
+
 app = FastAPI()
+# responses are written straight to JSON by serializers compiled from each route's response_model
+app.router.route_class = CompiledJSONRoute
 
 
-@app.post("/items/")
-async def create_item(item: Item):
+def item_with_tax(item: Item) -> dict:
     item_dict = item.model_dump()
     if item.tax:
         price_with_tax = item.price + item.tax
         item_dict.update({"price_with_tax": price_with_tax})
     return item_dict
 
+
+@app.post("/items/", response_model=ItemWithTax, response_model_exclude_unset=True)
+async def create_item(item: Item):
+    return item_with_tax(item)
+
+
+# many items in one request, one Item per line (application/x-ndjson) or as a JSON array (application/json). the body
+# is read as it arrives and validated in batches, and a line goes back for every item as its batch is done, with the
+# item as create_item returns it or the errors for it:
+#   {"line": 1, "item": {"name": "Foo", ..., "price_with_tax": 45.2}}
+#   {"line": 2, "errors": [{"type": "missing", "loc": ["price"], "msg": "Field required"}]}
+#   {"created": 1, "failed": 1}
+@app.post("/items/bulk")
+async def create_items(request: Request):
+    content_type = request.headers.get("content-type", "")
+    splitter = ArraySplitter() if content_type.startswith("application/json") else LineSplitter()
+    ingest = BulkIngest(Item, item_with_tax)
+    return IngestResponse(ingest.results(request.stream(), splitter))
+
 # request body + path parameters
-@app.put("/items/{item_id}")
+@app.put("/items/{item_id}", response_model=UpdatedItem, response_model_exclude_unset=True)
 async def update_item(item_id: int, item: Item, q: str | None = None):
     result = {"item_id": item_id, **item.model_dump()}
 
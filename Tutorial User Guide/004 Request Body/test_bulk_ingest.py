@@ -0,0 +1,61 @@
+# tests for the bulk ingest of /items/bulk. they run the records through BulkIngest directly, with the upload handed
+# over in chunks as a request would. run them from this folder:
+#   python -m pytest test_bulk_ingest.py
+import json
+import unittest
+
+from bulk_ingest import ArraySplitter, BulkIngest, LineSplitter
+from main import Item, item_with_tax
+
+
+async def upload(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class BulkIngestTest(unittest.IsolatedAsyncioTestCase):
+    async def ingest(self, chunks, splitter=None):
+        ingest = BulkIngest(Item, item_with_tax)
+        body = b"".join([part async for part in ingest.results(upload(chunks), splitter or LineSplitter())])
+        return [json.loads(line) for line in body.splitlines()]
+
+    async def test_each_line_is_parsed_on_its_own(self):
+        # none of these lines is an item by itself, but joined with commas they would make three
+        lines = [
+            b'{"name":"a","price":1,"description":"',
+            b'","price":2}',
+            b'{"name":"c","price":3},{"name":"d","price":4}',
+        ]
+        results = await self.ingest([b"\n".join(lines) + b"\n"])
+        self.assertEqual([result["line"] for result in results[:-1]], [1, 2, 3])
+        for result in results[:-1]:
+            self.assertNotIn("item", result)
+            self.assertEqual(result["errors"][0]["type"], "json_invalid")
+        self.assertEqual(results[-1], {"created": 0, "failed": 3})
+
+    async def test_a_bad_line_does_not_change_its_neighbours(self):
+        lines = [
+            b'{"name":"a","price":1}',
+            b'{"name":"b"}',
+            b'not json',
+            b'{"name":"d","price":4,"tax":1}',
+        ]
+        results = await self.ingest([b"\n".join(lines[:2]) + b"\n", b"\n".join(lines[2:]) + b"\n"])
+        self.assertEqual(results[0], {"line": 1, "item": {"name": "a", "description": None, "price": 1.0, "tax": None}})
+        self.assertEqual(results[1]["line"], 2)
+        self.assertEqual([(error["type"], error["loc"]) for error in results[1]["errors"]], [("missing", ["price"])])
+        self.assertEqual(results[2]["line"], 3)
+        self.assertEqual(results[2]["errors"][0]["type"], "json_invalid")
+        self.assertEqual(results[3]["item"]["price_with_tax"], 5.0)
+        self.assertEqual(results[-1], {"created": 2, "failed": 2})
+
+    async def test_array_elements_are_items(self):
+        body = b'[{"name":"a","price":1}, {"name":"b"}, {"name":"c","price":3}]'
+        results = await self.ingest([body[:20], body[20:]], ArraySplitter())
+        self.assertEqual([result["line"] for result in results[:-1]], [1, 2, 3])
+        self.assertIn("errors", results[1])
+        self.assertEqual(results[-1], {"created": 2, "failed": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# benchmark for the search index behind /items_2/. it adds a catalogue of made up items one at a time, the way
+# create_item does, then times searches for several words at once with AND and OR against checking every item. the
+# words are drawn with a skewed distribution like real text, so the queries mix common words with rare ones. the scan
+# is given the words of every item as a set up front so it only pays for the check itself. run it from this folder:
+#   python benchmark_search.py
+#   python benchmark_search.py --items 200000 --vocabulary 20000
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from search_index import SearchIndex, tokenize
+
+QUERIES = [
+    ("common + common", [1, 2]),
+    ("common + rare", [3, 2000]),
+    ("three mid", [50, 80, 120]),
+    ("rare + rare", [4000, 6000]),
+    ("five mixed", [5, 40, 300, 1500, 7000]),
+]
+
+
+def make_items(count, vocabulary, words_per_item, seed=1):
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    # zipf like weights, word i turns up about 1/i as often as the first. cumulative so choices does not add them up
+    # again for every item
+    cumulative = list(itertools.accumulate(1 / (i + 1) for i in range(vocabulary)))
+    for i in range(count):
+        yield {
+            "name": f"item {i}",
+            "description": " ".join(rng.choices(words, cum_weights=cumulative, k=words_per_item)),
+            "price": 1.0,
+        }
+
+
+def time_call(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        function()
+        timings.append(time.perf_counter_ns() - start)
+    return statistics.median(timings) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=1_000_000)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--words", type=int, default=12)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    items = list(make_items(args.items, args.vocabulary, args.words))
+    index = SearchIndex()
+    start = time.perf_counter()
+    for item in items:
+        index.add(item)
+    elapsed = time.perf_counter() - start
+    print(f"indexed {len(index)} items in {elapsed:.1f}s, {1e6 * elapsed / len(index):.1f}us per item, {len(index.terms)} terms")
+
+    token_sets = [set(tokenize(item["name"] + " " + item["description"])) for item in items]
+    for label, ranks in QUERIES:
+        terms = [f"w{rank}" for rank in ranks]
+        wanted = set(terms)
+        sizes = "/".join(str(len(index.terms.get(term, ()))) for term in terms)
+        for mode in ("and", "or"):
+            searched = time_call(lambda: index.search(terms, mode, 10), args.repeats)
+            if mode == "and":
+                scan = time_call(lambda: [i for i, tokens in enumerate(token_sets) if wanted <= tokens], 3)
+            else:
+                scan = time_call(lambda: [i for i, tokens in enumerate(token_sets) if not wanted.isdisjoint(tokens)], 3)
+            print(f"{label:16} {mode:3}  postings {sizes:28}  index {searched:10.1f}us  scan {scan:12.1f}us  {scan / searched:8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
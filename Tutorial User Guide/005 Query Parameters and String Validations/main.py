@@ -1,8 +1,29 @@
 from fastapi import FastAPI, Query
-from typing import Annotated
+from pydantic import BaseModel
+from typing import Annotated, Literal
+
+from search_index import SearchIndex
+
+
+class Item(BaseModel):
+    name: str
+    description: str | None = None
+    price: float
+    tax: float | None = None
+
 
 app = FastAPI()
 
+# every item created is added to an inverted index of the words in its name and description, so searching for many
+# words at once only looks at the items that have those words
+search_index = SearchIndex()
+for item in [
+    Item(name="Foo", description="The pretender", price=42.0, tax=3.2),
+    Item(name="Bar", description="The bartenders", price=62.0, tax=20.2),
+    Item(name="Baz", description="There goes my hero", price=50.2),
+]:
+    search_index.add(item.model_dump())
+
 @app.get("/items/")
 async def return_items(q: str | None = None):
     results = {"items": [{"item_id": "Foo"}, {"item_id": "Bar"}]}
@@ -21,11 +42,30 @@ async def read_items(q: Annotated[str | None, Query(min_length=10, max_length=50
 
 
 # Query parameter list / multiple values
+# every q is searched for: with mode=and an item has to have all of them, with mode=or any of them. the best matches
+# come first
 @app.get("/items_2/")
-async def read_items_2(q: Annotated[list[str] | None, Query()] = None):
-    query_items = {"q":q}
+async def read_items_2(
+    q: Annotated[list[str] | None, Query()] = None,
+    mode: Literal["and", "or"] = "and",
+    limit: Annotated[int, Query(ge=1, le=100)] = 10,
+):
+    query_items = {"q":q, "items": []}
+    if q:
+        query_items["items"] = [{**item, "score": round(score, 4)} for score, item in search_index.search(q, mode, limit)]
     return query_items
 
+
+# the create_item route from the request body tutorial. the new item is added to the search index straight away
+@app.post("/items/")
+async def create_item(item: Item):
+    item_dict = item.model_dump()
+    if item.tax:
+        price_with_tax = item.price + item.tax
+        item_dict.update({"price_with_tax": price_with_tax})
+    search_index.add(item_dict)
+    return item_dict
+
 # with defaults
 # async def read_items_2(q: Annotated[list[str] | None, Query()] = ["Foo", "Bar"]):
 
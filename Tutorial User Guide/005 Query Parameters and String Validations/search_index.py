@@ -0,0 +1,179 @@
+import bisect
+import heapq
+import math
+import re
+from array import array
+
+WORD = re.compile(r"\w+")
+
+# BM25 ranking parameters: how quickly repeats of a term stop counting and how much long documents are penalised
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    return WORD.findall(text.lower())
+
+
+# the documents that contain one term, as a sorted array of document numbers with the number of times the term is in
+# each one alongside. documents are numbered in the order they are added, so adding one only ever appends. the most
+# times the term is in any one document and the shortest document it is in are kept too, as between them they give the
+# highest score the term can add to any document
+class Postings:
+    __slots__ = ("docs", "counts", "max_count", "min_length")
+
+    def __init__(self):
+        self.docs = array("I")
+        self.counts = array("H")
+        self.max_count = 0
+        self.min_length = 0
+
+    def append(self, doc: int, count: int, length: int):
+        count = min(count, 0xFFFF)
+        if not self.docs or length < self.min_length:
+            self.min_length = length
+        self.max_count = max(self.max_count, count)
+        self.docs.append(doc)
+        self.counts.append(count)
+
+    def __len__(self):
+        return len(self.docs)
+
+
+# an in memory inverted index over the text fields of the items. each term maps to its postings, and a query only
+# touches the postings of its own terms, so it costs the same however many items there are that do not match.
+#
+# only the best k matches are wanted, so both ways keep them in a heap and skip what can not beat the worst of them,
+# using the highest score each term can add:
+#   AND  walks the shortest postings list and looks each document up in the others with a binary search that starts
+#        where the last one left off. a document whose score so far plus the most the other terms could add is not
+#        above the heap is dropped without looking it up any further
+#   OR   takes the terms from the one that can add the most, usually the rarest, and scores each document it has not
+#        seen yet in full. once the most the terms still to come could add between them is below the heap, no
+#        document that is only in those can get in and their postings are not read at all
+# ties go to the item that was added first
+class SearchIndex:
+    def __init__(self, fields=("name", "description")):
+        self.fields = fields
+        self.terms: dict[str, Postings] = {}
+        self.documents: list[dict] = []
+        self.lengths = array("I")
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, document: dict) -> int:
+        doc = len(self.documents)
+        tokens = []
+        for field in self.fields:
+            if document.get(field):
+                tokens.extend(tokenize(str(document[field])))
+
+        counts: dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, count in counts.items():
+            postings = self.terms.get(term)
+            if postings is None:
+                postings = self.terms[term] = Postings()
+            postings.append(doc, count, len(tokens))
+
+        self.documents.append(document)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        return doc
+
+    def weight(self, postings: Postings) -> float:
+        frequency = len(postings)
+        return math.log(1 + (len(self.documents) - frequency + 0.5) / (frequency + 0.5))
+
+    def score(self, idf: float, count: int, length: int, average_length: float) -> float:
+        return idf * count * (K1 + 1) / (count + K1 * (1 - B + B * length / average_length))
+
+    def bound(self, postings: Postings, idf: float, average_length: float) -> float:
+        return self.score(idf, postings.max_count, postings.min_length, average_length)
+
+    def search(self, terms: list[str], mode: str = "and", limit: int = 10) -> list[tuple[float, dict]]:
+        query = sorted({token for term in terms for token in tokenize(term)})
+        if not query or not self.documents or limit < 1:
+            return []
+        postings = [self.terms.get(term) for term in query]
+        average_length = max(self.total_length / len(self.documents), 1)
+
+        if mode == "and":
+            if any(p is None for p in postings):
+                return []
+            best = self.intersect(postings, limit, average_length)
+        else:
+            best = self.union([p for p in postings if p is not None], limit, average_length)
+        return [(score, self.documents[-negated]) for score, negated in sorted(best, reverse=True)]
+
+    # the heap holds (score, -doc), so of two documents with the same score the one added first is kept
+    def keep(self, best: list, limit: int, score: float, doc: int):
+        if len(best) < limit:
+            heapq.heappush(best, (score, -doc))
+        else:
+            heapq.heappushpop(best, (score, -doc))
+
+    def intersect(self, postings: list[Postings], limit: int, average_length: float) -> list:
+        postings = sorted(postings, key=len)
+        weights = [self.weight(p) for p in postings]
+        bounds = [self.bound(p, idf, average_length) for p, idf in zip(postings, weights)]
+        # the most the terms after each one could add, and the most all the other terms could
+        rest = [sum(bounds[i + 2 :]) for i in range(len(postings) - 1)]
+        others_bound = sum(bounds[1:])
+        shortest, others = postings[0], postings[1:]
+        lengths = self.lengths
+        starts = [0] * len(others)
+        best = []
+        for position, doc in enumerate(shortest.docs):
+            length = lengths[doc]
+            score = self.score(weights[0], shortest.counts[position], length, average_length)
+            if len(best) == limit and score + others_bound <= best[0][0]:
+                continue
+            for i, other in enumerate(others):
+                found = bisect.bisect_left(other.docs, doc, starts[i])
+                if found == len(other.docs):
+                    return best
+                starts[i] = found
+                if other.docs[found] != doc:
+                    break
+                score += self.score(weights[i + 1], other.counts[found], length, average_length)
+                if len(best) == limit and score + rest[i] <= best[0][0]:
+                    break
+            else:
+                self.keep(best, limit, score, doc)
+        return best
+
+    def union(self, postings: list[Postings], limit: int, average_length: float) -> list:
+        weights = [self.weight(p) for p in postings]
+        bounds = [self.bound(p, idf, average_length) for p, idf in zip(postings, weights)]
+        order = sorted(range(len(postings)), key=bounds.__getitem__, reverse=True)
+        postings = [postings[i] for i in order]
+        weights = [weights[i] for i in order]
+        # the most the terms from each one on could add to a document between them
+        remaining = [sum(bounds[i] for i in order[j:]) for j in range(len(order))] + [0.0]
+        lengths = self.lengths
+        seen = set()
+        best = []
+        for i, current in enumerate(postings):
+            if len(best) == limit and remaining[i] < best[0][0]:
+                break
+            later = postings[i + 1 :]
+            starts = [0] * len(later)
+            for position, doc in enumerate(current.docs):
+                if doc in seen:
+                    continue
+                seen.add(doc)
+                length = lengths[doc]
+                score = self.score(weights[i], current.counts[position], length, average_length)
+                if len(best) == limit and score + remaining[i + 1] < best[0][0]:
+                    continue
+                for j, other in enumerate(later):
+                    found = bisect.bisect_left(other.docs, doc, starts[j])
+                    starts[j] = found
+                    if found < len(other.docs) and other.docs[found] == doc:
+                        score += self.score(weights[i + 1 + j], other.counts[found], length, average_length)
+                self.keep(best, limit, score, doc)
+        return best
@@ -1,10 +1,16 @@
 from typing import Annotated
 
+from typing_extensions import NotRequired, TypedDict
+
 from fastapi import Body, FastAPI, Path
 from pydantic import BaseModel
 
+from compiled_json import CompiledJSONRoute
+
 
 app = FastAPI()
+# responses are written straight to JSON by serializers compiled from each route's response_model
+app.router.route_class = CompiledJSONRoute
 
 
 class Item(BaseModel):
@@ -18,13 +24,24 @@ class User(BaseModel):
     username: str
     full_name: str | None = None
 
+
+# what the routes send back. each one fills in some of these keys and only those are in the response. a TypedDict
+# rather than a model with response_model_exclude_unset, which would leave out the fields the client left out of the
+# item and the user too
+class ItemResult(TypedDict):
+    item_id: int
+    q: NotRequired[str]
+    item: NotRequired[Item]
+    user: NotRequired[User]
+    importance: NotRequired[int]
+
 # {
 #     "name": "Foo",
 #     "description": "The pretender",
 #     "price": 42.0,
 #     "tax": 3.2
 # }
-@app.put('/items/{item_id}')
+@app.put('/items/{item_id}', response_model=ItemResult)
 async def update_item(
     item_id: Annotated[int, Path(title="The ID of the item to get", ge=0, le=1000)],
     q: str | None = None,
@@ -51,7 +68,7 @@ async def update_item(
 #         "full_name": "Dave Grohl"
 #     }
 # }
-@app.put("/{item_id}")
+@app.put("/{item_id}", response_model=ItemResult)
 async def update_item_2(item_id: int, item: Item, user: User):
     results = {"item_id": item_id, "item":item, "user": user}
     return results
@@ -71,14 +88,14 @@ async def update_item_2(item_id: int, item: Item, user: User):
 #     },
 #     "importance": 5
 # }
-@app.put("/{item_id}")
+@app.put("/{item_id}", response_model=ItemResult)
 async def update_item_2(item_id: int, item: Item, user: User, importance: Annotated[int, Body()]):
     results = {"item_id": item_id, "item":item, "user": user, "importance": importance }
     return results
 
 
 # Multiple body params and query
-@app.put("/items/{item_id}")
+@app.put("/items/{item_id}", response_model=ItemResult)
 async def update_item(
     *,
     item_id: int,
@@ -94,7 +111,7 @@ async def update_item(
 
 
 # Embed a single body parameter
-@app.put("/items/{item_id}")
+@app.put("/items/{item_id}", response_model=ItemResult)
 async def update_item(item_id: int, item: Annotated[Item, Body(embed=True)]):
     results = {"item_id": item_id, "item": item}
     return results
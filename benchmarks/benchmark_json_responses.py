@@ -0,0 +1,129 @@
+# benchmark for the compiled JSON responses of Tutorial 004 and 007. every route is put in three apps and timed in each:
+#   dict            the route as it was, with no response_model, so FastAPI walks the dict of models it returns with
+#                   jsonable_encoder and then encodes the result with json.dumps
+#   response_model  FastAPI's own handling of the response_model: the models are dumped to dicts, validated into the
+#                   response_model, serialized back to python and then encoded with json.dumps
+#   compiled        the app as it is, with CompiledJSONRoute writing JSON bytes with a serializer made from the
+#                   response_model when the route was added
+# the requests are sent to the ASGI app directly, without httpx or a server, so what is left is the cost of the app.
+# the memory each request allocates at its peak is measured with tracemalloc. run it from the top of the repository:
+#   python benchmarks/benchmark_json_responses.py
+#   python benchmarks/benchmark_json_responses.py --requests 50000
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+
+from benchmark_suite import ITEM, TUTORIAL_DIRECTORY, LoadedApp
+
+USER = {'username': 'dave', 'full_name': 'Dave Grohl'}
+
+ROUTES = [
+    ('004 Request Body', 'PUT', '/items/5', b'q=bar', ITEM),
+    ('004 Request Body', 'POST', '/items/', b'', ITEM),
+    ('007 Body Multiple Parameters', 'PUT', '/items/5', b'q=bar', ITEM),
+    ('007 Body Multiple Parameters', 'PUT', '/5', b'', {'item': ITEM, 'user': USER}),
+]
+
+
+# the same routes in a new app, with or without their response_model, made the way FastAPI makes them
+def rebuild(app, with_response_model):
+    rebuilt = FastAPI()
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        rebuilt.router.add_api_route(
+            route.path, route.endpoint, methods=list(route.methods), route_class_override=APIRoute,
+            response_model=route.response_model if with_response_model else None,
+            response_model_exclude_unset=route.response_model_exclude_unset,
+        )
+    return rebuilt
+
+
+def requestOf(method, path, query, body):
+    content = json.dumps(body).encode()
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query, 'root_path': '',
+        'headers': [(b'host', b'benchmark'), (b'content-type', b'application/json'), (b'content-length', str(len(content)).encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('benchmark', 80),
+    }
+    return scope, content
+
+
+async def call(app, scope, content):
+    messages = [{'type': 'http.request', 'body': content, 'more_body': False}]
+    response = {}
+
+    async def receive():
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'] = response.get('body', b'') + message.get('body', b'')
+
+    await app(scope, receive, send)
+    return response
+
+
+async def measure(app, scope, content, requests, alloc_requests):
+    response = await call(app, scope, content)
+    for i in range(200):
+        await call(app, scope, content)
+
+    start = time.perf_counter()
+    for i in range(requests):
+        await call(app, scope, content)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        peaks = []
+        for i in range(alloc_requests):
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await call(app, scope, content)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return response, requests / elapsed, 1e6 * elapsed / requests, sum(peaks) / len(peaks) / 1024
+
+
+async def benchmark(settings):
+    for folder, method, path, query, body in ROUTES:
+        with LoadedApp(os.path.join(TUTORIAL_DIRECTORY, folder)) as main:
+            apps = [
+                ('dict', rebuild(main.app, False)),
+                ('response_model', rebuild(main.app, True)),
+                ('compiled', main.app),
+            ]
+            scope, content = requestOf(method, path, query, body)
+            bodies = set()
+            baseline = None
+            for label, app in apps:
+                response, throughput, micros, peak = await measure(app, scope, content, settings.requests, settings.alloc_requests)
+                bodies.add(json.dumps(json.loads(response['body']), sort_keys=True))
+                baseline = baseline or throughput
+                print('{:30} {:4} {:10} {:15} {:8.0f} req/s {:8.1f}us {:6.2f}x  {:6.1f}KiB/req  {}'.format(
+                    folder, method, path, label, throughput, micros, throughput / baseline, peak, response['status']))
+            if len(bodies) > 1:
+                print('  the responses differ: {}'.format(sorted(bodies)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--alloc-requests', type=int, default=500)
+    settings = parser.parse_args()
+    asyncio.run(benchmark(settings))
+
+
+if __name__ == '__main__':
+    main()
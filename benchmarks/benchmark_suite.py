@@ -0,0 +1,461 @@
+# benchmark suite for every app in the repository. each app is imported in this process and driven through the ASGI
+# interface with httpx, so no server or network is involved and the numbers are the cost of the app itself. for every
+# route it reports the latency percentiles and throughput at each concurrency, the memory allocated per request and the
+# resident size of the process, and it can write all of that to a JSON file that a later run is compared against:
+#   python benchmarks/benchmark_suite.py --output baseline.json
+#   python benchmarks/benchmark_suite.py --compare baseline.json
+#   python benchmarks/benchmark_suite.py Example09 "Tutorial 004" --concurrency 1 16 64 --requests 5000
+# the examples that use firestore are given the in memory stand in from fake_firestore.py for their user and address
+# documents and a fixed login, so the logged in pages are measured without the emulator or firebase. the routes that
+# need queries, batches, transactions or cloud storage are only run when the emulators are set, for example
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 STORAGE_EMULATOR_HOST=http://localhost:4443 GOOGLE_CLOUD_PROJECT=demo
+# and are listed as skipped otherwise. the startup events only run against the emulators, the shutdown events always
+# run so that anything an app started while it was measured is stopped before the next app is loaded
+import argparse
+import asyncio
+import datetime
+import importlib.util
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import httpx
+
+import fake_firestore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TUTORIAL_DIRECTORY = os.path.join(ROOT, 'Tutorial User Guide')
+EXAMPLE_DIRECTORY = os.path.join(ROOT, 'Google App Engine 9 Python By Example')
+
+# work out which emulators we have before we put in the place holders below. the clients are made when the examples
+# are imported and they need a project and somewhere to point even when the fake is what they end up using
+EMULATORS = {
+    'firestore': 'FIRESTORE_EMULATOR_HOST' in os.environ,
+    'storage': 'STORAGE_EMULATOR_HOST' in os.environ,
+}
+os.environ.setdefault('GOOGLE_CLOUD_PROJECT', 'benchmark')
+os.environ.setdefault('FIRESTORE_EMULATOR_HOST', 'localhost:1')
+os.environ.setdefault('STORAGE_EMULATOR_HOST', 'http://localhost:1')
+
+# the login every logged in request has. the examples check the firebase token in their getUserToken dependency and
+# that is replaced with one that returns this
+USER_TOKEN = {'user_id': 'benchmark-user', 'email': 'benchmark@example.com', 'name': 'Benchmark User'}
+
+# the metrics routes are for admins only, so the benchmark login is made one
+os.environ.setdefault('PROFILER_ADMINS', USER_TOKEN['email'])
+
+ITEM = {'name': 'Foo', 'description': 'The pretender', 'price': 42.0, 'tax': 3.2}
+ITEMS_NDJSON = '\n'.join(json.dumps(dict(ITEM, name='Item {}'.format(i))) for i in range(100))
+ADDRESS = {'address1': '1 Main Street', 'address2': 'Dublin', 'address3': 'Ireland', 'address4': 'D01'}
+
+
+# one request to benchmark. the path can be a function of the imported main module for paths only the app knows, like
+# the hashed name of a static file. a conditional route sends the ETag the route gave the first time, so it measures
+# the 304 path. needs lists the emulators the route can not run without
+class Route:
+    def __init__(self, method, path, name=None, login=False, needs=(), expect=200, conditional=False, **kwargs):
+        self.method = method
+        self.path = path
+        self.name = name or '{} {}'.format(method, path)
+        self.login = login
+        self.needs = needs
+        self.expect = expect
+        self.conditional = conditional
+        self.kwargs = kwargs
+
+    def request(self, main, headers=None):
+        path = self.path(main) if callable(self.path) else self.path
+        kwargs = dict(self.kwargs)
+        if headers:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **headers)
+        return self.method, path, kwargs
+
+
+def staticFile(main):
+    return '/static/' + main.static_files.fingerprint('style.css')
+
+
+STATIC = Route('GET', staticFile, name='GET /static/style.css', headers={'accept-encoding': 'gzip, br'})
+
+
+def exampleRoutes(*routes):
+    return [
+        Route('GET', '/', name='GET / (logged out)'),
+        STATIC,
+        Route('GET', '/', name='GET / (logged in)', login=True),
+        Route('GET', '/', name='GET / (logged in, 304)', login=True, conditional=True, expect=304),
+    ] + list(routes)
+
+
+APPS = {
+    'Tutorial 001': (os.path.join(TUTORIAL_DIRECTORY, '001 First Steps'), [
+        Route('GET', '/'),
+    ]),
+    'Tutorial 002': (os.path.join(TUTORIAL_DIRECTORY, '002 Path Parameters'), [
+        Route('GET', '/items/5'),
+        Route('GET', '/users/me'),
+        Route('GET', '/users/7'),
+        Route('GET', '/models/alexnet'),
+        Route('POST', '/models/resnet', json={'values': [0.5] * 64}),
+        Route('GET', '/files/home/johndoe/myfile.txt'),
+    ]),
+    'Tutorial 003': (os.path.join(TUTORIAL_DIRECTORY, '003 Query Parameters'), [
+        Route('GET', '/items/', params={'skip': 0, 'limit': 2}),
+        Route('GET', '/items/', name='GET /items/ (after)', params={'after': 'WyJpdGVtLTAwMSJd', 'limit': 2}),
+        Route('GET', '/items_2/item-002', params={'q': 'bar'}),
+        Route('GET', '/items_3/foo', params={'q': 'bar', 'short': 'false'}),
+        Route('GET', '/users/1/items/item-001', params={'q': 'bar'}),
+        Route('GET', '/items_4/foo', params={'needy': 'soneedy'}),
+    ]),
+    'Tutorial 004': (os.path.join(TUTORIAL_DIRECTORY, '004 Request Body'), [
+        Route('POST', '/items/', json=ITEM),
+        Route('PUT', '/items/5', json=ITEM, params={'q': 'bar'}),
+        Route('POST', '/items/bulk', name='POST /items/bulk (100 items)', content=ITEMS_NDJSON, headers={'content-type': 'application/x-ndjson'}),
+    ]),
+    'Tutorial 005': (os.path.join(TUTORIAL_DIRECTORY, '005 Query Parameters and String Validations'), [
+        Route('GET', '/items/', params={'q': 'fixedquery'}),
+        Route('GET', '/items_2/', params={'q': ['foo', 'bar']}),
+        Route('GET', '/items_2/', name='GET /items_2/ (or)', params={'q': ['the', 'hero'], 'mode': 'or'}),
+        Route('POST', '/items/', json=ITEM),
+    ]),
+    'Tutorial 006': (os.path.join(TUTORIAL_DIRECTORY, '006 Path Parameters and Numeric Validations'), [
+        Route('GET', '/items/5', params={'item-query': 'bar'}),
+    ]),
+    'Tutorial 007': (os.path.join(TUTORIAL_DIRECTORY, '007 Body Multiple Parameters'), [
+        Route('PUT', '/items/5', json=ITEM, params={'q': 'bar'}),
+        Route('PUT', '/5', json={'item': ITEM, 'user': {'username': 'dave', 'full_name': 'Dave Grohl'}}),
+    ]),
+    'Example01': (os.path.join(EXAMPLE_DIRECTORY, 'Example01'), [
+        Route('GET', '/'),
+    ]),
+    'Example02': (os.path.join(EXAMPLE_DIRECTORY, 'Example02'), [
+        Route('GET', '/'),
+        STATIC,
+    ]),
+    'Example03': (os.path.join(EXAMPLE_DIRECTORY, 'Example03'), [
+        Route('GET', '/', name='GET / (logged out)'),
+        STATIC,
+    ]),
+    'Example04': (os.path.join(EXAMPLE_DIRECTORY, 'Example04'), exampleRoutes(
+        Route('GET', '/update-user', login=True),
+        Route('POST', '/update-user', login=True, expect=302, data={'name': 'John Doe', 'age': '42'}),
+    )),
+    'Example05': (os.path.join(EXAMPLE_DIRECTORY, 'Example05'), exampleRoutes()),
+    'Example06': (os.path.join(EXAMPLE_DIRECTORY, 'Example06'), exampleRoutes(
+        Route('POST', '/add-address', login=True, expect=302, data=ADDRESS),
+    )),
+    'Example07': (os.path.join(EXAMPLE_DIRECTORY, 'Example07'), exampleRoutes(
+        Route('POST', '/add-address', login=True, expect=302, data=ADDRESS),
+    )),
+    'Example08': (os.path.join(EXAMPLE_DIRECTORY, 'Example08'), [
+        Route('GET', '/', name='GET / (logged out)'),
+        STATIC,
+        Route('GET', '/transaction-metrics', login=True),
+        Route('GET', '/', name='GET / (logged in)', login=True, needs=('firestore',)),
+        Route('GET', '/', name='GET / (logged in, 304)', login=True, needs=('firestore',), conditional=True, expect=304),
+        Route('POST', '/batch-add', login=True, needs=('firestore',), expect=302),
+        Route('POST', '/transaction-add', login=True, needs=('firestore',), expect=302),
+    ]),
+    'Example09': (os.path.join(EXAMPLE_DIRECTORY, 'Example09'), [
+        Route('GET', '/', name='GET / (logged out)'),
+        STATIC,
+        Route('GET', '/query-cache-metrics', login=True),
+        Route('POST', '/initialise', login=True, needs=('firestore',), expect=302),
+        Route('GET', '/', name='GET / (logged in)', login=True, needs=('firestore',)),
+        Route('POST', '/filter-by-number', login=True, needs=('firestore',), data={'num': '5'}),
+        Route('POST', '/filter-by-both', login=True, needs=('firestore',), data={'num': '5', 'textinput': 'f'}),
+    ]),
+    'Example10': (os.path.join(EXAMPLE_DIRECTORY, 'Example10'), [
+        Route('GET', '/', name='GET / (logged out)'),
+        STATIC,
+        Route('GET', '/storage-metrics', login=True),
+        Route('GET', '/', name='GET / (logged in)', login=True, needs=('firestore', 'storage')),
+    ]),
+}
+
+
+# import main.py from an app folder. the examples import their other modules by name and several examples have modules
+# with the same names, so whatever an app imported from its folder is taken out of sys.modules again when we are done
+# with it. the apps also open their templates and static files relative to their folder so we stay in it meanwhile
+class LoadedApp:
+    def __init__(self, directory):
+        self.directory = directory
+        self.cwd = os.getcwd()
+        self.modules = set(sys.modules)
+
+    def __enter__(self):
+        os.chdir(self.directory)
+        sys.path.insert(0, self.directory)
+        spec = importlib.util.spec_from_file_location('main', os.path.join(self.directory, 'main.py'))
+        self.main = importlib.util.module_from_spec(spec)
+        sys.modules['main'] = self.main
+        spec.loader.exec_module(self.main)
+        return self.main
+
+    def __exit__(self, *exc_info):
+        for name in set(sys.modules) - self.modules:
+            filename = getattr(sys.modules[name], '__file__', None) or ''
+            if name == 'main' or os.path.abspath(filename).startswith(self.directory + os.sep):
+                del sys.modules[name]
+        sys.path.remove(self.directory)
+        os.chdir(self.cwd)
+
+
+# point an example at the fake firestore and give it the login the route wants. the dependencies look firestore_db up
+# when they run so swapping the module global is enough for the user repository and the reference resolver
+def useFakes(main, route, fake):
+    if usesFake(main):
+        main.firestore_db = fake
+    if hasattr(main, 'getUserToken'):
+        user_token = USER_TOKEN if route.login else None
+
+        async def getUserToken():
+            return user_token
+        main.app.dependency_overrides[main.getUserToken] = getUserToken
+
+
+def usesFake(main):
+    return not EMULATORS['firestore'] and hasattr(main, 'firestore_db')
+
+
+# the firestore calls and the documents read and written per request between two readings of the fake's counts. with
+# the emulator there is nothing counting them and they are left out
+def firestoreCounts(before, after, requests):
+    rpcs, read, written = (now - then for now, then in zip(after, before))
+    return {
+        'firestore_rpcs': rpcs / requests,
+        'firestore_reads': read / requests,
+        'firestore_writes': written / requests,
+    }
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def residentMiB():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+def maxResidentMiB():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+
+async def send(client, route, main, headers):
+    method, path, kwargs = route.request(main, headers)
+    return await client.request(method, path, **kwargs)
+
+
+# send the requests from a number of workers that each keep one request in flight, so there are never more than
+# concurrency requests running at once. the workers take their requests from the same counter
+async def drive(client, route, main, headers, requests, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            start = time.perf_counter()
+            response = await send(client, route, main, headers)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != route.expect:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'throughput': requests / elapsed,
+        'mean_ms': 1e3 * sum(latencies) / len(latencies),
+        'p50_ms': 1e3 * percentile(latencies, 50),
+        'p95_ms': 1e3 * percentile(latencies, 95),
+        'p99_ms': 1e3 * percentile(latencies, 99),
+    }
+
+
+# memory allocated per request, one request at a time so each peak belongs to a single request. the peak is how far the
+# traced memory went above where it was when the request started. what is still allocated once all of them have
+# finished is reported as well, as a route that keeps growing it is holding on to something
+async def allocations(client, route, main, headers, requests):
+    tracemalloc.start()
+    try:
+        await send(client, route, main, headers)
+        before = tracemalloc.take_snapshot()
+        peaks = []
+        for i in range(requests):
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await send(client, route, main, headers)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    differences = after.compare_to(before, 'filename')
+    return {
+        'alloc_peak_kib': sum(peaks) / len(peaks) / 1024,
+        'retained_kib': sum(difference.size_diff for difference in differences) / 1024,
+        'retained_blocks': sum(difference.count_diff for difference in differences),
+    }
+
+
+async def benchmarkRoute(main, route, fake, settings):
+    fake.reset()
+    useFakes(main, route, fake)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app, raise_app_exceptions=False), base_url='http://benchmark') as client:
+        headers = None
+        if route.conditional:
+            method, path, kwargs = route.request(main)
+            etag = (await client.request(method, path, **kwargs)).headers.get('etag')
+            headers = {'if-none-match': etag} if etag else None
+
+        for i in range(settings.warmup):
+            await send(client, route, main, headers)
+
+        results = []
+        for concurrency in settings.concurrency:
+            before = fake.counts()
+            result = await drive(client, route, main, headers, settings.requests, concurrency)
+            result['rss_mib'] = residentMiB()
+            if usesFake(main):
+                result.update(firestoreCounts(before, fake.counts(), settings.requests))
+            results.append(result)
+
+        memory = await allocations(client, route, main, headers, settings.alloc_requests) if settings.alloc_requests else {}
+    for result in results:
+        result.update(memory)
+    return results
+
+
+async def benchmarkApp(name, directory, routes, settings, report):
+    fake = fake_firestore.FakeFirestore()
+    with LoadedApp(directory) as main:
+        emulated = any(EMULATORS.values()) and hasattr(main, 'firestore_db')
+        if emulated:
+            await main.app.router.startup()
+        try:
+            for route in routes:
+                missing = [service for service in route.needs if not EMULATORS[service]]
+                if missing:
+                    report['skipped'].append('{} {} (needs the {} emulator{})'.format(name, route.name, ' and '.join(missing), 's' if len(missing) > 1 else ''))
+                    continue
+                for result in await benchmarkRoute(main, route, fake, settings):
+                    key = '{} {} c{}'.format(name, route.name, result['concurrency'])
+                    report['results'][key] = result
+                    printResult(key, result)
+        finally:
+            main.app.dependency_overrides.clear()
+            await main.app.router.shutdown()
+
+
+def printResult(key, result):
+    line = '{:60} {:>9.0f} req/s  p50 {:7.2f}ms  p95 {:7.2f}ms  p99 {:7.2f}ms'.format(
+        key, result['throughput'], result['p50_ms'], result['p95_ms'], result['p99_ms'])
+    if 'alloc_peak_kib' in result:
+        line += '  {:8.1f}KiB/req'.format(result['alloc_peak_kib'])
+    if 'firestore_rpcs' in result:
+        line += '  firestore {:4.1f} rpc {:4.1f} read {:4.1f} write/req'.format(
+            result['firestore_rpcs'], result['firestore_reads'], result['firestore_writes'])
+    if result['errors']:
+        line += '  {} errors'.format(result['errors'])
+    print(line)
+
+
+# compare a run against a baseline. a route has regressed if its p95 or its allocations went up, or its throughput
+# went down, by more than the threshold. the firestore counts do not vary from run to run, so any call or document
+# more per request than before is a regression. returns the number of regressions
+def compare(report, baseline, threshold):
+    regressions = 0
+    for key, result in report['results'].items():
+        before = baseline['results'].get(key)
+        if before is None:
+            continue
+        checks = [
+            ('p95_ms', result['p95_ms'] > before['p95_ms'] * (1 + threshold)),
+            ('throughput', result['throughput'] < before['throughput'] * (1 - threshold)),
+        ]
+        if 'alloc_peak_kib' in result and 'alloc_peak_kib' in before:
+            checks.append(('alloc_peak_kib', result['alloc_peak_kib'] > before['alloc_peak_kib'] * (1 + threshold)))
+        for metric in ('firestore_rpcs', 'firestore_reads', 'firestore_writes'):
+            if metric in result and metric in before:
+                checks.append((metric, result[metric] > before[metric] + 0.01))
+        for metric, regressed in checks:
+            if regressed:
+                regressions += 1
+                print('REGRESSION {:60} {} {:.2f} -> {:.2f}'.format(key, metric, before[metric], result[metric]))
+    missing = sorted(set(baseline['results']) - set(report['results']))
+    for key in missing:
+        print('not run    {}'.format(key))
+    return regressions
+
+
+async def run(settings):
+    report = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'emulators': EMULATORS,
+        'settings': {
+            'requests': settings.requests,
+            'concurrency': settings.concurrency,
+            'warmup': settings.warmup,
+            'alloc_requests': settings.alloc_requests,
+        },
+        'results': {},
+        'skipped': [],
+    }
+    for name, (directory, routes) in APPS.items():
+        if settings.apps and not any(name.startswith(app) for app in settings.apps):
+            continue
+        await benchmarkApp(name, directory, routes, settings, report)
+    report['max_rss_mib'] = maxResidentMiB()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('apps', nargs='*', help='only run the apps whose names start with these')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--alloc-requests', type=int, default=200)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results with this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    settings = parser.parse_args()
+
+    report = asyncio.run(run(settings))
+    for skipped in report['skipped']:
+        print('skipped    {}'.format(skipped))
+
+    if settings.output:
+        with open(settings.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if settings.compare:
+        with open(settings.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, settings.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# in memory stand in for the parts of the async firestore client the examples use for their user and address
+# documents: collection/document, get (with or without a field mask), create, set, update, delete and get_all. it is
+# enough for the routes that read and write a single user, so they can be benchmarked without the emulator. queries,
+# batches and transactions are not here, the routes that need those are only run against the emulator. it counts the
+# calls that would each have been a round trip to firestore and the documents they read and wrote, so the benchmark can
+# report what a route costs in firestore as well as in time
+import collections
+import datetime
+import itertools
+import uuid
+
+from google.api_core import exceptions
+from google.cloud import firestore
+from google.cloud.firestore_v1 import transforms
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocument) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    # snapshots deep copy their data, and a reference in the data must not take the whole store with it
+    def __deepcopy__(self, memo):
+        return self
+
+    def snapshot(self, field_paths=None):
+        stored = self.db.documents.get(self.path)
+        if stored is None:
+            return firestore.DocumentSnapshot(self, None, False, self.db.now(), None, None)
+        data, create_time, update_time = stored
+        if field_paths is not None:
+            data = {key: value for key, value in data.items() if key in field_paths}
+        return firestore.DocumentSnapshot(self, dict(data), True, self.db.now(), create_time, update_time)
+
+    async def get(self, field_paths=None, **kwargs):
+        self.db.count('get', read=1)
+        return self.snapshot(field_paths)
+
+    async def create(self, data):
+        self.db.count('create', written=1)
+        if self.path in self.db.documents:
+            raise exceptions.Conflict('document already exists: {}'.format(self.path))
+        return self.db.write(self.path, dict(data))
+
+    async def set(self, data, merge=False):
+        self.db.count('set', written=1)
+        if merge and self.path in self.db.documents:
+            return self.merge(data)
+        return self.db.write(self.path, dict(data))
+
+    async def update(self, data):
+        self.db.count('update', written=1)
+        return self.merge(data)
+
+    def merge(self, data):
+        stored = self.db.documents.get(self.path)
+        if stored is None:
+            raise exceptions.NotFound('no document to update: {}'.format(self.path))
+        current = dict(stored[0])
+        for field, value in data.items():
+            if isinstance(value, transforms.ArrayUnion):
+                existing = list(current.get(field) or [])
+                current[field] = existing + [item for item in value.values if item not in existing]
+            elif isinstance(value, transforms.ArrayRemove):
+                current[field] = [item for item in current.get(field) or [] if item not in value.values]
+            elif value is transforms.DELETE_FIELD:
+                current.pop(field, None)
+            else:
+                current[field] = value
+        return self.db.write(self.path, current, stored[1])
+
+    async def delete(self):
+        self.db.count('delete', written=1)
+        self.db.documents.pop(self.path, None)
+        return WriteResult(self.db.now())
+
+
+class FakeCollection:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+
+    def document(self, document_id=None):
+        return FakeDocument(self.db, '{}/{}'.format(self.path, document_id or uuid.uuid4().hex[:20]))
+
+
+# the documents are kept as path -> (data, create time, update time). every write gets a later update time than the
+# one before it, as firestore's do, so the ETags of the pages that show a document change when it is written
+class FakeFirestore:
+    def __init__(self):
+        self.documents = {}
+        self.clock = itertools.count(1)
+        self.epoch = datetime.datetime.now(datetime.timezone.utc)
+        self.rpcs = collections.Counter()
+        self.documents_read = 0
+        self.documents_written = 0
+
+    def count(self, rpc, read=0, written=0):
+        self.rpcs[rpc] += 1
+        self.documents_read += read
+        self.documents_written += written
+
+    # the calls and documents so far, to take away from a later reading
+    def counts(self):
+        return sum(self.rpcs.values()), self.documents_read, self.documents_written
+
+    def now(self):
+        return self.epoch + datetime.timedelta(microseconds=next(self.clock))
+
+    def write(self, path, data, create_time=None):
+        update_time = self.now()
+        self.documents[path] = (data, create_time or update_time, update_time)
+        return WriteResult(update_time)
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def document(self, path):
+        return FakeDocument(self, path)
+
+    async def get_all(self, references, field_paths=None, **kwargs):
+        self.count('get_all')
+        for reference in references:
+            self.documents_read += 1
+            yield FakeDocument(self, reference.path).snapshot(field_paths)
+
+    def reset(self):
+        self.documents.clear()